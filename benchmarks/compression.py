@@ -0,0 +1,104 @@
+"""
+Bandwidth and CPU cost of response compression.
+
+Renders representative JSON payloads, `GET /games` pages of 50 games at several
+move history lengths and a single game, and compresses each with gzip and brotli
+at several levels. Reports compressed size, ratio and compression time per
+response, the defaults used by the app are marked with *.
+
+Usage:
+    python benchmarks/compression.py [--number 50]
+"""
+
+import argparse
+import gzip
+import random
+import timeit
+from datetime import datetime, timezone
+
+import brotli
+from pydantic import TypeAdapter
+
+from chessticulate_api import schemas, serialization
+from chessticulate_api.config import CONFIG
+
+FEN = "rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR b KQkq e3 0 1"
+# plausible SAN moves, real games repeat far less than a fixed opening would
+MOVES = [
+    f"{piece}{capture}{file}{rank}"
+    for piece in ("", "N", "B", "R", "Q", "K")
+    for capture in ("", "x")
+    for file in "abcdefgh"
+    for rank in "12345678"
+]
+
+
+def _page(games: int, moves: int) -> bytes:
+    now = datetime.now(tz=timezone.utc)
+    rng = random.Random(0)
+    page = [
+        schemas.GetGameResponse(
+            id_=i,
+            game_type="chess",
+            date_started=now,
+            last_active=now,
+            invitation_id=i,
+            white=i,
+            black=i + 1,
+            white_username=f"player{i}",
+            black_username=f"player{i + 1}",
+            whomst=i,
+            move_hist=rng.choices(MOVES, k=moves),
+            is_active=True,
+            fen=FEN,
+        )
+        for i in range(games)
+    ]
+    content = TypeAdapter(list[schemas.GetGameResponse]).dump_python(
+        page, mode="json", by_alias=True
+    )
+    return serialization.DefaultResponse(content).body
+
+
+def main(number: int):
+    """run benchmark"""
+    codecs = [
+        (f"gzip {level}", level == CONFIG.compression_gzip_level, gzip.compress, level)
+        for level in (1, 3, 6, 9)
+    ] + [
+        (
+            f"brotli {quality}",
+            quality == CONFIG.compression_brotli_quality,
+            brotli.compress,  # pylint: disable=no-member
+            quality,
+        )
+        for quality in (1, 3, 4, 6, 11)
+    ]
+
+    for name, payload in (
+        ("1 game, 60 moves", _page(1, 60)),
+        ("50 games, 40 moves", _page(50, 40)),
+        ("50 games, 120 moves", _page(50, 120)),
+        ("50 games, 300 moves", _page(50, 300)),
+    ):
+        print(f"\n{name}: {len(payload) / 1024:.1f} KiB")
+        print(f"{'codec':<12}{'KiB':>9}{'ratio':>8}{'us':>10}{'MiB/s':>9}")
+        for codec, default, compress, level in codecs:
+            if codec.startswith("gzip"):
+                run = lambda c=compress, l=level: c(payload, compresslevel=l)
+            else:
+                run = lambda c=compress, l=level: c(payload, quality=l)
+            size = len(run())
+            secs = min(timeit.repeat(run, number=number, repeat=3)) / number
+            print(
+                f"{codec + (' *' if default else ''):<12}{size / 1024:>9.1f}"
+                f"{len(payload) / size:>8.1f}{secs * 1e6:>10.0f}"
+                f"{len(payload) / secs / 2**20:>9.0f}"
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n", maxsplit=1)[0])
+    parser.add_argument("--number", type=int, default=50)
+    args = parser.parse_args()
+    main(args.number)
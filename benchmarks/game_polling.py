@@ -0,0 +1,132 @@
+"""
+Bytes and database reads of clients polling a game.
+
+Seeds a game with a long move history, then simulates a client polling it,
+with a move made every `--move-every` polls. Compares polling the list endpoint
+(`GET /games?game_id=X&include=moves`, the previous way to fetch one game)
+against the single game endpoint (`GET /games/{id}`) sending back the last ETag
+in If-None-Match.
+Reports response body bytes, SQL statements and time per poll, the statement
+counts include the authentication lookup.
+
+Usage:
+    python benchmarks/game_polling.py [--polls 2000] [--move-every 20]
+
+A temporary sqlite file is used unless SQL_CONN_STR is set.
+"""
+
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+from unittest.mock import AsyncMock
+
+if "SQL_CONN_STR" not in os.environ:
+    os.environ["SQL_CONN_STR"] = "sqlite+aiosqlite:///" + os.path.join(
+        tempfile.mkdtemp(), "game_polling.db"
+    )
+
+# pylint: disable=wrong-import-position
+from httpx import ASGITransport, AsyncClient
+from pydantic import SecretStr
+from sqlalchemy import insert
+
+from chessticulate_api import crud, db, migrations, models
+from chessticulate_api.app import app
+from chessticulate_api.config import CONFIG
+
+FEN = "rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR b KQkq e3 0 1"
+
+
+async def _seed(moves: int) -> str:
+    await migrations.migrate()
+    password_hash = await crud.hash_password(SecretStr("pswd"))
+    async with db.async_session() as session:
+        async with session.begin():
+            for i in (1, 2):
+                await crud.create_user(
+                    session, f"benchuser{i}", f"bench{i}@email.com", password_hash
+                )
+            await session.execute(
+                insert(models.Invitation),
+                [{"from_id": 1, "to_id": 2, "game_type": models.GameType.CHESS}],
+            )
+            await session.execute(
+                insert(models.Game),
+                [{"invitation_id": 1, "white": 1, "black": 2, "whomst": 1}],
+            )
+            await session.execute(
+                insert(models.Move),
+                [
+                    {"user_id": 1, "game_id": 1, "movestr": "Nxe4", "fen": FEN}
+                    for _ in range(moves)
+                ],
+            )
+        return await crud.login(session, "benchuser1", SecretStr("pswd"))
+
+
+async def _move():
+    async with db.async_session() as session:
+        async with session.begin():
+            await crud.do_move(session, 1, 1, 2, "Nxe4", "{}", FEN, "MOVEOK")
+
+
+async def _poll(client, path: str, polls: int, move_every: int, conditional: bool):
+    body_bytes = statements = not_modified = 0
+    etag = None
+    elapsed = 0.0
+    for i in range(polls):
+        if i and i % move_every == 0:
+            await _move()
+        headers = {"If-None-Match": etag} if conditional and etag else {}
+        start = time.perf_counter()
+        response = await client.get(path, headers=headers)
+        elapsed += time.perf_counter() - start
+
+        body_bytes += len(response.content)
+        statements += int(response.headers["X-SQL-Queries"])
+        if response.status_code == 304:
+            not_modified += 1
+        etag = response.headers.get("ETag", etag)
+    return body_bytes, statements, not_modified, elapsed
+
+
+async def main(polls: int, move_every: int, moves: int):
+    """run benchmark"""
+    token = await _seed(moves)
+    CONFIG.sql_debug_headers = True
+    app.state.redis = AsyncMock()
+
+    print(f"{polls} polls, a move every {move_every}, {moves}+ move history")
+    print(f"{'endpoint':<36}{'KiB':>10}{'stmts/poll':>12}{'304s':>7}{'ms/poll':>9}")
+    async with AsyncClient(
+        transport=ASGITransport(app=app),
+        base_url="http://bench",
+        headers={"Authorization": f"Bearer {token}"},
+    ) as client:
+        for name, path, conditional in (
+            (
+                "GET /games?game_id=1&include=moves",
+                "/games?game_id=1&include=moves",
+                False,
+            ),
+            ("GET /games/1 + If-None-Match", "/games/1", True),
+        ):
+            body_bytes, statements, not_modified, elapsed = await _poll(
+                client, path, polls, move_every, conditional
+            )
+            print(
+                f"{name:<36}{body_bytes / 1024:>10.1f}{statements / polls:>12.2f}"
+                f"{not_modified:>7}{elapsed / polls * 1000:>9.2f}"
+            )
+    await db.async_engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n", maxsplit=1)[0])
+    parser.add_argument("--polls", type=int, default=2000)
+    parser.add_argument("--move-every", type=int, default=20)
+    parser.add_argument("--moves", type=int, default=80)
+    args = parser.parse_args()
+    asyncio.run(main(args.polls, args.move_every, args.moves))
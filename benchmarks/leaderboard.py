@@ -0,0 +1,137 @@
+"""
+Leaderboard pages and rank lookups, Redis sorted set vs the users table.
+
+Seeds `--users` users with random win counts, builds the leaderboard from them,
+then times pages of the leaderboard at several depths and rank lookups of
+random users, both through `leaderboard.Leaderboard` and with the database
+queries they replace: `GET /users?order_by=wins&reverse=true` pages and a count
+of the users with more wins. Reports the median and 99th percentile latency.
+
+Usage:
+    python benchmarks/leaderboard.py [--users 1000000] [--lookups 200]
+
+A temporary sqlite file is used unless SQL_CONN_STR is set. Needs a Redis
+server at REDIS_URL, the benchmark's keys are deleted afterwards.
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import tempfile
+import time
+
+if "SQL_CONN_STR" not in os.environ:
+    os.environ["SQL_CONN_STR"] = "sqlite+aiosqlite:///" + os.path.join(
+        tempfile.mkdtemp(), "leaderboard.db"
+    )
+
+# pylint: disable=wrong-import-position
+from redis.asyncio import Redis
+from sqlalchemy import func, insert, select
+
+from chessticulate_api import crud, db, leaderboard, migrations, models
+from chessticulate_api.config import CONFIG
+
+KEY = "benchmark:leaderboard"
+
+
+async def _seed(users: int, batch_size: int = 50_000):
+    await migrations.migrate()
+    rng = random.Random(0)
+    for start in range(0, users, batch_size):
+        async with db.async_session() as session:
+            async with session.begin():
+                await session.execute(
+                    insert(models.User),
+                    [
+                        {
+                            "name": f"benchuser{i}",
+                            "password": "x",
+                            # most players win a few games, a few win many
+                            "wins": int(rng.expovariate(1 / 20)),
+                        } for i in range(start, min(start + batch_size, users))
+                    ],
+                )
+
+
+async def _db_page(session, skip: int):
+    return await crud.get_user_rows(
+        session, skip=skip, limit=50, order_by="wins", reverse=True, fields=("wins",)
+    )
+
+
+async def _db_rank(session, user_id: int) -> int:
+    users = models.User.__table__
+    wins = select(users.c.wins).where(users.c.id == user_id).scalar_subquery()
+    # pylint: disable=not-callable
+    above = select(func.count()).where(users.c.wins > wins)
+    return (await session.execute(above)).scalar_one() + 1
+
+
+async def _latencies(lookup, lookup_args: list) -> list[float]:
+    latencies = []
+    for arg in lookup_args:
+        begin = time.perf_counter()
+        await lookup(arg)
+        latencies.append(time.perf_counter() - begin)
+    latencies.sort()
+    return latencies
+
+
+def _report(name: str, latencies: list[float]):
+    print(
+        f"{name:<24}{statistics.median(latencies) * 1000:>9.2f}"
+        f"{latencies[int(len(latencies) * 0.99) - 1] * 1000:>9.2f}"
+    )
+
+
+async def main(users: int, lookups: int):
+    """run benchmark"""
+    start = time.perf_counter()
+    await _seed(users)
+    print(f"seeded {users} users in {time.perf_counter() - start:.1f}s")
+
+    redis = Redis.from_url(CONFIG.redis_url, decode_responses=True)
+    board = leaderboard.Leaderboard(redis, key=KEY)
+    try:
+        start = time.perf_counter()
+        async with db.async_session() as session:
+            ranked = await crud.rebuild_leaderboard(session, board)
+        print(
+            f"built leaderboard of {ranked} users in"
+            f" {time.perf_counter() - start:.1f}s"
+        )
+
+        rng = random.Random(1)
+        user_ids = [rng.randint(1, users) for _ in range(lookups)]
+        print(f"{'lookup':<24}{'p50 ms':>9}{'p99 ms':>9}")
+        async with db.async_session() as session:
+            for depth in (0, ranked // 2, ranked - 50):
+                skips = [max(0, depth)] * lookups
+                _report(
+                    f"page at {depth}, redis",
+                    await _latencies(lambda skip: board.page(skip, 50), skips),
+                )
+                _report(
+                    f"page at {depth}, db",
+                    await _latencies(lambda skip: _db_page(session, skip), skips),
+                )
+            _report("rank, redis", await _latencies(board.rank, user_ids))
+            _report(
+                "rank, db",
+                await _latencies(lambda id_: _db_rank(session, id_), user_ids),
+            )
+    finally:
+        await redis.delete(KEY)
+        await redis.aclose()
+        await db.async_engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n", maxsplit=1)[0])
+    parser.add_argument("--users", type=int, default=1_000_000)
+    parser.add_argument("--lookups", type=int, default=200)
+    args = parser.parse_args()
+    asyncio.run(main(args.users, args.lookups))
@@ -0,0 +1,112 @@
+"""
+ORM vs plain row list queries.
+
+Seeds a database with games that each have a long move history, then builds
+the `GET /games` response page both ways: ORM objects converted with
+`GetGameResponse(**vars(game))`, and the Core rows of `crud.get_game_rows`
+validated straight into `GetGameResponse`. Reports rows per second and the
+peak memory allocated while building one page, at the endpoint's maximum
+limit of 50 and at a raised limit.
+
+Usage:
+    python benchmarks/list_rows.py [--games 2000] [--moves 80]
+
+A temporary sqlite file is used unless SQL_CONN_STR is set.
+"""
+
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+import tracemalloc
+
+if "SQL_CONN_STR" not in os.environ:
+    os.environ["SQL_CONN_STR"] = "sqlite+aiosqlite:///" + os.path.join(
+        tempfile.mkdtemp(), "list_rows.db"
+    )
+
+# pylint: disable=wrong-import-position
+from sqlalchemy import insert
+
+from chessticulate_api import crud, db, models, schemas
+
+FEN = "rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR b KQkq e3 0 1"
+
+
+async def _seed(games: int, moves: int):
+    await models.init_db()
+    async with db.async_session() as session:
+        async with session.begin():
+            await session.execute(
+                insert(models.User),
+                [{"name": f"benchuser{i}", "password": "x"} for i in (1, 2)],
+            )
+            await session.execute(
+                insert(models.Invitation),
+                [{"from_id": 1, "to_id": 2, "game_type": models.GameType.CHESS}],
+            )
+            await session.execute(
+                insert(models.Game),
+                [
+                    {"invitation_id": 1, "white": 1, "black": 2, "whomst": 1}
+                    for _ in range(games)
+                ],
+            )
+            await session.execute(
+                insert(models.Move),
+                [
+                    {"user_id": 1, "game_id": g, "movestr": "Nxe4", "fen": FEN}
+                    for g in range(1, games + 1)
+                    for _ in range(moves)
+                ],
+            )
+
+
+async def _orm_page(limit: int) -> list[schemas.GetGameResponse]:
+    async with db.async_session() as session:
+        games = await crud.get_games(session, player_id=1, limit=limit)
+        return [schemas.GetGameResponse(**vars(game)) for game in games]
+
+
+async def _rows_page(limit: int) -> list[schemas.GetGameResponse]:
+    async with db.async_session() as session:
+        games = await crud.get_game_rows(session, player_id=1, limit=limit)
+        return [schemas.GetGameResponse.model_validate(game) for game in games]
+
+
+async def _bench(page, limit: int, rounds: int) -> tuple[float, float]:
+    await page(limit)
+
+    tracemalloc.start()
+    await page(limit)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    start = time.perf_counter()
+    for _ in range(rounds):
+        await page(limit)
+    elapsed = time.perf_counter() - start
+
+    return limit * rounds / elapsed, peak / 2**20
+
+
+async def main(games: int, moves: int):
+    """run benchmark"""
+    await _seed(games, moves)
+    print(f"{games} games, {moves} moves each")
+    print(f"{'limit':>6} {'path':<6}{'rows/s':>10}{'peak MiB':>10}")
+    for limit in (50, min(1000, games)):
+        rounds = max(1, 2000 // limit)
+        for name, page in (("orm", _orm_page), ("rows", _rows_page)):
+            rate, peak = await _bench(page, limit, rounds)
+            print(f"{limit:>6} {name:<6}{rate:>10.0f}{peak:>10.2f}")
+    await db.async_engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n", maxsplit=1)[0])
+    parser.add_argument("--games", type=int, default=2000)
+    parser.add_argument("--moves", type=int, default=80)
+    args = parser.parse_args()
+    asyncio.run(main(args.games, args.moves))
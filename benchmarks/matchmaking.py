@@ -0,0 +1,123 @@
+"""
+Matchmaking pairing throughput, bulk game creation vs accepting challenges.
+
+Seeds `--players` users, queues them all with random ratings and rating
+windows, then times a full pairing round: pairing the queue in Redis, creating
+the games with `crud.create_matches`, and publishing the match events. A round
+considers up to MATCHMAKING_BATCH_SIZE players. Also
+times pairing the same players in process alone, and creating as many games
+one challenge at a time through `crud.create_challenge` and
+`crud.accept_challenge`, as the polling clients did. Reports players or games
+per second for each.
+
+Usage:
+    python benchmarks/matchmaking.py [--players 100000]
+
+A temporary sqlite file is used unless SQL_CONN_STR is set. Needs a Redis
+server at REDIS_URL, the benchmark's keys are deleted afterwards.
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+
+if "SQL_CONN_STR" not in os.environ:
+    os.environ["SQL_CONN_STR"] = "sqlite+aiosqlite:///" + os.path.join(
+        tempfile.mkdtemp(), "matchmaking.db"
+    )
+
+# pylint: disable=wrong-import-position
+from redis.asyncio import Redis
+from sqlalchemy import insert
+
+from chessticulate_api import crud, db, matchmaking, migrations, models
+from chessticulate_api.app import match_players
+from chessticulate_api.config import CONFIG
+
+KEY = "benchmark:matchmaking"
+
+
+async def _seed(users: int, batch_size: int = 50_000):
+    await migrations.migrate()
+    for start in range(0, users, batch_size):
+        async with db.async_session() as session:
+            async with session.begin():
+                await session.execute(
+                    insert(models.User),
+                    [
+                        {"name": f"benchuser{i}", "password": "x"}
+                        for i in range(start, min(start + batch_size, users))
+                    ],
+                )
+
+
+def _players(count: int) -> list[matchmaking.Player]:
+    rng = random.Random(0)
+    return [
+        matchmaking.Player(
+            user_id,
+            rng.gauss(1500, 300),
+            # a quarter of the players take any opponent
+            rng.choice((None, 50, 100, 200)),
+        ) for user_id in range(1, count + 1)
+    ]
+
+
+def _report(name: str, count: int, seconds: float, unit: str):
+    print(f"{name:<32}{count:>9}{seconds * 1000:>10.1f}{count / seconds:>12.0f} {unit}")
+
+
+async def _accept_one_by_one(pairs: list[tuple[int, int]]) -> int:
+    async with db.async_session() as session:
+        async with session.begin():
+            for requester_id, accepter_id in pairs:
+                challenge = await crud.create_challenge(session, requester_id)
+                await crud.accept_challenge(session, challenge.id_, accepter_id)
+    return len(pairs)
+
+
+async def main(players: int):
+    """run benchmark"""
+    start = time.perf_counter()
+    await _seed(players)
+    print(f"seeded {players} users in {time.perf_counter() - start:.1f}s")
+    queued = _players(players)
+
+    print(f"{'step':<32}{'count':>9}{'ms':>10}{'per second':>12}")
+    start = time.perf_counter()
+    pairs = matchmaking.pair_players(sorted(queued, key=lambda p: p.rating))
+    _report("pair in process", players, time.perf_counter() - start, "players")
+
+    redis = Redis.from_url(CONFIG.redis_url, decode_responses=True)
+    queue = matchmaking.MatchmakingQueue(redis, key=KEY)
+    try:
+        for player in queued:
+            await queue.join(models.GameType.CHESS.value, player)
+
+        start = time.perf_counter()
+        games = await match_players(queue)
+        seconds = time.perf_counter() - start
+        _report("pairing round, matched", games * 2, seconds, "players")
+        _report("pairing round, created", games, seconds, "games")
+
+        start = time.perf_counter()
+        accepted = await _accept_one_by_one(
+            [(a.user_id, b.user_id) for a, b in pairs[:games]]
+        )
+        _report("accept one by one", accepted, time.perf_counter() - start, "games")
+    finally:
+        await redis.delete(
+            f"{KEY}:windows", f"{KEY}:lock", f"{KEY}:{models.GameType.CHESS.value}"
+        )
+        await redis.aclose()
+        await db.async_engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n", maxsplit=1)[0])
+    parser.add_argument("--players", type=int, default=100_000)
+    args = parser.parse_args()
+    asyncio.run(main(args.players))
@@ -0,0 +1,88 @@
+"""
+Connection pool saturation benchmark.
+
+Runs batches of concurrent "requests" that each check out a connection, run a
+query and hold the connection for a simulated handler duration. Reports
+throughput and pool checkout wait at several concurrency levels, using the pool
+settings from CONFIG (SQL_POOL_SIZE, SQL_MAX_OVERFLOW, SQL_POOL_TIMEOUT, ...).
+
+Usage:
+    SQL_CONN_STR=postgresql+asyncpg://... python benchmarks/pool_saturation.py
+
+Without SQL_CONN_STR set to a server database a temporary sqlite file is used.
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+
+from sqlalchemy import text
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+
+from chessticulate_api import db
+from chessticulate_api.config import CONFIG
+
+
+async def _request(engine, hold: float, waits: list[float]) -> bool:
+    start = time.perf_counter()
+    try:
+        async with engine.connect() as conn:
+            waits.append(time.perf_counter() - start)
+            await conn.execute(text("SELECT 1"))
+            await asyncio.sleep(hold)
+    except PoolTimeoutError:
+        return False
+    return True
+
+
+async def _run_level(engine, concurrency: int, requests: int, hold: float):
+    waits: list[float] = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def worker():
+        async with semaphore:
+            return await _request(engine, hold, waits)
+
+    start = time.perf_counter()
+    results = await asyncio.gather(*(worker() for _ in range(requests)))
+    elapsed = time.perf_counter() - start
+
+    waits.sort()
+    p99 = waits[int(len(waits) * 0.99) - 1] if waits else 0.0
+    print(
+        f"{concurrency:>11} {requests / elapsed:>10.0f} "
+        f"{statistics.median(waits) * 1000 if waits else 0:>12.2f} "
+        f"{p99 * 1000:>12.2f} {results.count(False):>9}"
+    )
+
+
+async def main(levels: list[int], requests: int, hold: float):
+    """run benchmark"""
+    conn_str = CONFIG.sql_conn_str
+    if conn_str.startswith("sqlite") and ":memory:" in conn_str:
+        path = os.path.join(tempfile.mkdtemp(), "pool_bench.db")
+        conn_str = f"sqlite+aiosqlite:///{path}"
+
+    engine = db.create_engine(conn_str)
+    print(
+        f"{engine.url.get_backend_name()} pool_size={CONFIG.sql_pool_size}"
+        f" max_overflow={CONFIG.sql_max_overflow} hold={hold * 1000:.1f}ms"
+    )
+    print("concurrency      req/s  wait p50 ms  wait p99 ms  timeouts")
+    try:
+        for level in levels:
+            await _run_level(engine, level, requests, hold)
+    finally:
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n", maxsplit=1)[0])
+    parser.add_argument("--levels", type=int, nargs="+", default=[1, 4, 16, 64, 256])
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--hold-ms", type=float, default=2.0)
+    args = parser.parse_args()
+    asyncio.run(main(args.levels, args.requests, args.hold_ms / 1000))
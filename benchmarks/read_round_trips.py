@@ -0,0 +1,123 @@
+"""
+Database round trips per GET request.
+
+Serves the read endpoints in-process and counts, per request, the statements
+sent to the database, the transaction control round trips (BEGIN, COMMIT and
+ROLLBACK, which a server database skips for autocommit connections) and the
+connections checked out of the pool. The same requests are then repeated with
+reads going through the transactional `db.session` for comparison.
+
+Usage:
+    python benchmarks/read_round_trips.py
+
+A temporary sqlite file is used unless SQL_CONN_STR is set.
+"""
+
+import asyncio
+import os
+import tempfile
+from collections import Counter
+from unittest.mock import AsyncMock
+
+if "SQL_CONN_STR" not in os.environ:
+    os.environ["SQL_CONN_STR"] = "sqlite+aiosqlite:///" + os.path.join(
+        tempfile.mkdtemp(), "round_trips.db"
+    )
+
+# pylint: disable=wrong-import-position
+from httpx import ASGITransport, AsyncClient
+from pydantic import SecretStr
+from sqlalchemy import event
+
+from chessticulate_api import app, crud, db, models
+
+ENDPOINTS = [
+    "/users",
+    "/users/self",
+    "/users/name/benchuser1",
+    "/games?player_id=1",
+    "/invitations?to_id=1",
+    "/challenges",
+]
+
+counts: Counter = Counter()
+
+
+def _autocommit(conn) -> bool:
+    return conn.get_execution_options().get("isolation_level") == "AUTOCOMMIT"
+
+
+def _listen(engine):
+    sync_engine = engine.sync_engine
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def _statement(*_):
+        counts["statements"] += 1
+
+    for name in ("begin", "commit", "rollback"):
+
+        @event.listens_for(sync_engine, name)
+        def _txn(conn):
+            if not _autocommit(conn):
+                counts["transaction control"] += 1
+
+    @event.listens_for(sync_engine.pool, "checkout")
+    def _checkout(*_):
+        counts["checkouts"] += 1
+
+
+async def _seed():
+    await models.init_db()
+    password_hash = await crud.hash_password(SecretStr("pswd"))
+    async with db.async_session() as session:
+        async with session.begin():
+            for i in (1, 2):
+                await crud.create_user(
+                    session, f"benchuser{i}", f"bench{i}@email.com", password_hash
+                )
+            invitation = await crud.create_invitation(session, 2, 1)
+            await crud.accept_invitation(session, invitation.id_)
+            await crud.create_challenge(session, 2)
+        token = await crud.login(session, "benchuser1", SecretStr("pswd"))
+    return token
+
+
+async def _measure(client, token, rounds: int) -> dict[str, Counter]:
+    results = {}
+    for endpoint in ENDPOINTS:
+        counts.clear()
+        for _ in range(rounds):
+            response = await client.get(
+                endpoint, headers={"Authorization": f"Bearer {token}"}
+            )
+            assert response.status_code == 200, response.text
+        results[endpoint] = Counter({k: v / rounds for k, v in counts.items()})
+    return results
+
+
+async def main(rounds: int = 20):
+    """run benchmark"""
+    token = await _seed()
+    _listen(db.async_engine)
+    app.state.redis = AsyncMock()
+
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://b") as c:
+        after = await _measure(c, token, rounds)
+
+        # route every read through the transactional primary session
+        app.dependency_overrides[db.read_session] = db.session
+        db.async_read_session = db.async_primary_read_session = db.async_session
+        before = await _measure(c, token, rounds)
+
+    keys = ("statements", "transaction control", "checkouts")
+    print(f"{'endpoint':<24}" + "".join(f"{k:>26}" for k in keys))
+    for endpoint in ENDPOINTS:
+        row = "".join(
+            f"{before[endpoint][k]:>17.1f} -> {after[endpoint][k]:<5.1f}" for k in keys
+        )
+        print(f"{endpoint:<24}{row}")
+    await db.async_engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
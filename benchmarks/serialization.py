@@ -0,0 +1,98 @@
+"""
+JSON serialization of game responses and move state.
+
+Renders a page of `GetGameResponse` objects with long move histories the way
+FastAPI does, pydantic serialization to JSON compatible data followed by the
+response class, with stdlib `JSONResponse` and with `ORJSONResponse`. Also
+times the `states` round trip of the move endpoint and the encoding of a
+pub/sub move event, stdlib `json` against `serialization.loads`/`dumps`.
+
+Usage:
+    python benchmarks/serialization.py [--games 50] [--moves 120]
+"""
+
+import argparse
+import json
+import timeit
+from datetime import datetime, timezone
+
+from fastapi.responses import JSONResponse, ORJSONResponse
+from pydantic import TypeAdapter
+
+from chessticulate_api import schemas, serialization
+
+FEN = "rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR b KQkq e3 0 1"
+MOVES = ["e4", "e5", "Nf3", "Nc6", "Bb5", "a6", "Ba4", "Nf6", "O-O", "Be7"]
+
+
+def _games(games: int, moves: int) -> list[schemas.GetGameResponse]:
+    now = datetime.now(tz=timezone.utc)
+    return [
+        schemas.GetGameResponse(
+            id_=i,
+            game_type="chess",
+            date_started=now,
+            last_active=now,
+            invitation_id=i,
+            white=1,
+            black=2,
+            white_username="benchuser1",
+            black_username="benchuser2",
+            whomst=1,
+            move_hist=[MOVES[m % len(MOVES)] for m in range(moves)],
+            is_active=True,
+            fen=FEN,
+        )
+        for i in range(games)
+    ]
+
+
+def _states(moves: int) -> dict[str, str]:
+    # chess-workers keys positions seen so far by board layout, for repetition
+    return {f"{FEN[:-4]}{i}": str(i % 3 + 1) for i in range(moves)}
+
+
+def _time(fn, number: int) -> float:
+    return min(timeit.repeat(fn, number=number, repeat=5)) / number * 1e6
+
+
+def main(games: int, moves: int, number: int):
+    """run benchmark"""
+    page = _games(games, moves)
+    adapter = TypeAdapter(list[schemas.GetGameResponse])
+    content = adapter.dump_python(page, mode="json", by_alias=True)
+
+    size = len(JSONResponse(content).body)
+    print(f"GET /games page: {games} games x {moves} moves, {size} bytes")
+    print(f"{'step':<40}{'us':>10}")
+    print(f"{'pydantic dump_python(mode=json)':<40}", end="")
+    print(f"{_time(lambda: adapter.dump_python(page, mode='json'), number):>10.1f}")
+    for name, response_class in (
+        ("JSONResponse.render", JSONResponse),
+        ("ORJSONResponse.render", ORJSONResponse),
+    ):
+        elapsed = _time(lambda cls=response_class: cls(content), number)
+        print(f"{name:<40}{elapsed:>10.1f}")
+
+    states = _states(moves)
+    encoded = json.dumps(states)
+    event = {"type": "move", "gameId": 1, "move": "e4", "fen": FEN, "whomst": 2}
+    print(f"\nmove path, {moves} entry states")
+    for name, fn in (
+        ("json.loads(states)", lambda: json.loads(encoded)),
+        ("serialization.loads(states)", lambda: serialization.loads(encoded)),
+        ("json.dumps(states)", lambda: json.dumps(states)),
+        ("serialization.dumps(states)", lambda: serialization.dumps(states)),
+        ("json.dumps(event)", lambda: json.dumps(event)),
+        ("serialization.dumps(event)", lambda: serialization.dumps(event)),
+    ):
+        print(f"{name:<40}{_time(fn, number * 10):>10.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n", maxsplit=1)[0])
+    parser.add_argument("--games", type=int, default=50)
+    parser.add_argument("--moves", type=int, default=120)
+    parser.add_argument("--number", type=int, default=200)
+    args = parser.parse_args()
+    main(args.games, args.moves, args.number)
@@ -0,0 +1,76 @@
+"""
+Overhead of Server-Timing instrumentation.
+
+Times `server_timing.timer` around an empty block with the middleware absent,
+as in a default deployment, and with timings being collected, then a full
+`GET /users` request through the app with and without ServerTimingMiddleware.
+
+Usage:
+    python benchmarks/server_timing.py [--calls 1000000] [--requests 2000]
+"""
+
+import argparse
+import asyncio
+import time
+import timeit
+from unittest.mock import AsyncMock
+
+from httpx import ASGITransport, AsyncClient
+from pydantic import SecretStr
+
+from chessticulate_api import crud, db, migrations, server_timing
+from chessticulate_api.app import app
+
+
+def _timer_cost(calls: int) -> float:
+    def block():
+        with server_timing.timer("db"):
+            pass
+
+    return timeit.timeit(block, number=calls) / calls * 1e9
+
+
+async def _request_cost(asgi_app, token: str, requests: int) -> float:
+    transport = ASGITransport(app=asgi_app)
+    async with AsyncClient(transport=transport, base_url="http://bench") as client:
+        headers = {"Authorization": f"Bearer {token}"}
+        await client.get("/users", headers=headers)
+        start = time.perf_counter()
+        for _ in range(requests):
+            await client.get("/users", headers=headers)
+    return (time.perf_counter() - start) / requests * 1e6
+
+
+async def main(calls: int, requests: int):
+    """run benchmark"""
+    print(f"{'timer, middleware absent':<36}{_timer_cost(calls):>10.0f} ns/call")
+    token = server_timing._timings.set(  # pylint: disable=protected-access
+        server_timing._Timings()  # pylint: disable=protected-access
+    )
+    print(f"{'timer, collecting':<36}{_timer_cost(calls):>10.0f} ns/call")
+    server_timing._timings.reset(token)  # pylint: disable=protected-access
+
+    await migrations.migrate()
+    password_hash = await crud.hash_password(SecretStr("pswd"))
+    async with db.async_session() as session:
+        async with session.begin():
+            await crud.create_user(
+                session, "benchuser", "bench@email.com", password_hash
+            )
+        jwt = await crud.login(session, "benchuser", SecretStr("pswd"))
+    app.state.redis = AsyncMock()
+
+    for name, asgi_app in (
+        ("GET /users, middleware absent", app),
+        ("GET /users, middleware installed", server_timing.ServerTimingMiddleware(app)),
+    ):
+        cost = await _request_cost(asgi_app, jwt, requests)
+        print(f"{name:<36}{cost:>10.0f} us/request")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n", maxsplit=1)[0])
+    parser.add_argument("--calls", type=int, default=1_000_000)
+    parser.add_argument("--requests", type=int, default=2000)
+    args = parser.parse_args()
+    asyncio.run(main(args.calls, args.requests))
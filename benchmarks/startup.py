@@ -0,0 +1,76 @@
+"""
+Database work done at application startup.
+
+Compares the old startup step, `models.init_db` running `create_all` against an
+existing schema, with the schema version check that replaced it. Reports wall
+time and the number of statements sent per startup, on a database that has
+already been migrated. `--extra-tables` pads the catalog with unrelated tables.
+
+Usage:
+    python benchmarks/startup.py [--extra-tables 500]
+
+A temporary sqlite file is used unless SQL_CONN_STR is set.
+"""
+
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+if "SQL_CONN_STR" not in os.environ:
+    os.environ["SQL_CONN_STR"] = "sqlite+aiosqlite:///" + os.path.join(
+        tempfile.mkdtemp(), "startup.db"
+    )
+
+# pylint: disable=wrong-import-position
+from sqlalchemy import event
+
+from chessticulate_api import db, migrations, models
+
+statements = 0
+
+
+def _count(*_):
+    global statements  # pylint: disable=global-statement
+    statements += 1
+
+
+async def _time(step, rounds: int) -> tuple[float, float]:
+    global statements  # pylint: disable=global-statement
+    await step()
+    statements = 0
+    start = time.perf_counter()
+    for _ in range(rounds):
+        await step()
+    return (time.perf_counter() - start) / rounds * 1000, statements / rounds
+
+
+async def main(extra_tables: int, rounds: int):
+    """run benchmark"""
+    await migrations.migrate()
+    async with db.async_engine.begin() as conn:
+        for i in range(extra_tables):
+            await conn.exec_driver_sql(
+                f"CREATE TABLE IF NOT EXISTS padding_{i} (id INTEGER PRIMARY KEY)"
+            )
+    await db.async_engine.dispose()
+
+    event.listen(db.async_engine.sync_engine, "before_cursor_execute", _count)
+
+    print(f"{'startup step':<28}{'ms':>8}{'statements':>12}")
+    for name, step in (
+        ("models.init_db", models.init_db),
+        ("migrations.check_version", migrations.check_version),
+    ):
+        elapsed, count = await _time(step, rounds)
+        print(f"{name:<28}{elapsed:>8.2f}{count:>12.0f}")
+    await db.async_engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n", maxsplit=1)[0])
+    parser.add_argument("--extra-tables", type=int, default=500)
+    parser.add_argument("--rounds", type=int, default=50)
+    args = parser.parse_args()
+    asyncio.run(main(args.extra_tables, args.rounds))
@@ -0,0 +1,104 @@
+"""
+Latency of user search at a large number of users.
+
+Seeds `--users` users with random names, then times `crud.search_users` for
+queries of several lengths, each query a prefix of an existing name, a fuzzy
+variant of one (a typo), or a name that doesn't exist. Reports the median and
+99th percentile latency and the number of results per query type.
+
+Usage:
+    python benchmarks/user_search.py [--users 1000000] [--queries 200]
+
+A temporary sqlite file is used unless SQL_CONN_STR is set. Sqlite has no
+trigram index and scans the users table, point SQL_CONN_STR at postgres to
+measure the indexed search.
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import string
+import tempfile
+import time
+
+if "SQL_CONN_STR" not in os.environ:
+    os.environ["SQL_CONN_STR"] = "sqlite+aiosqlite:///" + os.path.join(
+        tempfile.mkdtemp(), "user_search.db"
+    )
+
+# pylint: disable=wrong-import-position
+from sqlalchemy import insert
+
+from chessticulate_api import crud, db, migrations, models
+
+ALPHABET = string.ascii_lowercase + string.digits + "_-"
+
+
+def _names(users: int, rng: random.Random) -> list[str]:
+    names: set[str] = set()
+    while len(names) < users:
+        names.add("".join(rng.choices(ALPHABET, k=rng.randint(4, 15))))
+    return list(names)
+
+
+def _typo(name: str, rng: random.Random) -> str:
+    i = rng.randrange(len(name))
+    return name[:i] + rng.choice(string.ascii_lowercase) + name[i + 1 :]
+
+
+async def _seed(names: list[str], batch_size: int = 10_000):
+    await migrations.migrate()
+    for start in range(0, len(names), batch_size):
+        async with db.async_session() as session:
+            async with session.begin():
+                await session.execute(
+                    insert(models.User),
+                    [
+                        {"name": name, "email": f"{name}@bench.com", "password": "x"}
+                        for name in names[start : start + batch_size]
+                    ],
+                )
+
+
+async def main(users: int, queries: int):
+    """run benchmark"""
+    rng = random.Random(0)
+    names = _names(users, rng)
+    start = time.perf_counter()
+    await _seed(names)
+    print(f"seeded {users} users in {time.perf_counter() - start:.1f}s")
+
+    long_names = [name for name in names if len(name) > 6]
+    kinds = {
+        "prefix, 2 chars": lambda: rng.choice(names)[:2],
+        "prefix, 4 chars": lambda: rng.choice(names)[:4],
+        "exact name": lambda: rng.choice(names),
+        "typo": lambda: _typo(rng.choice(long_names), rng),
+        "no match": lambda: "zz" + "".join(rng.choices(string.digits, k=8)),
+    }
+    print(f"{'query':<18}{'p50 ms':>9}{'p99 ms':>9}{'results':>9}")
+    async with db.async_session() as session:
+        for kind, make_query in kinds.items():
+            latencies, results = [], 0
+            for _ in range(queries):
+                query = make_query()
+                begin = time.perf_counter()
+                results += len(await crud.search_users(session, query))
+                latencies.append(time.perf_counter() - begin)
+            latencies.sort()
+            print(
+                f"{kind:<18}{statistics.median(latencies) * 1000:>9.2f}"
+                f"{latencies[int(len(latencies) * 0.99) - 1] * 1000:>9.2f}"
+                f"{results / queries:>9.1f}"
+            )
+    await db.async_engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n", maxsplit=1)[0])
+    parser.add_argument("--users", type=int, default=1_000_000)
+    parser.add_argument("--queries", type=int, default=200)
+    args = parser.parse_args()
+    asyncio.run(main(args.users, args.queries))
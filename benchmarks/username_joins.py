@@ -0,0 +1,172 @@
+"""
+Game list queries joining in usernames vs looking them up in the username cache.
+
+Seeds `--users` users and `--games` games between random pairs of them, then
+builds pages of `GET /games` rows three ways: with the users table joined in
+twice for the usernames, as the game queries used to, and with
+`crud.get_game_rows` looking them up in the username cache, cold and warm.
+Reports the median and 99th percentile latency of each, and the number of
+nodes in the query plan of the game query with and without the joins.
+
+Usage:
+    python benchmarks/username_joins.py [--users 10000] [--games 1000000]
+
+A temporary sqlite file is used unless SQL_CONN_STR is set.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import tempfile
+import time
+
+if "SQL_CONN_STR" not in os.environ:
+    os.environ["SQL_CONN_STR"] = "sqlite+aiosqlite:///" + os.path.join(
+        tempfile.mkdtemp(), "username_joins.db"
+    )
+
+# pylint: disable=wrong-import-position
+from sqlalchemy import insert
+
+from chessticulate_api import crud, db, migrations, models, usernames
+from chessticulate_api.routers.game import LIST_FIELDS
+
+FIELDS = tuple(sorted(LIST_FIELDS))
+
+QUERIES = {
+    "latest games": {},
+    "player's games": {"player_id": 1},
+    "game by id": {"id_": 1},
+}
+
+
+async def _seed(users: int, games: int, batch_size: int = 50_000):
+    await migrations.migrate()
+    rng = random.Random(0)
+    async with db.async_session() as session:
+        async with session.begin():
+            await session.execute(
+                insert(models.User),
+                [{"name": f"benchuser{i}", "password": "x"} for i in range(users)],
+            )
+            await session.execute(
+                insert(models.Invitation),
+                [{"from_id": 1, "to_id": 2, "game_type": models.GameType.CHESS}],
+            )
+    for start in range(0, games, batch_size):
+        rows = []
+        for _ in range(min(batch_size, games - start)):
+            white, black = rng.sample(range(1, users + 1), 2)
+            rows.append(
+                {"invitation_id": 1, "white": white, "black": black, "whomst": white}
+            )
+        async with db.async_session() as session:
+            async with session.begin():
+                await session.execute(insert(models.Game), rows)
+
+
+# pylint: disable=protected-access
+def _games_stmt(filters: tuple[str, ...]):
+    """The game list query `crud.get_game_rows` runs, without usernames."""
+    fields = crud._row_fields(models.Game, FIELDS)
+    return crud._games_stmt(filters, "last_active", True, False, True, fields)
+
+
+def _join_stmt(filters: tuple[str, ...]):
+    """The game list query with usernames joined in, as it was built before."""
+    stmt = _games_stmt(filters)
+    games = models.Game.__table__
+    for label, player in (("white_username", "white"), ("black_username", "black")):
+        users = models.User.__table__.alias()
+        stmt = stmt.add_columns(users.c.name.label(label)).join(
+            users, games.c[player] == users.c.id
+        )
+    return stmt
+
+
+async def _join_rows(session, filters: dict) -> list[crud.Row]:
+    stmt = _join_stmt(tuple(sorted(filters)))
+    params = {**filters, "skip": 0, "limit": 50}
+    return [dict(row) for row in (await session.execute(stmt, params)).mappings()]
+
+
+async def _cached_rows(session, filters: dict) -> list[crud.Row]:
+    return await crud.get_game_rows(
+        session, limit=50, reverse=True, fields=FIELDS, **filters
+    )
+
+
+async def _cold_rows(session, filters: dict) -> list[crud.Row]:
+    usernames.cache.clear()
+    return await _cached_rows(session, filters)
+
+
+def _count_nodes(plan: dict) -> int:
+    return 1 + sum(_count_nodes(child) for child in plan.get("Plans", []))
+
+
+async def _plan_nodes(session, stmt, filters: dict) -> int:
+    """Number of nodes in the query plan of `stmt`."""
+    conn = await session.connection()
+    compiled = stmt.compile(dialect=conn.dialect)
+    values = compiled.construct_params({**filters, "skip": 0, "limit": 50})
+    params = tuple(values[key] for key in compiled.positiontup or ())
+    if conn.dialect.name == "postgresql":
+        result = await conn.exec_driver_sql(f"EXPLAIN (FORMAT JSON) {compiled}", params)
+        plan = result.scalar()
+        plan = json.loads(plan) if isinstance(plan, str) else plan
+        return _count_nodes(plan[0]["Plan"])
+    result = await conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {compiled}", params)
+    return len(result.all())
+
+
+async def _latencies(page, filters: dict, rounds: int) -> list[float]:
+    latencies = []
+    async with db.async_session() as session:
+        await page(session, filters)
+        for _ in range(rounds):
+            begin = time.perf_counter()
+            await page(session, filters)
+            latencies.append(time.perf_counter() - begin)
+    latencies.sort()
+    return latencies
+
+
+async def main(users: int, games: int, rounds: int):
+    """run benchmark"""
+    start = time.perf_counter()
+    await _seed(users, games)
+    print(f"seeded {users} users, {games} games in {time.perf_counter() - start:.1f}s")
+
+    print(f"{'query':<16}{'path':<8}{'p50 ms':>9}{'p99 ms':>9}{'plan nodes':>12}")
+    for name, filters in QUERIES.items():
+        filter_keys = tuple(sorted(filters))
+        async with db.async_session() as session:
+            nodes = {
+                "join": await _plan_nodes(session, _join_stmt(filter_keys), filters),
+                "cache": await _plan_nodes(session, _games_stmt(filter_keys), filters),
+            }
+        for path, page, plan in (
+            ("join", _join_rows, "join"),
+            ("cold", _cold_rows, "cache"),
+            ("warm", _cached_rows, "cache"),
+        ):
+            latencies = await _latencies(page, filters, rounds)
+            print(
+                f"{name:<16}{path:<8}{statistics.median(latencies) * 1000:>9.2f}"
+                f"{latencies[int(len(latencies) * 0.99) - 1] * 1000:>9.2f}"
+                f"{nodes[plan]:>12}"
+            )
+    await db.async_engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n", maxsplit=1)[0])
+    parser.add_argument("--users", type=int, default=10_000)
+    parser.add_argument("--games", type=int, default=1_000_000)
+    parser.add_argument("--rounds", type=int, default=200)
+    args = parser.parse_args()
+    asyncio.run(main(args.users, args.games, args.rounds))
@@ -0,0 +1,195 @@
+"""
+Throughput of `chess-api` at several worker counts.
+
+Seeds a database, then for each worker count starts `chess-api` with
+APP_WORKERS set and drives the list endpoint (`GET /games`) and the move
+endpoint (`POST /games/{id}/move`) at a fixed concurrency. The chess-workers
+service is replaced by a stub that accepts every move, started by this script.
+The move endpoint publishes to Redis, so it is skipped when REDIS_URL is not
+reachable.
+
+Usage:
+    SQL_CONN_STR=postgresql+asyncpg://... python benchmarks/workers_throughput.py
+
+A temporary sqlite file is used unless SQL_CONN_STR is set, sqlite serializes
+writers so move numbers on it say little about the API itself.
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+if "SQL_CONN_STR" not in os.environ:
+    os.environ["SQL_CONN_STR"] = "sqlite+aiosqlite:///" + os.path.join(
+        tempfile.mkdtemp(), "workers_throughput.db"
+    )
+
+# pylint: disable=wrong-import-position
+import httpx
+from pydantic import SecretStr
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
+from sqlalchemy import insert
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+from chessticulate_api import crud, db, migrations, models
+from chessticulate_api.config import CONFIG
+
+API_PORT = 8911
+STUB_PORT = 8912
+FEN = "rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR b KQkq e3 0 1"
+
+
+async def _stub_move(_):
+    return JSONResponse({"status": "MOVEOK", "states": {}, "fen": FEN})
+
+
+# chess-workers stand in, run with `uvicorn workers_throughput:stub_app`
+stub_app = Starlette(routes=[Route("/move", _stub_move, methods=["POST"])])
+
+
+async def _seed(games: int) -> tuple[str, str]:
+    await migrations.migrate()
+    password_hash = await crud.hash_password(SecretStr("pswd"))
+    async with db.async_session() as session:
+        async with session.begin():
+            for i in (1, 2):
+                await crud.create_user(
+                    session, f"benchuser{i}", f"bench{i}@email.com", password_hash
+                )
+            await session.execute(
+                insert(models.Invitation),
+                [{"from_id": 1, "to_id": 2, "game_type": models.GameType.CHESS}],
+            )
+            await session.execute(
+                insert(models.Game),
+                [
+                    {"invitation_id": 1, "white": 1, "black": 2, "whomst": 1}
+                    for _ in range(games)
+                ],
+            )
+        tokens = [
+            await crud.login(session, f"benchuser{i}", SecretStr("pswd"))
+            for i in (1, 2)
+        ]
+    await db.async_engine.dispose()
+    return tokens[0], tokens[1]
+
+
+async def _redis_available() -> bool:
+    redis = Redis.from_url(CONFIG.redis_url)
+    try:
+        return await redis.ping()
+    except (RedisError, OSError):
+        return False
+    finally:
+        await redis.aclose()
+
+
+def _start(args: list[str], env: dict[str, str]) -> subprocess.Popen:
+    return subprocess.Popen(
+        args,
+        env={**os.environ, **env},
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+
+
+async def _wait_ready(url: str):
+    async with httpx.AsyncClient() as client:
+        for _ in range(200):
+            try:
+                await client.get(url)
+                return
+            except httpx.TransportError:
+                await asyncio.sleep(0.1)
+    raise RuntimeError(f"{url} did not come up")
+
+
+async def _load(request, concurrency: int, duration: float):
+    latencies: list[float] = []
+    deadline = time.perf_counter() + duration
+
+    async def client_loop(n: int):
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{API_PORT}") as c:
+            i = 0
+            while time.perf_counter() < deadline:
+                start = time.perf_counter()
+                response = await request(c, n, i)
+                if response.status_code < 400:
+                    latencies.append(time.perf_counter() - start)
+                i += 1
+
+    await asyncio.gather(*(client_loop(n) for n in range(concurrency)))
+    latencies.sort()
+    p99 = latencies[int(len(latencies) * 0.99) - 1] if latencies else 0.0
+    p50 = statistics.median(latencies or [0])
+    return len(latencies) / duration, p50 * 1000, p99 * 1000
+
+
+async def main(levels: list[int], concurrency: int, duration: float):
+    """run benchmark"""
+    white, black = await _seed(concurrency)
+    moves = await _redis_available()
+    if not moves:
+        print(f"redis not reachable at {CONFIG.redis_url}, skipping move endpoint")
+
+    async def list_games(client, _, __):
+        return await client.get(
+            "/games?player_id=1&limit=10", headers={"Authorization": f"Bearer {white}"}
+        )
+
+    async def move(client, n, i):
+        # each client plays its own game, alternating sides
+        return await client.post(
+            f"/games/{n + 1}/move",
+            headers={"Authorization": f"Bearer {black if i % 2 else white}"},
+            json={"move": "e4"},
+        )
+
+    stub = _start(
+        [sys.executable, "-m", "uvicorn", "workers_throughput:stub_app"]
+        + ["--port", str(STUB_PORT), "--log-level", "warning"],
+        {"PYTHONPATH": os.path.dirname(os.path.abspath(__file__))},
+    )
+    print(f"{'workers':>7} {'endpoint':<10}{'req/s':>8}{'p50 ms':>9}{'p99 ms':>9}")
+    try:
+        for workers in levels:
+            api = _start(
+                ["chess-api"],
+                {
+                    "APP_WORKERS": str(workers),
+                    "APP_PORT": str(API_PORT),
+                    "LOG_LEVEL": "warning",
+                    "WORKERS_URL": f"http://127.0.0.1:{STUB_PORT}",
+                },
+            )
+            try:
+                await _wait_ready(f"http://127.0.0.1:{API_PORT}/users/name/x")
+                for name, request in (("list", list_games), ("move", move)):
+                    if name == "move" and not moves:
+                        continue
+                    rate, p50, p99 = await _load(request, concurrency, duration)
+                    print(f"{workers:>7} {name:<10}{rate:>8.0f}{p50:>9.1f}{p99:>9.1f}")
+            finally:
+                api.terminate()
+                api.wait()
+    finally:
+        stub.terminate()
+        stub.wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n", maxsplit=1)[0])
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=10.0)
+    args = parser.parse_args()
+    asyncio.run(main(args.workers, args.concurrency, args.duration))
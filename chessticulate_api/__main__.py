@@ -1,12 +1,17 @@
 """Chessticulate API Entrypoint"""
 
+import argparse
+import asyncio
+
 import uvicorn
+from redis.asyncio import Redis
 from uvicorn.config import LOGGING_CONFIG
 
+from chessticulate_api import bloom, crud, db, leaderboard, metrics, migrations
 from chessticulate_api.config import CONFIG
 
 
-def main():
+def serve():
     """run API with uvicorn"""
 
     LOGGING_CONFIG["formatters"]["default"][
@@ -18,12 +23,145 @@ def main():
         ' "%(request_line)s" %(status_code)s'
     )
 
+    if CONFIG.app_workers > 1 or CONFIG.prometheus_multiproc_dir:
+        metrics.setup_multiprocess_dir()
+
+    # with more than one worker uvicorn supervises a process per worker,
+    # restarting any that die. each worker runs the app lifespan, and so gets its
+    # own redis client and database connection pool
     uvicorn.run(
         "chessticulate_api:app",
         host=CONFIG.app_host,
         port=CONFIG.app_port,
         log_level=CONFIG.log_level,
+        workers=CONFIG.app_workers,
+        loop=CONFIG.app_loop,
+        http=CONFIG.app_http,
+        backlog=CONFIG.app_backlog,
+        timeout_keep_alive=CONFIG.app_keep_alive,
+        timeout_graceful_shutdown=CONFIG.app_graceful_timeout or None,
+    )
+
+
+def migrate():
+    """bring the database schema up to date"""
+
+    async def run():
+        try:
+            return await migrations.migrate()
+        finally:
+            await db.async_engine.dispose()
+
+    start, end = asyncio.run(run())
+    if start is None:
+        print(f"created database at schema version {end}")
+    elif start == end:
+        print(f"database already at schema version {end}")
+    else:
+        print(f"migrated database from schema version {start} to {end}")
+
+
+def rebuild_user_filter():
+    """rebuild the redis bloom filter of taken usernames and emails"""
+    if CONFIG.user_filter != "redis":
+        print(f"USER_FILTER is '{CONFIG.user_filter}', there is no shared filter")
+        return
+
+    async def run():
+        redis = Redis.from_url(CONFIG.redis_url)
+        try:
+            async with db.async_session() as session:
+                return await crud.rebuild_user_filter(
+                    session, bloom.create_user_filter(redis)
+                )
+        finally:
+            await redis.aclose()
+            await db.async_engine.dispose()
+
+    users = asyncio.run(run())
+    if users is None:
+        print("user filter is already being rebuilt")
+    else:
+        print(f"rebuilt user filter with {users} users")
+
+
+def rebuild_leaderboard():
+    """rebuild the redis leaderboard of users ranked by wins"""
+
+    async def run():
+        redis = Redis.from_url(CONFIG.redis_url, decode_responses=True)
+        try:
+            async with db.async_session() as session:
+                return await crud.rebuild_leaderboard(
+                    session, leaderboard.Leaderboard(redis)
+                )
+        finally:
+            await redis.aclose()
+            await db.async_engine.dispose()
+
+    users = asyncio.run(run())
+    if users is None:
+        print("leaderboard is already being rebuilt")
+    else:
+        print(f"rebuilt leaderboard with {users} users")
+
+
+def recount_results():
+    """recompute every user's wins, draws and losses from the finished games"""
+
+    async def run():
+        try:
+            async with db.async_session() as session:
+                async with session.begin():
+                    return await crud.recount_results(session)
+        finally:
+            await db.async_engine.dispose()
+
+    users = asyncio.run(run())
+    print(f"recounted the results of {users} users")
+
+
+def recompute_ratings():
+    """recompute every user's rating by replaying the finished games"""
+
+    async def run():
+        try:
+            async with db.async_session() as session:
+                async with session.begin():
+                    return await crud.recompute_ratings(session)
+        finally:
+            await db.async_engine.dispose()
+
+    games = asyncio.run(run())
+    print(f"recomputed ratings from {games} games")
+
+
+COMMANDS = {
+    "serve": serve,
+    "migrate": migrate,
+    "rebuild-user-filter": rebuild_user_filter,
+    "recount-results": recount_results,
+    "rebuild-leaderboard": rebuild_leaderboard,
+    "recompute-ratings": recompute_ratings,
+}
+
+
+def main():
+    """chess-api command line"""
+    parser = argparse.ArgumentParser(prog="chess-api", description=__doc__)
+    parser.add_argument(
+        "command",
+        nargs="?",
+        default="serve",
+        choices=COMMANDS,
+        help=(
+            "run the API (default), migrate the database schema, rebuild the"
+            " filter of taken usernames and emails, recount users' wins, draws"
+            " and losses, rebuild the leaderboard, or recompute users' ratings"
+        ),
     )
+    args = parser.parse_args()
+    COMMANDS[args.command]()
 
 
 if __name__ == "__main__":
@@ -1,40 +1,252 @@
 """chessticulate_api.app"""
 
+import asyncio
 import importlib.metadata
+import logging
 from contextlib import asynccontextmanager
-from typing import Annotated
+from datetime import datetime, timedelta, timezone
+from typing import Annotated, Any, Awaitable, Callable, Iterable
 
-from fastapi import Depends, FastAPI, HTTPException, Response
+from fastapi import Depends, FastAPI, HTTPException, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import RedirectResponse
-from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+from prometheus_fastapi_instrumentator import Instrumentator
 from redis.asyncio import Redis
+from redis.exceptions import LockError, RedisError
+from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from chessticulate_api import crud, db, models, routers, schemas
+from chessticulate_api import (
+    bloom,
+    compression,
+    crud,
+    db,
+    events,
+    leaderboard,
+    matchmaking,
+    metrics,
+    migrations,
+    query_stats,
+    routers,
+    schemas,
+    serialization,
+    server_timing,
+)
 from chessticulate_api.config import CONFIG
 
+logger = logging.getLogger(__name__)
+
+
+async def build_user_filter(user_filter: bloom.UserFilter):
+    """Build the filter of taken usernames and emails, unless it already is."""
+    if await user_filter.is_built():
+        return
+    async with db.async_session() as session:
+        await crud.rebuild_user_filter(session, user_filter)
+
+
+async def build_leaderboard(board: leaderboard.Leaderboard):
+    """Build the leaderboard from the users table, unless it already is."""
+    if await board.is_built():
+        return
+    async with db.async_session() as session:
+        await crud.rebuild_leaderboard(session, board)
+
+
+async def match_players(queue: matchmaking.MatchmakingQueue) -> int:
+    """
+    Start games between the players the matchmaking queue pairs up, all in one
+    transaction, and tell both players of each game. Returns the number of games.
+
+    Players whose games fail to be created are put back in the queue.
+    """
+    matches = await queue.pair()
+    if not matches:
+        return 0
+    try:
+        async with db.async_session() as session:
+            async with session.begin():
+                games = await crud.create_matches(
+                    session,
+                    [(game_type, a.user_id, b.user_id) for game_type, a, b in matches],
+                )
+    except SQLAlchemyError:
+        for game_type, *players in matches:
+            for player in players:
+                await queue.join(game_type, player)
+        raise
+
+    await events.publish_many(
+        queue.redis,
+        (
+            (
+                events.user_channel(player),
+                {
+                    "type": "match",
+                    "gameId": game["id"],
+                    "white": game["white"],
+                    "black": game["black"],
+                },
+            )
+            for game in games
+            for player in (game["white"], game["black"])
+        ),
+    )
+    return len(games)
+
+
+async def run_matchmaking(queue: matchmaking.MatchmakingQueue):
+    """Pair up queued players every CONFIG.matchmaking_tick seconds."""
+    while True:
+        try:
+            await match_players(queue)
+        except (RedisError, SQLAlchemyError):
+            logger.exception("failed to match queued players")
+        await asyncio.sleep(CONFIG.matchmaking_tick)
+
+
+async def _expire(
+    redis: Redis,
+    expire: Callable[[AsyncSession, datetime, int], Awaitable[list[crud.Row]]],
+    ttl: int,
+    notify: Callable[[crud.Row], Iterable[tuple[str, dict[str, Any]]]],
+) -> int:
+    """
+    Cancel the rows `expire` finds pending for longer than `ttl` seconds, in
+    batches of CONFIG.expiry_batch_size each committed on its own, and publish
+    the events `notify` makes of each. Returns the number of rows cancelled.
+    """
+    if ttl <= 0:
+        return 0
+    before = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(seconds=ttl)
+    expired = 0
+    while True:
+        async with db.async_session() as session:
+            async with session.begin():
+                rows = await expire(session, before, CONFIG.expiry_batch_size)
+        if rows:
+            await events.publish_many(
+                redis, (event for row in rows for event in notify(row))
+            )
+        expired += len(rows)
+        if len(rows) < CONFIG.expiry_batch_size:
+            return expired
+
+
+def _challenge_expired(challenge: crud.Row) -> Iterable[tuple[str, dict[str, Any]]]:
+    event = {
+        "type": "challenge_cancelled",
+        "challengeId": challenge["id"],
+        "reason": "expired",
+    }
+    return [(events.user_channel(challenge["requester_id"]), event)]
+
+
+def _invitation_expired(invitation: crud.Row) -> Iterable[tuple[str, dict[str, Any]]]:
+    event = {
+        "type": "invitation_cancelled",
+        "invitationId": invitation["id"],
+        "reason": "expired",
+    }
+    return [
+        (events.user_channel(invitation["from_id"]), event),
+        (events.user_channel(invitation["to_id"]), event),
+    ]
+
+
+async def expire_stale(redis: Redis) -> tuple[int, int] | None:
+    """
+    Cancel the challenges and invitations pending for longer than
+    CONFIG.challenge_ttl and CONFIG.invitation_ttl, telling the users involved.
+    Returns the number of challenges and invitations cancelled, or None if
+    another process is sweeping.
+    """
+    # a sweep outliving the lock is harmless, rows already cancelled or locked by
+    # another sweep are skipped
+    lock = redis.lock("expiry:lock", timeout=300)
+    if not await lock.acquire(blocking=False):
+        return None
+    try:
+        challenges = await _expire(
+            redis, crud.expire_challenges, CONFIG.challenge_ttl, _challenge_expired
+        )
+        invitations = await _expire(
+            redis, crud.expire_invitations, CONFIG.invitation_ttl, _invitation_expired
+        )
+        return challenges, invitations
+    finally:
+        try:
+            await lock.release()
+        except LockError:
+            logger.warning("expiry lock expired before the sweep ended")
+
+
+async def run_expiry_sweeper(redis: Redis):
+    """Expire stale challenges and invitations every CONFIG.expiry_sweep_interval."""
+    while True:
+        try:
+            await expire_stale(redis)
+        except (RedisError, SQLAlchemyError):
+            logger.exception("failed to expire stale challenges and invitations")
+        await asyncio.sleep(CONFIG.expiry_sweep_interval)
+
 
 @asynccontextmanager
 async def lifespan(app_: FastAPI):
     """Setup DB and Redis"""
-    await models.init_db()
+    # drop any pooled connections inherited from a parent process, this process
+    # opens its own
+    await db.async_engine.dispose(close=False)
+    if db.async_read_engine is not db.async_engine:
+        await db.async_read_engine.dispose(close=False)
+
+    if db.is_memory_sqlite(db.async_engine.url):
+        # nothing persists between runs, so there is nothing to check
+        await migrations.migrate()
+    else:
+        await migrations.check_version()
 
     app_.state.redis = Redis.from_url(
         CONFIG.redis_url,
         decode_responses=True,
     )
 
+    # built in the background, lookups go to the database until it's ready
+    bloom.user_filter = bloom.create_user_filter(app_.state.redis)
+    building = (
+        asyncio.create_task(build_user_filter(bloom.user_filter))
+        if bloom.user_filter is not None
+        else None
+    )
+    # lookups answer 503 until it's built
+    leaderboard.board = leaderboard.Leaderboard(app_.state.redis)
+    building_leaderboard = asyncio.create_task(build_leaderboard(leaderboard.board))
+    matchmaking.queue = matchmaking.MatchmakingQueue(app_.state.redis)
+    matching = asyncio.create_task(run_matchmaking(matchmaking.queue))
+    sweeping = asyncio.create_task(run_expiry_sweeper(app_.state.redis))
+
     try:
         yield
     finally:
+        if building is not None:
+            building.cancel()
+        bloom.user_filter = None
+        building_leaderboard.cancel()
+        leaderboard.board = None
+        matching.cancel()
+        matchmaking.queue = None
+        sweeping.cancel()
         await app_.state.redis.aclose()
+        metrics.mark_worker_dead()
         await db.async_engine.dispose()
+        if db.async_read_engine is not db.async_engine:
+            await db.async_read_engine.dispose()
 
 
 app = FastAPI(
     title=CONFIG.app_name,
     lifespan=lifespan,
+    default_response_class=serialization.DefaultResponse,
     version=importlib.metadata.version("chessticulate_api"),
 )
 
@@ -45,12 +257,34 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # response headers browsers let clients read, beyond the CORS safelisted ones
+    expose_headers=["ETag", "X-Missing-Ids"],
 )
 
+app.add_middleware(
+    compression.CompressionMiddleware,
+    minimum_size=CONFIG.compression_min_size,
+    gzip_level=CONFIG.compression_gzip_level,
+    brotli_quality=CONFIG.compression_brotli_quality,
+)
+
+# per route request counts, sizes and latencies, and requests in progress
+Instrumentator(
+    should_instrument_requests_inprogress=True,
+    inprogress_labels=True,
+    excluded_handlers=["/metrics"],
+).instrument(app)
+
+app.add_middleware(query_stats.QueryStatsMiddleware)
+
+if CONFIG.server_timing:
+    app.add_middleware(server_timing.ServerTimingMiddleware)
+
 app.include_router(routers.user_router)
 app.include_router(routers.invitation_router)
 app.include_router(routers.game_router)
 app.include_router(routers.challenge_router)
+app.include_router(routers.leaderboard_router)
 
 
 @app.get("/", include_in_schema=False)
@@ -61,7 +295,8 @@ async def docs_redirect():
 
 @app.post("/login")
 async def login(
-    session: Annotated[AsyncSession, Depends(db.session)], payload: schemas.LoginRequest
+    session: Annotated[AsyncSession, Depends(db.session, scope="function")],
+    payload: schemas.LoginRequest,
 ) -> schemas.LoginResponse:
     """Given valid user credentials, generate JWT."""
     if not (token := await crud.login(session, payload.name, payload.password)):
@@ -71,26 +306,28 @@ async def login(
 
 @app.post("/signup", status_code=201)
 async def signup(
-    session: Annotated[AsyncSession, Depends(db.session)],
+    request: Request,
+    session: Annotated[AsyncSession, Depends(db.session, scope="function")],
     payload: schemas.CreateUserRequest,
 ) -> schemas.GetOwnUserResponse:
     """Create a new user account."""
-    if await crud.get_users(session, name=payload.name):
-        raise HTTPException(
-            status_code=400, detail="user with same name already exists"
-        )
-    if await crud.get_users(session, name=payload.email):
-        raise HTTPException(
-            status_code=400, detail="user with same name already exists"
+    # the session only takes a connection with its first statement, after bcrypt
+    password_hash = await crud.hash_password(payload.password)
+    try:
+        user = await crud.create_user(
+            session, payload.name, payload.email, password_hash
         )
-    user = await crud.create_user(
-        session, payload.name, payload.email, payload.password
-    )
+    except crud.UserExistsError as exc:
+        raise HTTPException(status_code=400, detail=str(exc)) from exc
 
+    # the request carries no token, the session pins the new user's reads once
+    # it commits
+    request.state.user_id = user.id_
     return schemas.GetOwnUserResponse(**vars(user))
 
 
 @app.get("/metrics")
-def metrics():
+def get_metrics():
     """Prometheus metrics for Grafana dashboards"""
-    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+    content, media_type = metrics.render()
+    return Response(content, media_type=media_type)
@@ -0,0 +1,280 @@
+"""chessticulate_api.bloom"""
+
+import hashlib
+import logging
+import math
+from typing import AsyncIterable, AsyncIterator, Iterator
+
+from redis.asyncio import Redis
+from redis.asyncio.lock import Lock
+from redis.exceptions import LockError, LockNotOwnedError, RedisError
+
+from chessticulate_api import metrics
+from chessticulate_api.config import CONFIG
+
+logger = logging.getLogger(__name__)
+
+# set the bits of an item in the filter, and in the filter being rebuilt if there
+# is one. filters which don't exist are left alone, a filter holding only the
+# users added since it was lost would turn every other lookup into a negative
+_ADD_SCRIPT = """
+for _, key in ipairs(KEYS) do
+    if redis.call('EXISTS', key) == 1 then
+        for _, offset in ipairs(ARGV) do
+            redis.call('SETBIT', key, offset, 1)
+        end
+    end
+end
+"""
+
+# 0 if the filter exists and one of the item's bits is unset, otherwise 1
+_CONTAINS_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return 1
+end
+for _, offset in ipairs(ARGV) do
+    if redis.call('GETBIT', KEYS[1], offset) == 0 then
+        return 0
+    end
+end
+return 1
+"""
+
+
+def parameters(capacity: int, error_rate: float) -> tuple[int, int]:
+    """
+    Number of bits and of hash functions of a Bloom filter holding `capacity`
+    items with a false positive rate of `error_rate`.
+    """
+    bits = math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+    hashes = max(1, round(bits / capacity * math.log(2)))
+    return bits, hashes
+
+
+def offsets(item: str, size: int, hashes: int) -> list[int]:
+    """Bit offsets of `item` in a filter, double hashing a single blake2b digest."""
+    digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+    h1 = int.from_bytes(digest[:8], "little")
+    h2 = int.from_bytes(digest[8:], "little") | 1
+    return [(h1 + i * h2) % size for i in range(hashes)]
+
+
+class BloomFilter:
+    """
+    Bloom filter kept in a bytearray.
+
+    Bits are numbered from the most significant bit of the first byte, like
+    Redis' SETBIT numbers them, so the bytes can be stored as a Redis string.
+    """
+
+    def __init__(self, capacity: int, error_rate: float):
+        self.size, self.hashes = parameters(capacity, error_rate)
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def add(self, item: str):
+        """Add `item` to the filter."""
+        for offset in offsets(item, self.size, self.hashes):
+            self.bits[offset >> 3] |= 0x80 >> (offset & 7)
+
+    def __contains__(self, item: str) -> bool:
+        return all(
+            self.bits[offset >> 3] & (0x80 >> (offset & 7))
+            for offset in offsets(item, self.size, self.hashes)
+        )
+
+
+def _items(name: str, email: str | None) -> Iterator[str]:
+    """Filter items of a user, names and emails share a filter."""
+    yield f"name:{name}"
+    if email is not None:
+        yield f"email:{email}"
+
+
+class UserFilter:
+    """
+    Bloom filter of taken usernames and emails, kept in process.
+
+    Answers whether a name or email might be taken: False means it definitely
+    isn't, True that it has to be confirmed in the database. Until the filter is
+    first built every lookup answers True. Deleted users free up their email but
+    their bits stay set until the next rebuild, which is harmless, they're only
+    confirmed in the database.
+
+    Every process keeps its own filter and only sees the users it creates itself,
+    so it must only be used with a single worker process.
+    """
+
+    def __init__(self, capacity: int, error_rate: float):
+        # a user takes up to two items, their name and email
+        self.capacity = 2 * capacity
+        self.error_rate = error_rate
+        self._filter: BloomFilter | None = None
+        # filter being rebuilt, users created meanwhile are added to it as well
+        self._next: BloomFilter | None = None
+
+    async def is_built(self) -> bool:
+        """Whether the filter has been built and is answering lookups."""
+        return self._filter is not None
+
+    async def add(self, name: str, email: str | None):
+        """Add a new user's name and email."""
+        for item in _items(name, email):
+            for bloom in (self._filter, self._next):
+                if bloom is not None:
+                    bloom.add(item)
+
+    async def _might_contain(self, item: str) -> bool:
+        return self._filter is None or item in self._filter
+
+    async def might_have_name(self, name: str) -> bool:
+        """Whether `name` might be taken."""
+        return await self._might_contain(f"name:{name}")
+
+    async def might_have_email(self, email: str) -> bool:
+        """Whether `email` might be taken."""
+        return await self._might_contain(f"email:{email}")
+
+    async def _build(self, users: AsyncIterable[tuple[str, str | None]]) -> int:
+        """Add the streamed names and emails to `_next`, returning the count."""
+        assert self._next is not None
+        count = 0
+        async for name, email in users:
+            for item in _items(name, email):
+                self._next.add(item)
+            count += 1
+        return count
+
+    async def rebuild(self, users: AsyncIterable[tuple[str, str | None]]) -> int | None:
+        """
+        Replace the filter with one built from the (name, email) pairs of every
+        user. Returns the number of users, or None if a rebuild is already running.
+        """
+        if self._next is not None:
+            return None
+        self._next = BloomFilter(self.capacity, self.error_rate)
+        try:
+            count = await self._build(users)
+            self._filter = self._next
+        finally:
+            self._next = None
+        return count
+
+
+class RedisUserFilter(UserFilter):
+    """
+    Bloom filter of taken usernames and emails, kept in Redis and shared by every
+    worker process.
+
+    The key names the filter's size, so workers configured for a different
+    capacity or error rate use, and build, a filter of their own. Redis errors on
+    lookups are logged and answered as maybe taken, errors adding users are
+    logged, the user's signup still goes through.
+    """
+
+    def __init__(
+        self,
+        redis: Redis,
+        capacity: int,
+        error_rate: float,
+        key: str = "users:bloom",
+    ):
+        super().__init__(capacity, error_rate)
+        self.redis = redis
+        self.size, self.hashes = parameters(self.capacity, error_rate)
+        self.key = f"{key}:{self.size}:{self.hashes}"
+        self._add_script = redis.register_script(_ADD_SCRIPT)
+        self._contains_script = redis.register_script(_CONTAINS_SCRIPT)
+
+    async def is_built(self) -> bool:
+        return bool(await self.redis.exists(self.key))
+
+    @metrics.timed(metrics.REDIS_SECONDS, "bloom_add", timing="redis")
+    async def add(self, name: str, email: str | None):
+        bits = [
+            offset
+            for item in _items(name, email)
+            for offset in offsets(item, self.size, self.hashes)
+        ]
+        try:
+            await self._add_script(keys=[self.key, f"{self.key}:next"], args=bits)
+        except RedisError:
+            # a missed user is only a false negative, their signup still hits
+            # the unique constraints
+            logger.exception("failed to add user %s to the user filter", name)
+
+    @metrics.timed(metrics.REDIS_SECONDS, "bloom_check", timing="redis")
+    async def _might_contain(self, item: str) -> bool:
+        try:
+            return bool(
+                await self._contains_script(
+                    keys=[self.key], args=offsets(item, self.size, self.hashes)
+                )
+            )
+        except RedisError:
+            logger.exception("user filter lookup failed, falling back to the db")
+            return True
+
+    async def rebuild(self, users: AsyncIterable[tuple[str, str | None]]) -> int | None:
+        """
+        Replace the filter with one built from the (name, email) pairs of every
+        user. Returns the number of users, or None if another process is
+        rebuilding it or took the rebuild over.
+
+        The new filter is built in process and uploaded. Users created meanwhile
+        are added to a `:next` key, which the uploaded bits are merged into before
+        it's renamed over the filter. The lock is extended as users are streamed,
+        a rebuild which loses it anyway leaves the `:next` key to whichever
+        rebuild holds it now.
+        """
+        lock = self.redis.lock(f"{self.key}:lock", timeout=600)
+        if not await lock.acquire(blocking=False):
+            return None
+        next_key, built_key = f"{self.key}:next", f"{self.key}:built"
+        try:
+            # from here on, new users are added to the next filter as well
+            await self.redis.setbit(next_key, self.size - 1, 0)
+            self._next = BloomFilter(self.capacity, self.error_rate)
+            count = await self._build(_extending(lock, users))
+            await lock.reacquire()
+            await self.redis.set(built_key, bytes(self._next.bits))
+            await self.redis.bitop("OR", next_key, next_key, built_key)
+            await self.redis.rename(next_key, self.key)
+            return count
+        except LockNotOwnedError:
+            logger.warning("user filter lock expired during the rebuild, giving up")
+            return None
+        finally:
+            self._next = None
+            if await lock.owned():
+                await self.redis.delete(next_key, built_key)
+                try:
+                    await lock.release()
+                except LockError:
+                    logger.warning("user filter lock expired before the rebuild ended")
+
+
+async def _extending(
+    lock: Lock, users: AsyncIterable[tuple[str, str | None]], every: int = 10_000
+) -> AsyncIterator[tuple[str, str | None]]:
+    """Stream `users`, extending `lock` every `every` users."""
+    count = 0
+    async for user in users:
+        yield user
+        count += 1
+        if count % every == 0:
+            await lock.reacquire()
+
+
+# filter answering username and email availability checks, set up at startup
+user_filter: UserFilter | None = None  # pylint: disable=invalid-name
+
+
+def create_user_filter(redis: Redis) -> UserFilter | None:
+    """Create the user filter CONFIG asks for, None if it's turned off."""
+    if CONFIG.user_filter == "redis":
+        return RedisUserFilter(
+            redis, CONFIG.user_filter_capacity, CONFIG.user_filter_error_rate
+        )
+    if CONFIG.user_filter == "memory":
+        return UserFilter(CONFIG.user_filter_capacity, CONFIG.user_filter_error_rate)
+    return None
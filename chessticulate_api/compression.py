@@ -0,0 +1,89 @@
+"""chessticulate_api.compression"""
+
+from starlette.datastructures import Headers
+from starlette.middleware.gzip import GZipResponder, IdentityResponder
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None  # pylint: disable=invalid-name
+
+
+class BrotliResponder(IdentityResponder):
+    """Brotli counterpart of starlette's GZipResponder."""
+
+    content_encoding = "br"
+
+    def __init__(self, app: ASGIApp, minimum_size: int, quality: int):
+        super().__init__(app, minimum_size)
+        # pylint: disable=no-member
+        self.compressor = brotli.Compressor(mode=brotli.MODE_TEXT, quality=quality)
+
+    def apply_compression(self, body: bytes, *, more_body: bool) -> bytes:
+        body = self.compressor.process(body)
+        # flush streamed chunks, so clients aren't kept waiting on the compressor
+        if more_body:
+            return body + self.compressor.flush()
+        return body + self.compressor.finish()
+
+
+def _accepted_encodings(accept_encoding: str) -> set[str]:
+    """Content codings an Accept-Encoding header allows, q=0 ones excluded."""
+    accepted = set()
+    for item in accept_encoding.lower().split(","):
+        coding, *params = item.split(";")
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if quality > 0:
+            accepted.add(coding.strip())
+    return accepted
+
+
+class CompressionMiddleware:  # pylint: disable=too-few-public-methods
+    """
+    Compress responses of at least `minimum_size` bytes with brotli or gzip,
+    whichever the client accepts, brotli first. Brotli is only offered when the
+    `brotli` package is installed.
+
+    Server-sent event streams (text/event-stream) are never compressed, the
+    compressor would hold back events until enough data accumulates.
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        minimum_size: int = 1024,
+        gzip_level: int = 3,
+        brotli_quality: int = 3,
+    ):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        accepted = _accepted_encodings(Headers(scope=scope).get("Accept-Encoding", ""))
+        responder: ASGIApp
+        if brotli is not None and "br" in accepted:
+            responder = BrotliResponder(
+                self.app, self.minimum_size, quality=self.brotli_quality
+            )
+        elif "gzip" in accepted:
+            responder = GZipResponder(
+                self.app, self.minimum_size, compresslevel=self.gzip_level
+            )
+        else:
+            responder = IdentityResponder(self.app, self.minimum_size)
+
+        await responder(scope, receive, send)
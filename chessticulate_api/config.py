@@ -15,6 +15,25 @@ class CONFIG:  # pylint: disable=too-few-public-methods
     app_host: str = os.environ.get("APP_HOST", "localhost")
     app_port: int = int(os.environ.get("APP_PORT", 8000))
     log_level: str = os.environ.get("LOG_LEVEL", "info")
+
+    # uvicorn serving options
+    app_workers: int = int(os.environ.get("APP_WORKERS", 1))
+    # "auto", "asyncio" or "uvloop"
+    app_loop: str = os.environ.get("APP_LOOP", "auto")
+    # "auto", "h11" or "httptools"
+    app_http: str = os.environ.get("APP_HTTP", "auto")
+    app_backlog: int = int(os.environ.get("APP_BACKLOG", 2048))
+    app_keep_alive: int = int(os.environ.get("APP_KEEP_ALIVE", 5))
+    # seconds to wait for in flight requests on shutdown, 0 waits forever
+    app_graceful_timeout: int = int(os.environ.get("APP_GRACEFUL_TIMEOUT", 30))
+    # responses of at least this many bytes are compressed with brotli or gzip.
+    # level 3 keeps most of the size reduction of higher levels at a fraction of
+    # the CPU, see benchmarks/compression.py
+    compression_min_size: int = int(os.environ.get("COMPRESSION_MIN_SIZE", 1024))
+    compression_gzip_level: int = int(os.environ.get("COMPRESSION_GZIP_LEVEL", 3))
+    compression_brotli_quality: int = int(
+        os.environ.get("COMPRESSION_BROTLI_QUALITY", 3)
+    )
     cors_origins: list[str] = json.loads(
         os.environ.get(
             "CORS_ORIGINS", '["https://chess.brgdev.xyz", "http://localhost:3000"]'
@@ -25,6 +44,27 @@ class CONFIG:  # pylint: disable=too-few-public-methods
     sql_conn_str: str = os.environ.get("SQL_CONN_STR", "sqlite+aiosqlite:///:memory:")
     sql_echo: bool = os.environ.get("SQL_ECHO") == "TRUE"
 
+    # optional read replica used by read only endpoints
+    sql_read_conn_str: str | None = os.environ.get("SQL_READ_CONN_STR") or None
+    # seconds a user's reads stay on the primary after one of their writes,
+    # tracked in Redis so every worker sees it. 0 disables read-your-writes pinning
+    sql_read_your_writes: float = float(os.environ.get("SQL_READ_YOUR_WRITES", 0))
+
+    # connection pool tuning, ignored for in-memory sqlite databases
+    sql_pool_size: int = int(os.environ.get("SQL_POOL_SIZE", 5))
+    sql_max_overflow: int = int(os.environ.get("SQL_MAX_OVERFLOW", 10))
+    sql_pool_timeout: float = float(os.environ.get("SQL_POOL_TIMEOUT", 30))
+    sql_pool_recycle: int = int(os.environ.get("SQL_POOL_RECYCLE", -1))
+    # asyncpg prepared statement cache size, set to 0 behind pgbouncer
+    sql_statement_cache_size: int = int(os.environ.get("SQL_STATEMENT_CACHE_SIZE", 100))
+
+    # return per request SQL statement counts and timings as X-SQL-* headers
+    sql_debug_headers: bool = os.environ.get("SQL_DEBUG_HEADERS") == "TRUE"
+    # log requests running the same statement more often than this, likely N+1s
+    sql_repeated_query_threshold: int = int(
+        os.environ.get("SQL_REPEATED_QUERY_THRESHOLD", 5)
+    )
+
     jwt_ttl: int = int(os.environ.get("JWT_TTL", 7))
     jwt_secret: str = os.environ.get("JWT_SECRET", "secret")
     jwt_algo: str = os.environ.get("JWT_ALGO", "HS256")
@@ -32,5 +72,44 @@ class CONFIG:  # pylint: disable=too-few-public-methods
     # chess workers service url
     workers_base_url: str = os.environ.get("WORKERS_URL", "http://localhost:8001")
 
+    # directory worker processes share prometheus metrics through. set by
+    # `chess-api` itself when serving with more than one worker
+    prometheus_multiproc_dir: str | None = (
+        os.environ.get("PROMETHEUS_MULTIPROC_DIR") or None
+    )
+
+    # add a Server-Timing header breaking down where each request spent its time
+    server_timing: bool = os.environ.get("SERVER_TIMING") == "TRUE"
+
     # redis url
     redis_url: str = os.environ.get("REDIS_URL", "redis://localhost:6379/0")
+
+    # bloom filter of taken usernames and emails answering availability checks.
+    # "redis" shares one between workers, "memory" keeps one per process, which is
+    # only correct with a single worker, "off" checks the database every time
+    user_filter: str = os.environ.get("USER_FILTER", "redis")
+    # users the filter is sized for, and its false positive rate at that many
+    user_filter_capacity: int = int(os.environ.get("USER_FILTER_CAPACITY", 1_000_000))
+    user_filter_error_rate: float = float(
+        os.environ.get("USER_FILTER_ERROR_RATE", 0.01)
+    )
+
+    # user id to username entries cached per process, list queries look usernames
+    # up here rather than joining the users table. 0 turns the cache off
+    username_cache_size: int = int(os.environ.get("USERNAME_CACHE_SIZE", 100_000))
+
+    # most Elo rating points a player wins or loses with a game
+    rating_k_factor: float = float(os.environ.get("RATING_K_FACTOR", 32))
+
+    # seconds between rounds of pairing up the players waiting in the matchmaking
+    # queue, and the most players of each game type paired per round
+    matchmaking_tick: float = float(os.environ.get("MATCHMAKING_TICK", 1))
+    matchmaking_batch_size: int = int(os.environ.get("MATCHMAKING_BATCH_SIZE", 10_000))
+
+    # seconds pending challenges and invitations stay open before the sweeper
+    # cancels them, 0 keeps them open forever
+    challenge_ttl: int = int(os.environ.get("CHALLENGE_TTL", 3600))
+    invitation_ttl: int = int(os.environ.get("INVITATION_TTL", 7 * 24 * 3600))
+    # seconds between sweeps, and the most rows cancelled per transaction
+    expiry_sweep_interval: float = float(os.environ.get("EXPIRY_SWEEP_INTERVAL", 60))
+    expiry_batch_size: int = int(os.environ.get("EXPIRY_BATCH_SIZE", 1000))
@@ -1,40 +1,387 @@
 """chessticulate_api.crud"""
 
+# pylint: disable=too-many-lines
+
+import asyncio
+import functools
 import random
 from datetime import datetime, timedelta, timezone
-from typing import TypeAlias
+from typing import Any, AsyncIterator, Iterable, TypeAlias
 
 import bcrypt
 import jwt
 from pydantic import SecretStr
-from sqlalchemy import or_, select, update
+from sqlalchemy import (
+    Select,
+    Update,
+    bindparam,
+    case,
+    false,
+    func,
+    or_,
+    select,
+    true,
+    union_all,
+    update,
+)
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import aliased
 
-from chessticulate_api import models, schemas
+from chessticulate_api import (
+    bloom,
+    leaderboard,
+    metrics,
+    models,
+    rating,
+    schemas,
+    server_timing,
+    usernames,
+)
 from chessticulate_api.config import CONFIG
 
 WhiteUsername: TypeAlias = str
 BlackUsername: TypeAlias = str
 RequesterUsername: TypeAlias = str
 MoveList: TypeAlias = list[str]
+# plain result row keyed by column name, as returned by the get_*_rows functions
+Row: TypeAlias = dict[str, Any]
+
+# max number of distinct query shapes cached per query builder
+STATEMENT_CACHE_SIZE = 128
+
+# INSERT constructs supporting ON CONFLICT DO NOTHING, by dialect
+_CONFLICT_INSERTS = {"postgresql": postgresql.insert, "sqlite": sqlite.insert}
+
+
+class UserExistsError(Exception):
+    """Raised when creating a user whose name or email is already taken."""
+
+    def __init__(self, fields: list[str]):
+        self.fields = fields
+        super().__init__(f"user with same {' and '.join(fields)} already exists")
+
+
+# columns left out of plain row queries: secrets, and the game state blob which
+# only the move endpoint needs
+_UNLISTED_COLUMNS = {"password", "states"}
+
+
+def _column(model: type[models.Base], key: str, core: bool):
+    """
+    Look up a mapped attribute of `model` by name.
+
+    Plain row queries use the underlying table column, so that the statement stays
+    a Core statement and its results skip the ORM entirely.
+    """
+    return model.__mapper__.columns[key] if core else getattr(model, key)
+
+
+def _entity(
+    model: type[models.Base], core: bool, fields: tuple[str, ...] | None = None
+) -> tuple:
+    """
+    Select the ORM entity, or the public columns of its table.
+
+    Plain row queries can be narrowed to the columns in `fields`, the primary key
+    is always selected.
+    """
+    if not core:
+        return (model,)
+    return tuple(
+        c
+        for c in model.__table__.c
+        if c.key not in _UNLISTED_COLUMNS
+        and (fields is None or c.key == "id" or c.key in fields)
+    )
+
+
+def _wants(fields: tuple[str, ...] | None, field: str) -> bool:
+    """Whether a list query was asked for `field`, None meaning every field."""
+    return fields is None or field in fields
+
+
+# username fields of list queries, and the player id column each is looked up by.
+# usernames come from the username cache rather than joins on the users table
+_USERNAME_COLUMNS = {
+    models.Invitation: {"white_username": "to_id", "black_username": "from_id"},
+    models.Game: {"white_username": "white", "black_username": "black"},
+    models.ChallengeRequest: {"requester_username": "requester_id"},
+}
+
+_USERNAMES_STMT = select(
+    _column(models.User, "id_", True), _column(models.User, "name", True)
+).where(_column(models.User, "id_", True).in_(bindparam("ids", expanding=True)))
+
+
+def _row_fields(
+    model: type[models.Base], fields: tuple[str, ...] | None
+) -> tuple[str, ...] | None:
+    """
+    Columns a plain row query selects for `fields`. Usernames aren't columns, the
+    player id columns they're looked up by are selected in their place.
+    """
+    if fields is None:
+        return None
+    columns = _USERNAME_COLUMNS[model]
+    return tuple(sorted({columns.get(field, field) for field in fields}))
+
+
+async def _usernames(session: AsyncSession, ids: Iterable[int]) -> dict[int, str]:
+    """
+    Look up usernames by user id in the username cache. Ids it doesn't hold are
+    fetched with a single query and cached.
+    """
+    names, missing = usernames.cache.lookup(ids)
+    if missing:
+        result = await session.execute(_USERNAMES_STMT, {"ids": list(missing)})
+        fetched = dict(result.all())
+        usernames.cache.update(fetched)
+        names.update(fetched)
+    return names
+
+
+async def _set_usernames(
+    session: AsyncSession, model: type[models.Base], objs: list[Any]
+):
+    """Set the username attributes of ORM objects of `model`."""
+    columns = _USERNAME_COLUMNS[model]
+    names = await _usernames(
+        session, {getattr(obj, column) for obj in objs for column in columns.values()}
+    )
+    for obj in objs:
+        for label, column in columns.items():
+            setattr(obj, label, names.get(getattr(obj, column)))
+
+
+async def _add_usernames(
+    session: AsyncSession,
+    model: type[models.Base],
+    rows: list[Row],
+    fields: tuple[str, ...] | None,
+):
+    """
+    Add the username fields asked for to plain rows of `model`, dropping player id
+    columns which were only selected to look them up.
+    """
+    columns = {
+        label: column
+        for label, column in _USERNAME_COLUMNS[model].items()
+        if _wants(fields, label)
+    }
+    if not columns:
+        return
+    names = await _usernames(
+        session, {row[column] for row in rows for column in columns.values()}
+    )
+    unwanted = set() if fields is None else set(columns.values()).difference(fields)
+    for row in rows:
+        for label, column in columns.items():
+            row[label] = names.get(row[column])
+        for column in unwanted:
+            del row[column]
+
+
+# pylint: disable=too-many-arguments, disable=too-many-positional-arguments
+def _finish_stmt(
+    stmt: Select,
+    model: type[models.Base],
+    order_by: str,
+    reverse: bool,
+    lock_rows: bool,
+    core: bool,
+) -> Select:
+    """Apply ordering, bound offset/limit and row locking to a list query."""
+    order_attr = _column(model, order_by, core)
+    stmt = stmt.order_by(order_attr.desc() if reverse else order_attr.asc())
+    stmt = stmt.offset(bindparam("skip")).limit(bindparam("limit"))
+
+    if lock_rows:
+        stmt = stmt.with_for_update()
+
+    return stmt
+
+
+@functools.lru_cache(maxsize=STATEMENT_CACHE_SIZE)
+def _users_stmt(
+    filters: tuple[str, ...],
+    order_by: str,
+    reverse: bool,
+    lock_rows: bool,
+    core: bool = False,
+    fields: tuple[str, ...] | None = None,
+) -> Select:
+    """Build the get_users query for a given filter shape."""
+    stmt = select(*_entity(models.User, core, fields))
+    for k in filters:
+        # a list of ids is matched with a single IN, expanded per call
+        if k == "ids":
+            id_ = _column(models.User, "id_", core)
+            stmt = stmt.where(id_.in_(bindparam(k, expanding=True)))
+        else:
+            stmt = stmt.where(_column(models.User, k, core) == bindparam(k))
+    return _finish_stmt(stmt, models.User, order_by, reverse, lock_rows, core)
+
+
+@functools.lru_cache(maxsize=STATEMENT_CACHE_SIZE)
+def _invitations_stmt(
+    filters: tuple[str, ...],
+    order_by: str,
+    reverse: bool,
+    lock_rows: bool,
+    core: bool = False,
+    fields: tuple[str, ...] | None = None,
+) -> Select:
+    """Build the get_invitations query for a given filter shape."""
+    stmt = select(*_entity(models.Invitation, core, fields))
+    for k in filters:
+        stmt = stmt.where(_column(models.Invitation, k, core) == bindparam(k))
+
+    return _finish_stmt(stmt, models.Invitation, order_by, reverse, lock_rows, core)
+
+
+@functools.lru_cache(maxsize=STATEMENT_CACHE_SIZE)
+def _games_stmt(
+    filters: tuple[str, ...],
+    order_by: str,
+    reverse: bool,
+    lock_rows: bool,
+    core: bool = False,
+    fields: tuple[str, ...] | None = None,
+) -> Select:
+    """Build the get_games query for a given filter shape."""
+    white = _column(models.Game, "white", core)
+    black = _column(models.Game, "black", core)
+
+    stmt = select(*_entity(models.Game, core, fields))
+    for k in filters:
+        # if player_id is included in request,
+        # we want to query all games and return any where player_id == white or black
+        if k == "player_id":
+            stmt = stmt.where(or_(white == bindparam(k), black == bindparam(k)))
+        else:
+            stmt = stmt.where(_column(models.Game, k, core) == bindparam(k))
+
+    return _finish_stmt(stmt, models.Game, order_by, reverse, lock_rows, core)
+
+
+@functools.lru_cache(maxsize=STATEMENT_CACHE_SIZE)
+def _challenges_stmt(
+    filters: tuple[str, ...],
+    order_by: str,
+    reverse: bool,
+    lock_rows: bool,
+    core: bool = False,
+    fields: tuple[str, ...] | None = None,
+) -> Select:
+    """Build the get_challenges query for a given filter shape."""
+    stmt = select(*_entity(models.ChallengeRequest, core, fields))
+    for k in filters:
+        stmt = stmt.where(_column(models.ChallengeRequest, k, core) == bindparam(k))
+
+    return _finish_stmt(
+        stmt, models.ChallengeRequest, order_by, reverse, lock_rows, core
+    )
+
+
+@functools.lru_cache(maxsize=2)
+def _search_users_stmt(trigrams: bool) -> Select:
+    """
+    Build the search_users query, ranking exact matches first, then prefix
+    matches, then trigram matches when `trigrams` is set, or else substring
+    matches.
+    """
+    users = models.User.__table__
+    name = func.lower(users.c.name)
+    prefix = name.like(bindparam("prefix"), escape="/")
+    stmt = select(*_entity(models.User, True)).where(users.c.deleted == false())
+
+    if trigrams:
+        fuzzy = name.op("%")(bindparam("query"))
+        order: tuple = (func.similarity(name, bindparam("query")).desc(),)
+    else:
+        fuzzy = name.like(bindparam("substring"), escape="/")
+        order = ()
+
+    rank = case((name == bindparam("query"), 0), (prefix, 1), else_=2)
+    return (
+        stmt.where(or_(prefix, fuzzy))
+        .order_by(rank, *order, func.length(users.c.name), name)
+        .limit(bindparam("limit"))
+    )
+
+
+_MOVE_HISTS_STMT = (
+    select(models.Move.__table__.c.game_id, models.Move.__table__.c.movestr)
+    .where(models.Move.__table__.c.game_id.in_(bindparam("game_ids", expanding=True)))
+    .order_by(models.Move.__table__.c.id)
+)
+
+
+_GAME_VERSION_STMT = select(
+    models.Game.__table__.c.id,
+    models.Game.__table__.c.last_active,
+    models.Game.__table__.c.is_active,
+).where(models.Game.__table__.c.id == bindparam("id_"))
+
+
+# ratings of the players of a game being ended, locked in id order so that two
+# games ending at once can't deadlock
+_PLAYER_RATINGS_STMT = (
+    select(models.User.__table__.c.id, models.User.__table__.c.rating)
+    .where(models.User.__table__.c.id.in_(bindparam("ids", expanding=True)))
+    .order_by(models.User.__table__.c.id)
+    .with_for_update()
+)
+
+
+def _timed(fn):
+    """Record the duration of every call to a crud function."""
+    return metrics.timed(metrics.CRUD_SECONDS, fn.__name__, timing="db")(fn)
+
+
+async def _move_hists(
+    session: AsyncSession, game_ids: list[int]
+) -> dict[int, MoveList]:
+    """Move histories of several games, with a single query."""
+    move_hists: dict[int, MoveList] = {game_id: [] for game_id in game_ids}
+    if not game_ids:
+        return move_hists
+
+    moves = await session.execute(_MOVE_HISTS_STMT, {"game_ids": game_ids})
+    for game_id, movestr in moves:
+        move_hists[game_id].append(movestr)
+    return move_hists
 
 
 def _hash_password(pswd: SecretStr) -> str:
     """Hash password using bcrypt."""
-    return bcrypt.hashpw(  # pylint: disable=no-member  # pyright: ignore
-        pswd.get_secret_value(), bcrypt.gensalt()
-    )
+    with metrics.BCRYPT_SECONDS.labels("hash").time(), server_timing.timer("bcrypt"):
+        return bcrypt.hashpw(  # pylint: disable=no-member  # pyright: ignore
+            pswd.get_secret_value(), bcrypt.gensalt()
+        )
+
+
+async def hash_password(pswd: SecretStr) -> str:
+    """
+    Hash password using bcrypt, in a worker thread so the event loop isn't blocked.
+
+    Call it before the session that stores the hash runs its first statement, so no
+    connection is held while bcrypt runs.
+    """
+    return await asyncio.to_thread(_hash_password, pswd)
 
 
 def _check_password(pswd: SecretStr, pswd_hash: str) -> bool:
     """Compare password with password hash using bcrypt."""
-    return bcrypt.checkpw(  # pylint: disable=no-member  # pyright: ignore
-        pswd.get_secret_value(), pswd_hash
-    )
+    with metrics.BCRYPT_SECONDS.labels("check").time(), server_timing.timer("bcrypt"):
+        return bcrypt.checkpw(  # pylint: disable=no-member  # pyright: ignore
+            pswd.get_secret_value(), pswd_hash
+        )
 
 
 # pylint: disable=too-many-arguments, disable=too-many-positional-arguments
+@_timed
 async def get_users(
     session: AsyncSession,
     skip: int = 0,
@@ -52,39 +399,168 @@ async def get_users(
         get_users(id_=10)
         get_users(name="user10")
 
+        # get several users by ID at once
+        get_users(ids=[3, 1, 2], limit=3)
+
         # get top five winning users
         get_users(skip=0, limit=5, reverse=True, order_by="wins")
     """
-    stmt = select(models.User)
-    for k, v in kwargs.items():
-        stmt = stmt.where(getattr(models.User, k) == v)
+    stmt = _users_stmt(tuple(sorted(kwargs)), order_by, reverse, lock_rows)
+    params = {**kwargs, "skip": skip, "limit": limit}
 
-    order_attr = getattr(models.User, order_by)
-    stmt = stmt.order_by(order_attr.desc() if reverse else order_attr.asc())
-    stmt = stmt.offset(skip).limit(limit)
+    return (await session.execute(stmt, params)).scalars().all()
 
-    if lock_rows:
-        stmt = stmt.with_for_update()
 
-    return (await session.execute(stmt)).scalars().all()
+# pylint: disable=too-many-arguments, disable=too-many-positional-arguments
+@_timed
+async def get_user_rows(
+    session: AsyncSession,
+    skip: int = 0,
+    limit: int = 10,
+    order_by: str = "date_joined",
+    reverse: bool = False,
+    fields: Iterable[str] | None = None,
+    **kwargs,
+) -> list[Row]:
+    """
+    Retrieve a list of users from DB as plain rows, without building ORM objects.
+
+    Takes the same filters as get_users. Rows are keyed by column name, so the
+    primary key is found under "id", and don't include the password hash.
+    Passing `fields` selects only those columns, plus "id".
+    """
+    fields = None if fields is None else tuple(sorted(set(fields)))
+    stmt = _users_stmt(tuple(sorted(kwargs)), order_by, reverse, False, True, fields)
+    params = {**kwargs, "skip": skip, "limit": limit}
+
+    return [dict(row) for row in (await session.execute(stmt, params)).mappings()]
+
+
+@_timed
+async def search_users(session: AsyncSession, query: str, limit: int = 10) -> list[Row]:
+    """
+    Search users who aren't deleted by name, case insensitively, best match first.
+
+    Exact matches rank first, then names starting with `query`, then on postgres
+    names similar to it by trigram similarity, all served by the
+    ix_users_name_trgm index. Without pg_trgm, on sqlite, names containing
+    `query` rank last instead, found by scanning the table. Rows are keyed like
+    get_user_rows' rows.
+    """
+    trigrams = session.get_bind().dialect.name == "postgresql"
+    query = query.lower()
+    escaped = query.replace("/", "//").replace("%", "/%").replace("_", "/_")
+    params = {"query": query, "prefix": f"{escaped}%", "limit": limit}
+    if not trigrams:
+        params["substring"] = f"%{escaped}%"
 
+    result = await session.execute(_search_users_stmt(trigrams), params)
+    return [dict(row) for row in result.mappings()]
 
+
+@_timed
 async def create_user(
-    session: AsyncSession, name: str, email: str, pswd: SecretStr
+    session: AsyncSession, name: str, email: str, password_hash: str
 ) -> models.User:
     """
-    Create a new user.
+    Create a new user, `password_hash` as returned by hash_password.
+
+    A single INSERT ... ON CONFLICT DO NOTHING RETURNING statement, left to the
+    unique constraints on name and email rather than checking for existing users
+    beforehand, which would race with concurrent signups. Raises a UserExistsError
+    listing the fields which are already taken if the insert conflicts.
 
-    Raises a sqlalchemy.exc.IntegrityError if either name or email is already present.
+    New users are added to the filter of taken names and emails, if there is one.
     """
-    hashed_pswd = _hash_password(pswd)
-    user = models.User(name=name, email=email, password=hashed_pswd)
-    session.add(user)
-    await session.flush()
-    await session.refresh(user)
-    return user
+    insert = _CONFLICT_INSERTS[session.get_bind().dialect.name]
+    stmt = (
+        insert(models.User)
+        .values(name=name, email=email, password=password_hash)
+        .on_conflict_do_nothing()
+        .returning(models.User)
+    )
+    if (user := (await session.scalars(stmt)).first()) is not None:
+        if bloom.user_filter is not None:
+            await bloom.user_filter.add(name, email)
+        return user
+
+    # only conflicting signups pay for finding out which field collided
+    taken = (
+        await session.execute(
+            select(models.User.name, models.User.email).where(
+                or_(models.User.name == name, models.User.email == email)
+            )
+        )
+    ).all()
+    raise UserExistsError(
+        [
+            field
+            for field, value in (("name", name), ("email", email))
+            if any(getattr(row, field) == value for row in taken)
+        ]
+    )
+
+
+async def _user_names_and_emails(
+    session: AsyncSession, batch_size: int = 10_000
+) -> AsyncIterator[tuple[str, str | None]]:
+    """Stream the name and email of every user, deleted ones included."""
+    result = await session.stream(
+        select(models.User.name, models.User.email).execution_options(
+            yield_per=batch_size
+        )
+    )
+    async for name, email in result:
+        yield name, email
+
+
+@_timed
+async def rebuild_user_filter(
+    session: AsyncSession, user_filter: bloom.UserFilter
+) -> int | None:
+    """
+    Rebuild the filter of taken names and emails from the users table, streamed in
+    batches.
+
+    Returns the number of users, or None if the filter is already being rebuilt.
+    """
+    return await user_filter.rebuild(_user_names_and_emails(session))
+
+
+async def _user_wins(
+    session: AsyncSession, batch_size: int = 10_000
+) -> AsyncIterator[tuple[int, int]]:
+    """Stream the id and wins of every user with a win, fetched in batches."""
+    users = models.User.__table__
+    result = await session.stream(
+        select(users.c.id, users.c.wins)
+        .where(users.c.wins > 0, users.c.deleted == false())
+        .execution_options(yield_per=batch_size)
+    )
+    async for id_, wins in result:
+        yield id_, wins
 
 
+@_timed
+async def rebuild_leaderboard(
+    session: AsyncSession, board: leaderboard.Leaderboard
+) -> int | None:
+    """
+    Rebuild the leaderboard from the users table, streamed in batches.
+
+    Returns the number of users with a win, or None if the leaderboard is already
+    being rebuilt.
+    """
+    return await board.rebuild(_user_wins(session))
+
+
+@_timed
+async def get_usernames(session: AsyncSession, ids: Iterable[int]) -> dict[int, str]:
+    """Look up usernames by user id, through the username cache."""
+    return await _usernames(session, ids)
+
+
+@_timed
 async def delete_user(session: AsyncSession, id_: int) -> bool:
     """
     Delete existing user.
@@ -101,9 +577,11 @@ async def delete_user(session: AsyncSession, id_: int) -> bool:
         .values(password=None, email=None, deleted=True)
     )
     result = await session.execute(stmt)
+    usernames.cache.discard(id_)
     return result.rowcount == 1  # pyright: ignore
 
 
+@_timed
 async def login(
     session: AsyncSession, name: str, submitted_pswd: SecretStr
 ) -> str | None:
@@ -133,6 +611,7 @@ async def login(
     )
 
 
+@_timed
 async def create_invitation(
     session: AsyncSession,
     from_id: int,
@@ -155,6 +634,7 @@ async def create_invitation(
 
 # pylint: disable=too-many-locals
 # pylint: disable=too-many-arguments, disable=too-many-positional-arguments
+@_timed
 async def get_invitations(
     session: AsyncSession,
     skip: int = 0,
@@ -174,44 +654,53 @@ async def get_invitations(
         # get pending invitations addressed to user with ID 3
         get_invitations(skip=0, limit=5, to_id=3, status='PENDING')
     """
+    stmt = _invitations_stmt(tuple(sorted(kwargs)), order_by, reverse, lock_rows)
+    params = {**kwargs, "skip": skip, "limit": limit}
 
-    user_temp1 = aliased(models.User)
-    user_temp2 = aliased(models.User)
+    invitations = list((await session.execute(stmt, params)).scalars())
+    await _set_usernames(session, models.Invitation, invitations)
 
-    stmt = (
-        select(
-            models.Invitation,
-            user_temp1.name.label("white_username"),
-            user_temp2.name.label("black_username"),
-        )
-        .join(user_temp1, models.Invitation.to_id == user_temp1.id_)
-        .join(user_temp2, models.Invitation.from_id == user_temp2.id_)
-    )
-
-    for k, v in kwargs.items():
-        stmt = stmt.where(getattr(models.Invitation, k) == v)
-
-    order_attr = getattr(models.Invitation, order_by)
-    order_attr = order_attr.desc() if reverse else order_attr.asc()
-    stmt = stmt.order_by(order_attr)
-
-    stmt = stmt.offset(skip).limit(limit)
+    return invitations
 
-    if lock_rows:
-        stmt = stmt.with_for_update()
 
-    rows = (await session.execute(stmt)).all()
+# pylint: disable=too-many-arguments, disable=too-many-positional-arguments
+@_timed
+async def get_invitation_rows(
+    session: AsyncSession,
+    skip: int = 0,
+    limit: int = 10,
+    order_by: str = "date_sent",
+    reverse: bool = False,
+    fields: Iterable[str] | None = None,
+    **kwargs,
+) -> list[Row]:
+    """
+    Retrieve a list of invitations from DB as plain rows.
 
-    invitations: list[models.Invitation] = []
+    Takes the same filters as get_invitations. Rows are keyed by column name and
+    include the white_username and black_username columns, looked up in the
+    username cache. Passing `fields` selects only those columns, plus "id".
+    """
+    fields = None if fields is None else tuple(sorted(set(fields)))
+    stmt = _invitations_stmt(
+        tuple(sorted(kwargs)),
+        order_by,
+        reverse,
+        False,
+        True,
+        _row_fields(models.Invitation, fields),
+    )
+    params = {**kwargs, "skip": skip, "limit": limit}
 
-    for invitation, white_username, black_username in rows:
-        invitation.white_username = white_username
-        invitation.black_username = black_username
-        invitations.append(invitation)
+    invitations = [
+        dict(row) for row in (await session.execute(stmt, params)).mappings()
+    ]
+    await _add_usernames(session, models.Invitation, invitations, fields)
 
     return invitations
 
 
+@_timed
 async def cancel_invitation(session: AsyncSession, id_: int) -> bool:
     """
     Cancel invitation.
@@ -231,6 +720,79 @@ async def cancel_invitation(session: AsyncSession, id_: int) -> bool:
     return result.rowcount == 1  # pyright: ignore
 
 
+def _expire_stmt(
+    model: type[models.Base],
+    sent: str,
+    cancelled: models.InvitationStatus | models.ChallengeRequestStatus,
+    *returning: str,
+) -> Update:
+    """
+    Set the pending rows of `model` whose `sent` column is older than the
+    `before` parameter to `cancelled`, at most `limit` of them, oldest first.
+    Rows locked by a transaction answering them are skipped.
+    """
+    table = model.__table__
+    pending = table.c.status == type(cancelled).PENDING
+    stale = (
+        select(table.c.id)
+        .where(pending, table.c[sent] < bindparam("before"))
+        .order_by(table.c[sent], table.c.id)
+        .limit(bindparam("limit"))
+        .with_for_update(skip_locked=True)
+    )
+    return (
+        update(table)
+        .where(table.c.id.in_(stale.scalar_subquery()), pending)
+        .values(status=cancelled)
+        .returning(table.c.id, *(table.c[column] for column in returning))
+    )
+
+
+_EXPIRE_INVITATIONS_STMT = _expire_stmt(
+    models.Invitation,
+    "date_sent",
+    models.InvitationStatus.CANCELLED,
+    "from_id",
+    "to_id",
+)
+
+_EXPIRE_CHALLENGES_STMT = _expire_stmt(
+    models.ChallengeRequest,
+    "created_at",
+    models.ChallengeRequestStatus.CANCELLED,
+    "requester_id",
+)
+
+
+@_timed
+async def expire_invitations(
+    session: AsyncSession, before: datetime, limit: int
+) -> list[Row]:
+    """
+    Cancel up to `limit` pending invitations sent before `before`, oldest first.
+    Returns their id, from_id and to_id.
+    """
+    result = await session.execute(
+        _EXPIRE_INVITATIONS_STMT, {"before": before, "limit": limit}
+    )
+    return [dict(row) for row in result.mappings()]
+
+
+@_timed
+async def expire_challenges(
+    session: AsyncSession, before: datetime, limit: int
+) -> list[Row]:
+    """
+    Cancel up to `limit` pending challenges made before `before`, oldest first.
+    Returns their id and requester_id.
+    """
+    result = await session.execute(
+        _EXPIRE_CHALLENGES_STMT, {"before": before, "limit": limit}
+    )
+    return [dict(row) for row in result.mappings()]
+
+
+@_timed
 async def accept_invitation(session: AsyncSession, id_: int) -> models.Game | None:
     """
     Accept pending invitation and create a new game.
@@ -269,6 +831,7 @@ async def accept_invitation(session: AsyncSession, id_: int) -> models.Game | No
     return new_game
 
 
+@_timed
 async def decline_invitation(session: AsyncSession, id_: int) -> bool:
     """
     Decline pending invitation.
@@ -290,6 +853,7 @@ async def decline_invitation(session: AsyncSession, id_: int) -> bool:
 
 # pylint: disable=too-many-locals
 # pylint: disable=too-many-arguments, disable=too-many-positional-arguments
+@_timed
 async def get_games(
     session: AsyncSession,
     skip: int = 0,
@@ -310,57 +874,116 @@ async def get_games(
         get_games(white=5, skip=0, limit=10)
 
     """
+    stmt = _games_stmt(tuple(sorted(kwargs)), order_by, reverse, lock_rows)
+    params = {**kwargs, "skip": skip, "limit": limit}
 
-    user_temp1 = aliased(models.User)
-    user_temp2 = aliased(models.User)
+    games = list((await session.execute(stmt, params)).scalars())
+    await _set_usernames(session, models.Game, games)
+    move_hists = await _move_hists(session, [game.id_ for game in games])
 
-    stmt = (
-        select(
-            models.Game,
-            user_temp1.name.label("white_username"),
-            user_temp2.name.label("black_username"),
-        )
-        .join(user_temp1, models.Game.white == user_temp1.id_)
-        .join(user_temp2, models.Game.black == user_temp2.id_)
-    )
+    for game in games:
+        game.move_hist = move_hists[game.id_]
 
-    # if player_id is included in request,
-    # we want to query all games and return any where player_id == white or black
-    if "player_id" in kwargs:
-        player_id = kwargs.pop("player_id")
-        stmt = stmt.where(
-            or_(models.Game.white == player_id, models.Game.black == player_id)
-        )
+    return games
+
+
+# pylint: disable=too-many-arguments, disable=too-many-positional-arguments
+@_timed
+async def get_game_rows(
+    session: AsyncSession,
+    skip: int = 0,
+    limit: int = 10,
+    order_by: str = "last_active",
+    reverse: bool = False,
+    fields: Iterable[str] | None = None,
+    **kwargs,
+) -> list[Row]:
+    """
+    Retrieve a list of games from DB as plain rows, without building ORM objects.
 
-    for k, v in kwargs.items():
-        stmt = stmt.where(getattr(models.Game, k) == v)
+    Takes the same filters as get_games. Rows are keyed by column name and include
+    the white_username, black_username and move_hist columns. Usernames are looked
+    up in the username cache, move histories for the whole page are fetched with a
+    single query.
 
-    order_by_attr = getattr(models.Game, order_by)
-    stmt = stmt.order_by(order_by_attr.desc() if reverse else order_by_attr.asc())
+    Passing `fields` selects only those columns, plus "id". Usernames and move
+    histories are only looked up when asked for.
+    """
+    fields = None if fields is None else tuple(sorted(set(fields)))
+    stmt = _games_stmt(
+        tuple(sorted(kwargs)),
+        order_by,
+        reverse,
+        False,
+        True,
+        _row_fields(models.Game, fields),
+    )
+    params = {**kwargs, "skip": skip, "limit": limit}
 
-    stmt = stmt.offset(skip).limit(limit)
+    games = [dict(row) for row in (await session.execute(stmt, params)).mappings()]
+    await _add_usernames(session, models.Game, games, fields)
+    if not _wants(fields, "move_hist"):
+        return games
 
-    if lock_rows:
-        stmt = stmt.with_for_update()
+    move_hists = await _move_hists(session, [game["id"] for game in games])
+    for game in games:
+        game["move_hist"] = move_hists[game["id"]]
+
+    return games
 
-    rows = (await session.execute(stmt)).all()
 
-    games: list[models.Game] = []
+@_timed
+async def get_game_version(session: AsyncSession, id_: int) -> Row | None:
+    """
+    Retrieve what identifies the current state of a game, without joins or the
+    move history.
 
-    for game, white_username, black_username in rows:
-        move_stmt = select(models.Move.movestr).where(models.Move.game_id == game.id_)
-        move_hist = (await session.execute(move_stmt)).scalars().all()
+    Every change to a game updates last_active, so the returned id, last_active
+    and is_active columns are enough to tell whether a game has changed. Returns
+    None if the game does not exist.
+    """
+    row = (await session.execute(_GAME_VERSION_STMT, {"id_": id_})).mappings().first()
+    return dict(row) if row else None
 
-        game.white_username = white_username
-        game.black_username = black_username
-        game.move_hist = move_hist
 
-        games.append(game)
+async def _finish_game(session: AsyncSession, stmt: Update, winner: int | None):
+    """
+    Run `stmt`, an update ending a game, then count the result in both players'
+    wins, draws and losses and update their ratings, no winner being a draw.
 
-    return games
+    The update only applies to active games, so a game is counted once however
+    many requests try to end it. The players' rows are locked, in id order, while
+    their ratings are updated.
+    """
+    stmt = stmt.where(models.Game.is_active == true()).returning(
+        models.Game.white, models.Game.black
+    )
+    players = (await session.execute(stmt)).first()
+    if players is None:
+        return
+    white, black = players
+
+    users = models.User.__table__
+    ratings = dict(
+        (await session.execute(_PLAYER_RATINGS_STMT, {"ids": [white, black]})).all()
+    )
+    white_rating, black_rating = rating.update(
+        ratings[white], ratings[black], rating.white_score(white, winner)
+    )
+
+    values = {"rating": case((users.c.id == white, white_rating), else_=black_rating)}
+    if winner is None:
+        values["draws"] = users.c.draws + 1
+    else:
+        values["wins"] = users.c.wins + case((users.c.id == winner, 1), else_=0)
+        values["losses"] = users.c.losses + case((users.c.id == winner, 0), else_=1)
+    await session.execute(
+        update(users).where(users.c.id.in_((white, black))).values(**values)
+    )
 
 
 # pylint: disable=too-many-arguments, disable=too-many-positional-arguments
+@_timed
 async def do_move(
     session: AsyncSession,
     id_: int,
@@ -414,13 +1037,17 @@ async def do_move(
         )
     )
 
-    await session.execute(stmt)
+    if is_active:
+        await session.execute(stmt)
+    else:
+        await _finish_game(session, stmt, winner)
 
     return (
         await session.execute(select(models.Game).where(models.Game.id_ == id_))
     ).one()[0]
 
 
+@_timed
 async def forfeit(
     session: AsyncSession, user_id: int, game: models.Game
 ) -> models.Game:
@@ -439,13 +1066,115 @@ async def forfeit(
         )
     )
 
-    await session.execute(stmt)
+    await _finish_game(session, stmt, winner)
 
     return (
         await session.execute(select(models.Game).where(models.Game.id_ == game.id_))
     ).one()[0]
 
 
+@_timed
+async def recount_results(session: AsyncSession) -> int:
+    """
+    Recompute every user's wins, draws and losses from the finished games, with
+    a single pass over the games table.
+
+    Returns the number of users who played at least one finished game.
+    """
+    games, users = models.Game.__table__, models.User.__table__
+    finished = games.c.result.is_not(None)
+    players = union_all(
+        select(games.c.white.label("user_id"), games.c.winner).where(finished),
+        select(games.c.black.label("user_id"), games.c.winner).where(finished),
+    ).subquery()
+    won = players.c.winner == players.c.user_id
+    # pylint: disable=not-callable
+    totals = (
+        select(
+            players.c.user_id,
+            func.count(case((won, 1))).label("wins"),
+            func.count(case((players.c.winner.is_(None), 1))).label("draws"),
+            func.count(case((~won, 1))).label("losses"),
+        )
+        .group_by(players.c.user_id)
+        .subquery()
+    )
+
+    # users without finished games are left out of the totals
+    await session.execute(
+        update(users)
+        .where(or_(users.c.wins != 0, users.c.draws != 0, users.c.losses != 0))
+        .values(wins=0, draws=0, losses=0)
+    )
+    result = await session.execute(
+        update(users)
+        .where(users.c.id == totals.c.user_id)
+        .values(wins=totals.c.wins, draws=totals.c.draws, losses=totals.c.losses)
+    )
+    return result.rowcount  # pyright: ignore
+
+
+async def _finished_games(
+    session: AsyncSession, batch_size: int = 10_000
+) -> AsyncIterator[tuple[int, int, int | None]]:
+    """
+    Stream the white, black and winner of every finished game, in the order they
+    ended, fetched in batches.
+    """
+    games = models.Game.__table__
+    result = await session.stream(
+        select(games.c.white, games.c.black, games.c.winner)
+        .where(games.c.result.is_not(None))
+        .order_by(games.c.last_active, games.c.id)
+        .execution_options(yield_per=batch_size)
+    )
+    async for white, black, winner in result:
+        yield white, black, winner
+
+
+@_timed
+async def recompute_ratings(session: AsyncSession, batch_size: int = 10_000) -> int:
+    """
+    Recompute every user's rating by replaying the finished games in the order
+    they ended. Games are streamed in batches, only the ratings of the players
+    are kept in memory.
+
+    Returns the number of games replayed.
+    """
+    ratings: dict[int, float] = {}
+    games = 0
+    async for white, black, winner in _finished_games(session, batch_size):
+        ratings[white], ratings[black] = rating.update(
+            ratings.get(white, rating.INITIAL_RATING),
+            ratings.get(black, rating.INITIAL_RATING),
+            rating.white_score(white, winner),
+        )
+        games += 1
+
+    users = models.User.__table__
+    await session.execute(
+        update(users)
+        .where(users.c.rating != rating.INITIAL_RATING)
+        .values(rating=rating.INITIAL_RATING)
+    )
+    stmt = (
+        update(users)
+        .where(users.c.id == bindparam("user_id"))
+        .values(rating=bindparam("new_rating"))
+    )
+    players = list(ratings.items())
+    for start in range(0, len(players), batch_size):
+        await session.execute(
+            stmt,
+            [
+                {"user_id": user_id, "new_rating": new_rating}
+                for user_id, new_rating in players[start : start + batch_size]
+            ],
+        )
+    return games
+
+
+@_timed
 async def create_challenge(
     session: AsyncSession,
     user_id: int,
@@ -473,6 +1202,7 @@ async def create_challenge(
     return challenge_obj
 
 
+@_timed
 async def get_challenges(
     session: AsyncSession,
     skip: int = 0,
@@ -484,35 +1214,51 @@ async def get_challenges(
 ) -> list[models.ChallengeRequest]:
     """Retrieve a list of challenge requests along with the requester's username"""
 
-    requester = aliased(models.User)
+    stmt = _challenges_stmt(tuple(sorted(kwargs)), order_by, reverse, lock_rows)
+    params = {**kwargs, "skip": skip, "limit": limit}
 
-    stmt = select(
-        models.ChallengeRequest,
-        requester.name.label("requester_username"),
-    ).join(requester, models.ChallengeRequest.requester_id == requester.id_)
+    challenges = list((await session.execute(stmt, params)).scalars())
+    await _set_usernames(session, models.ChallengeRequest, challenges)
 
-    for k, v in kwargs.items():
-        stmt = stmt.where(getattr(models.ChallengeRequest, k) == v)
-
-    order_attr = getattr(models.ChallengeRequest, order_by)
-    order_attr = order_attr.desc() if reverse else order_attr.asc()
-    stmt = stmt.order_by(order_attr)
+    return challenges
 
-    stmt = stmt.offset(skip).limit(limit)
 
-    if lock_rows:
-        stmt = stmt.with_for_update()
+# pylint: disable=too-many-arguments, disable=too-many-positional-arguments
+@_timed
+async def get_challenge_rows(
+    session: AsyncSession,
+    skip: int = 0,
+    limit: int = 10,
+    order_by: str = "created_at",
+    reverse: bool = False,
+    fields: Iterable[str] | None = None,
+    **kwargs,
+) -> list[Row]:
+    """
+    Retrieve a list of challenge requests from DB as plain rows.
 
-    rows = (await session.execute(stmt)).all()
+    Takes the same filters as get_challenges. Rows are keyed by column name and
+    include the requester_username column, looked up in the username cache.
+    Passing `fields` selects only those columns, plus "id".
+    """
+    fields = None if fields is None else tuple(sorted(set(fields)))
+    stmt = _challenges_stmt(
+        tuple(sorted(kwargs)),
+        order_by,
+        reverse,
+        False,
+        True,
+        _row_fields(models.ChallengeRequest, fields),
+    )
+    params = {**kwargs, "skip": skip, "limit": limit}
 
-    challenges: list[models.ChallengeRequest] = []
-    for challenge, requester_username in rows:
-        challenge.requester_username = requester_username
-        challenges.append(challenge)
+    challenges = [dict(row) for row in (await session.execute(stmt, params)).mappings()]
+    await _add_usernames(session, models.ChallengeRequest, challenges, fields)
 
     return challenges
 
 
+@_timed
 async def accept_challenge(
     session: AsyncSession, id_: int, user_id: int
 ) -> models.Game | None:
@@ -530,13 +1276,11 @@ async def accept_challenge(
     challenge.status = models.ChallengeRequestStatus.ACCEPTED
     challenge.fulfilled_by = user_id
 
-    players = [challenge.requester_id, user_id]
-    random.shuffle(players)
-
+    white, black = _challenge_players(challenge.requester_id, user_id)
     new_game = models.Game(
-        white=players[0],
-        black=players[1],
-        whomst=players[0],
+        white=white,
+        black=black,
+        whomst=white,
         challenge_id=id_,
         game_type=challenge.game_type,
     )
@@ -547,6 +1291,149 @@ async def accept_challenge(
     return new_game
 
 
+def _challenge_players(requester_id: int, accepter_id: int) -> tuple[int, int]:
+    """White and black of the game of an accepted challenge, drawn at random."""
+    players = [requester_id, accepter_id]
+    random.shuffle(players)
+    return players[0], players[1]
+
+
+def _claim_challenge_stmt(user_id: int) -> Update:
+    """
+    Mark the oldest pending challenge not made by `user_id` or by a deleted user
+    as accepted by them, returning its id, requester_id and game_type. Rows locked
+    by a concurrent claim are skipped.
+    """
+    challenges = models.ChallengeRequest.__table__
+    users = models.User.__table__
+
+    oldest = (
+        select(challenges.c.id)
+        .join(users, users.c.id == challenges.c.requester_id)
+        .where(
+            challenges.c.status == models.ChallengeRequestStatus.PENDING,
+            challenges.c.requester_id != user_id,
+            users.c.deleted == false(),
+        )
+        .order_by(challenges.c.created_at, challenges.c.id)
+        .limit(1)
+        .with_for_update(of=challenges, skip_locked=True)
+        .scalar_subquery()
+    )
+    return (
+        update(challenges)
+        .where(
+            challenges.c.id == oldest,
+            challenges.c.status == models.ChallengeRequestStatus.PENDING,
+        )
+        .values(status=models.ChallengeRequestStatus.ACCEPTED, fulfilled_by=user_id)
+        .returning(challenges.c.id, challenges.c.requester_id, challenges.c.game_type)
+    )
+
+
+@_timed
+async def accept_any_challenge(session: AsyncSession, user_id: int) -> Row | None:
+    """
+    Accept the oldest pending challenge not made by `user_id` or by a deleted
+    user, and start its game. Returns the game's id, challenge_id, white and
+    black, or None if there is no challenge to accept.
+
+    The challenge is claimed by a single UPDATE picking it with FOR UPDATE SKIP
+    LOCKED, so concurrent callers each claim a different challenge rather than
+    waiting on the same one. The game is inserted and linked to the challenge
+    with two more statements, in the caller's transaction.
+    """
+    challenges = models.ChallengeRequest.__table__
+    games = models.Game.__table__
+
+    claimed = (await session.execute(_claim_challenge_stmt(user_id))).first()
+    if claimed is None:
+        return None
+    challenge_id, requester_id, game_type = claimed
+
+    white, black = _challenge_players(requester_id, user_id)
+    result = await session.execute(
+        games.insert()
+        .values(
+            white=white,
+            black=black,
+            whomst=white,
+            challenge_id=challenge_id,
+            game_type=game_type,
+        )
+        .returning(games.c.id, games.c.challenge_id, games.c.white, games.c.black)
+    )
+    game = dict(result.mappings().one())
+    await session.execute(
+        update(challenges)
+        .where(challenges.c.id == challenge_id)
+        .values(game_id=game["id"])
+    )
+    return game
+
+
+@_timed
+async def create_matches(
+    session: AsyncSession, matches: list[tuple[str, int, int]]
+) -> list[Row]:
+    """
+    Start a game for each (game type, user id, user id) match made by the
+    matchmaking queue, as if the first player had made a challenge the second
+    accepted. Returns the games' id, white and black.
+
+    The challenges and games are each inserted with a single statement, and the
+    challenges pointed at their games with another, however many matches there
+    are. A player can only be in one of the matches.
+    """
+    if not matches:
+        return []
+    challenges = models.ChallengeRequest.__table__
+    games = models.Game.__table__
+
+    result = await session.execute(
+        challenges.insert().returning(challenges.c.id, challenges.c.requester_id),
+        [
+            {
+                "requester_id": requester_id,
+                "fulfilled_by": accepter_id,
+                "game_type": models.GameType(game_type),
+                "status": models.ChallengeRequestStatus.ACCEPTED,
+            }
+            for game_type, requester_id, accepter_id in matches
+        ],
+    )
+    challenge_ids = {requester_id: id_ for id_, requester_id in result}
+
+    game_rows = []
+    for game_type, requester_id, accepter_id in matches:
+        white, black = _challenge_players(requester_id, accepter_id)
+        game_rows.append(
+            {
+                "white": white,
+                "black": black,
+                "whomst": white,
+                "challenge_id": challenge_ids[requester_id],
+                "game_type": models.GameType(game_type),
+            }
+        )
+    result = await session.execute(
+        games.insert().returning(
+            games.c.id, games.c.challenge_id, games.c.white, games.c.black
+        ),
+        game_rows,
+    )
+    rows = [dict(row) for row in result.mappings()]
+
+    await session.execute(
+        update(challenges)
+        .where(challenges.c.id == bindparam("challenge_id"))
+        .values(game_id=bindparam("game_id")),
+        [{"challenge_id": row["challenge_id"], "game_id": row["id"]} for row in rows],
+    )
+    return rows
+
+
+@_timed
 async def cancel_challenge(session: AsyncSession, id_: int) -> bool:
     """
     Cancel challenge.
@@ -1,22 +1,187 @@
 """chessticulate_api.db"""
 
+import logging
 from typing import AsyncGenerator
 
-from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+import jwt
+from fastapi import Request
+from redis.exceptions import RedisError
+from sqlalchemy.engine import URL, make_url
+from sqlalchemy.ext.asyncio import (
+    AsyncEngine,
+    AsyncSession,
+    async_sessionmaker,
+    create_async_engine,
+)
 
+from chessticulate_api import metrics, server_timing
 from chessticulate_api.config import CONFIG
 
-async_engine = create_async_engine(
-    CONFIG.sql_conn_str,
-    echo=CONFIG.sql_echo,
-    pool_pre_ping=True,
+logger = logging.getLogger(__name__)
+
+# Redis key prefix of the users whose reads are pinned to the primary, each key
+# expiring with the read-your-writes window
+_PIN_KEY = "read-your-writes"
+
+
+def is_memory_sqlite(url: URL) -> bool:
+    """In-memory sqlite databases share one connection through a StaticPool."""
+    return url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:")
+
+
+def _engine_kwargs(conn_str: str) -> dict:
+    """Build pool and driver options for an engine connecting to `conn_str`."""
+    url = make_url(conn_str)
+    kwargs = {"echo": CONFIG.sql_echo, "pool_pre_ping": True}
+
+    # a StaticPool takes no sizing options
+    if is_memory_sqlite(url):
+        return kwargs
+
+    kwargs.update(
+        pool_size=CONFIG.sql_pool_size,
+        max_overflow=CONFIG.sql_max_overflow,
+        pool_timeout=CONFIG.sql_pool_timeout,
+        pool_recycle=CONFIG.sql_pool_recycle,
+    )
+
+    if url.get_driver_name() == "asyncpg":
+        kwargs["connect_args"] = {
+            # asyncpg's own cache, and the one SQLAlchemy keeps on top of it
+            "statement_cache_size": CONFIG.sql_statement_cache_size,
+            "prepared_statement_cache_size": CONFIG.sql_statement_cache_size,
+        }
+
+    return kwargs
+
+
+def create_engine(conn_str: str) -> AsyncEngine:
+    """Create an async engine using the pool settings found in CONFIG."""
+    return create_async_engine(conn_str, **_engine_kwargs(conn_str))
+
+
+async_engine = create_engine(CONFIG.sql_conn_str)
+
+# without a configured replica, reads share the primary engine
+async_read_engine = (
+    create_engine(CONFIG.sql_read_conn_str)
+    if CONFIG.sql_read_conn_str
+    else async_engine
 )
 
+
+def read_only(engine: AsyncEngine) -> AsyncEngine:
+    """
+    Variant of `engine` whose connections run in autocommit mode.
+
+    Without a transaction, reads skip the BEGIN and COMMIT/ROLLBACK round trips.
+    Changing the isolation level of the single connection shared by an in-memory
+    sqlite database would commit whatever another session has in flight, so those
+    engines are returned as is.
+    """
+    if is_memory_sqlite(engine.url):
+        return engine
+    return engine.execution_options(isolation_level="AUTOCOMMIT")
+
+
 async_session = async_sessionmaker(async_engine, expire_on_commit=False)
+async_read_session = async_sessionmaker(
+    read_only(async_read_engine), expire_on_commit=False
+)
+# reads which must see the primary's latest writes
+async_primary_read_session = async_sessionmaker(
+    read_only(async_engine), expire_on_commit=False
+)
+
+
+def _caller_id(request: Request) -> int | None:
+    """The user id in the bearer token of a request, if it carries a valid one."""
+    scheme, _, token = request.headers.get("Authorization", "").partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        return None
+    try:
+        return jwt.decode(token, CONFIG.jwt_secret, [CONFIG.jwt_algo]).get("user_id")
+    except jwt.exceptions.PyJWTError:
+        return None
+
+
+def _pin_key(user_id: int) -> str:
+    return f"{_PIN_KEY}:{user_id}"
+
+
+async def mark_write(request: Request):
+    """
+    Pin the reads of the user behind a write to the primary for the
+    read-your-writes window: `request.state.user_id` when the endpoint sets it,
+    the caller otherwise. Pins are kept in Redis so they hold on every worker
+    process, not just the one which served the write.
+    """
+    if async_read_engine is async_engine or CONFIG.sql_read_your_writes <= 0:
+        return
+    user_id = getattr(request.state, "user_id", None)
+    if user_id is None and (user_id := _caller_id(request)) is None:
+        return
+
+    try:
+        with (
+            metrics.REDIS_SECONDS.labels("pin_reads").time(),
+            server_timing.timer("redis"),
+        ):
+            await request.app.state.redis.set(
+                _pin_key(user_id), 1, px=int(CONFIG.sql_read_your_writes * 1000)
+            )
+    except RedisError:
+        logger.exception("failed to pin the reads of user %s to the primary", user_id)
 
 
-async def session() -> AsyncGenerator[AsyncSession, None]:
-    """Async session gnerator"""
+async def read_from_primary(request: Request) -> bool:
+    """Whether reads for this request must be served by the primary."""
+    if async_read_engine is async_engine:
+        return True
+    if CONFIG.sql_read_your_writes <= 0 or (user_id := _caller_id(request)) is None:
+        return False
+
+    try:
+        with (
+            metrics.REDIS_SECONDS.labels("pin_reads").time(),
+            server_timing.timer("redis"),
+        ):
+            return bool(await request.app.state.redis.exists(_pin_key(user_id)))
+    except RedisError:
+        # without the pins, the replica may not have the caller's latest writes
+        logger.exception("failed to look up the read pin of user %s", user_id)
+        return True
+
+
+async def read_sessionmaker(request: Request) -> async_sessionmaker[AsyncSession]:
+    """Pick the session factory that should serve reads for this request."""
+    if await read_from_primary(request):
+        return async_primary_read_session
+    return async_read_session
+
+
+async def session(request: Request) -> AsyncGenerator[AsyncSession, None]:
+    """
+    Async session generator for endpoints which write.
+
+    Should be requested with `Depends(session, scope="function")`, so that the
+    transaction commits, and the writer's reads are pinned to the primary,
+    before the response is sent rather than after.
+    """
     async with async_session() as sesh:
         async with sesh.begin():
             yield sesh
+    if request.method not in ("GET", "HEAD"):
+        await mark_write(request)
+
+
+async def read_session(request: Request) -> AsyncGenerator[AsyncSession, None]:
+    """
+    Async session generator for read only endpoints.
+
+    Sessions are not transactional and should be requested with
+    `Depends(read_session, scope="function")` so the connection goes back to the
+    pool as soon as the endpoint returns, rather than after the response is sent.
+    """
+    async with (await read_sessionmaker(request))() as sesh:
+        yield sesh
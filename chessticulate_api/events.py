@@ -0,0 +1,74 @@
+"""chessticulate_api.events"""
+
+from typing import Any, Iterable
+
+from fastapi import Request
+from fastapi.responses import StreamingResponse
+from redis.asyncio import Redis
+
+from chessticulate_api import metrics, serialization, server_timing
+
+
+def game_channel(game_id: int) -> str:
+    """Channel the moves of a game are published to."""
+    return f"game:{game_id}"
+
+
+def user_channel(user_id: int) -> str:
+    """Channel of the events addressed to a user, such as them being matched."""
+    return f"user:{user_id}"
+
+
+async def publish(redis: Redis, channel: str, event: dict[str, Any]):
+    """Publish an event to the subscribers of a channel."""
+    with metrics.REDIS_SECONDS.labels("publish").time(), server_timing.timer("redis"):
+        await redis.publish(channel, serialization.dumps(event))
+
+
+async def publish_many(redis: Redis, events: Iterable[tuple[str, dict[str, Any]]]):
+    """Publish (channel, event) pairs in a single round trip."""
+    pipeline = redis.pipeline(transaction=False)
+    for channel, event in events:
+        pipeline.publish(channel, serialization.dumps(event))
+    with metrics.REDIS_SECONDS.labels("publish").time(), server_timing.timer("redis"):
+        await pipeline.execute()
+
+
+async def stream(request: Request, channel: str) -> StreamingResponse:
+    """
+    Server-sent event stream of the events published to a channel, with a
+    heartbeat every second, until the client disconnects.
+    """
+    redis: Redis = request.app.state.redis
+    pubsub = redis.pubsub()
+    with metrics.REDIS_SECONDS.labels("subscribe").time(), server_timing.timer("redis"):
+        await pubsub.subscribe(channel)
+
+    async def event_stream():
+        # notify client that connection has been made
+        yield ": connected\n\n"
+        try:
+            while True:
+                # wait 1s for message, send heartbeat if none
+                msg = await pubsub.get_message(
+                    ignore_subscribe_messages=True,
+                    timeout=1.0,
+                )
+                if msg and msg["type"] == "message":
+                    data = msg["data"]
+                    yield f"data: {data}\n\n"
+                else:
+                    yield ": ping\n\n"
+                if await request.is_disconnected():
+                    break
+        finally:
+            await pubsub.unsubscribe(channel)
+            await pubsub.close()
+
+    # text/event-stream responses are left uncompressed by CompressionMiddleware
+    headers = {
+        "Content-Type": "text/event-stream",
+        "Cache-Control": "no-cache, no-transform",
+        "Connection": "keep-alive",
+    }
+    return StreamingResponse(event_stream(), headers=headers)
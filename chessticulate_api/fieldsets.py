@@ -0,0 +1,60 @@
+"""chessticulate_api.fieldsets"""
+
+import functools
+
+from fastapi import HTTPException
+from pydantic import BaseModel, Field, create_model
+
+
+def _response_names(model: type[BaseModel]) -> set[str]:
+    """Names the fields of `model` are serialized under."""
+    return {
+        info.serialization_alias or name for name, info in model.model_fields.items()
+    }
+
+
+@functools.cache
+def sparse(model: type[BaseModel]) -> type[BaseModel]:
+    """
+    Variant of a response model whose fields are all optional.
+
+    Endpoints returning a sparse model set `response_model_exclude_unset`, so only
+    the fields which were requested, and so set, are sent.
+    """
+    fields = {
+        name: (
+            info.annotation | None,
+            Field(
+                None,
+                validation_alias=info.validation_alias,
+                serialization_alias=info.serialization_alias,
+            ),
+        )
+        for name, info in model.model_fields.items()
+    }
+    return create_model(f"Sparse{model.__name__}", **fields)  # type: ignore
+
+
+def parse(model: type[BaseModel], fields: str | None) -> tuple[str, ...] | None:
+    """
+    Parse a comma separated `fields` query parameter into the response fields of
+    `model` it names, always including "id". Returns None if no fields were given,
+    meaning all of them.
+
+    Raises a 400 HTTPException naming any field `model` doesn't have.
+    """
+    if fields is None:
+        return None
+
+    requested = {field.strip() for field in fields.split(",") if field.strip()}
+    unknown = requested - _response_names(model)
+    if unknown:
+        raise HTTPException(
+            status_code=400, detail=f"unknown fields: {', '.join(sorted(unknown))}"
+        )
+    return tuple(sorted(requested | {"id"}))
+
+
+def every(model: type[BaseModel]) -> tuple[str, ...]:
+    """All response fields of `model`."""
+    return tuple(sorted(_response_names(model)))
@@ -0,0 +1,186 @@
+"""chessticulate_api.leaderboard"""
+
+import logging
+from typing import AsyncIterable
+
+from redis.asyncio import Redis
+from redis.exceptions import LockError, LockNotOwnedError, RedisError
+
+from chessticulate_api import metrics
+
+logger = logging.getLogger(__name__)
+
+# set the wins of users in the leaderboard, and in the one being rebuilt if there
+# is one. ARGV holds user id and wins pairs. wins only ever go up, so results of
+# concurrent games recorded out of order keep the highest count
+_RECORD_SCRIPT = """
+for _, key in ipairs(KEYS) do
+    if redis.call('EXISTS', key) == 1 then
+        for i = 1, #ARGV, 2 do
+            redis.call('ZADD', key, 'GT', ARGV[i + 1], ARGV[i])
+        end
+    end
+end
+"""
+
+# a page of the leaderboard: the number of users with more wins than the first
+# entry of the page, and the page's user ids and wins. nil if it isn't built
+_PAGE_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return nil
+end
+local entries = redis.call('ZREVRANGE', KEYS[1], ARGV[1], ARGV[2], 'WITHSCORES')
+if #entries == 0 then
+    return {0, entries}
+end
+return {redis.call('ZCOUNT', KEYS[1], '(' .. entries[2], '+inf'), entries}
+"""
+
+# the wins of a user, false if they have none, and the number of users with more
+# wins. nil if the leaderboard isn't built
+_RANK_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return nil
+end
+local wins = redis.call('ZSCORE', KEYS[1], ARGV[1])
+if not wins then
+    return {false, redis.call('ZCARD', KEYS[1]) - 1}
+end
+return {wins, redis.call('ZCOUNT', KEYS[1], '(' .. wins, '+inf')}
+"""
+
+
+class NotBuiltError(Exception):
+    """Raised when the leaderboard is looked up before it is built."""
+
+
+class Leaderboard:
+    """
+    Users ranked by wins, in a Redis sorted set shared by every worker process.
+
+    Only users with at least one win are members, the sorted set also holds a
+    placeholder member so that it exists, and counts as built, when nobody has
+    won yet. Users share a rank when they have as many wins, ranks and pages
+    are looked up in O(log n) time.
+
+    Wins are set from the users table, not incremented, so recording a result
+    twice is harmless. Results which fail to be recorded are logged and fixed by
+    the next rebuild.
+    """
+
+    # member making sure the sorted set exists, ranked below every user
+    PLACEHOLDER = "-"
+
+    def __init__(self, redis: Redis, key: str = "leaderboard:wins"):
+        self.redis = redis
+        self.key = key
+        self._record_script = redis.register_script(_RECORD_SCRIPT)
+        self._page_script = redis.register_script(_PAGE_SCRIPT)
+        self._rank_script = redis.register_script(_RANK_SCRIPT)
+
+    async def is_built(self) -> bool:
+        """Whether the leaderboard has been built and is answering lookups."""
+        return bool(await self.redis.exists(self.key))
+
+    @metrics.timed(metrics.REDIS_SECONDS, "leaderboard_record", timing="redis")
+    async def record(self, wins: dict[int, int]):
+        """Set the wins of users, by user id, logging any Redis error."""
+        if not wins:
+            return
+        args = [str(arg) for user_id, count in wins.items() for arg in (user_id, count)]
+        try:
+            await self._record_script(keys=[self.key, f"{self.key}:next"], args=args)
+        except RedisError:
+            logger.exception("failed to record wins %s in the leaderboard", wins)
+
+    async def remove(self, user_id: int):
+        """Take a user off the leaderboard, logging any Redis error."""
+        try:
+            await self.redis.zrem(self.key, user_id)
+            await self.redis.zrem(f"{self.key}:next", user_id)
+        except RedisError:
+            logger.exception("failed to remove user %s from the leaderboard", user_id)
+
+    @metrics.timed(metrics.REDIS_SECONDS, "leaderboard_page", timing="redis")
+    async def page(self, skip: int, limit: int) -> list[tuple[int, int, int]]:
+        """
+        A page of the leaderboard, as (rank, user id, wins) tuples from the most
+        wins down. Raises NotBuiltError if the leaderboard isn't built.
+        """
+        result = await self._page_script(keys=[self.key], args=[skip, skip + limit - 1])
+        if result is None:
+            raise NotBuiltError
+        above, entries = result
+
+        page: list[tuple[int, int, int]] = []
+        rank, previous = int(above) + 1, None
+        for position, i in enumerate(range(0, len(entries), 2), start=skip + 1):
+            member, wins = entries[i], int(float(entries[i + 1]))
+            if member == self.PLACEHOLDER:
+                break
+            if previous is not None and wins != previous:
+                rank = position
+            page.append((rank, int(member), wins))
+            previous = wins
+        return page
+
+    @metrics.timed(metrics.REDIS_SECONDS, "leaderboard_rank", timing="redis")
+    async def rank(self, user_id: int) -> tuple[int, int]:
+        """
+        Rank and wins of a user. Users who haven't won rank after every user who
+        has. Raises NotBuiltError if the leaderboard isn't built.
+        """
+        result = await self._rank_script(keys=[self.key], args=[user_id])
+        if result is None:
+            raise NotBuiltError
+        wins, above = result
+        return int(above) + 1, 0 if wins is None else int(float(wins))
+
+    async def rebuild(self, users: AsyncIterable[tuple[int, int]]) -> int | None:
+        """
+        Replace the leaderboard with one built from the (user id, wins) pairs of
+        every user with a win. Returns the number of users, or None if another
+        process is rebuilding it or took the rebuild over.
+
+        The new leaderboard is written to a `:next` key, which results recorded
+        meanwhile are also written to, and renamed over the leaderboard. Wins
+        streamed from the database only ever raise a user's wins there, so an
+        older count doesn't overwrite a result recorded meanwhile.
+
+        The lock is extended as batches are written. A rebuild which loses it
+        anyway leaves the `:next` key to whichever rebuild holds it now.
+        """
+        lock = self.redis.lock(f"{self.key}:lock", timeout=600)
+        if not await lock.acquire(blocking=False):
+            return None
+        next_key = f"{self.key}:next"
+        try:
+            await self.redis.delete(next_key)
+            await self.redis.zadd(next_key, {self.PLACEHOLDER: -1})
+            count, batch = 0, {}
+            async for user_id, wins in users:
+                batch[user_id] = wins
+                if len(batch) == 10_000:
+                    await lock.reacquire()
+                    await self.redis.zadd(next_key, batch, gt=True)
+                    count, batch = count + len(batch), {}
+            await lock.reacquire()
+            if batch:
+                await self.redis.zadd(next_key, batch, gt=True)
+                count += len(batch)
+            await self.redis.rename(next_key, self.key)
+            return count
+        except LockNotOwnedError:
+            logger.warning("leaderboard lock expired during the rebuild, giving up")
+            return None
+        finally:
+            if await lock.owned():
+                await self.redis.delete(next_key)
+                try:
+                    await lock.release()
+                except LockError:
+                    logger.warning("leaderboard lock expired before the rebuild ended")
+
+
+# leaderboard kept up to date as games end, set up at startup
+board: Leaderboard | None = None  # pylint: disable=invalid-name
@@ -0,0 +1,174 @@
+"""chessticulate_api.matchmaking"""
+
+import logging
+from typing import NamedTuple
+
+from redis.asyncio import Redis
+from redis.exceptions import LockError
+
+from chessticulate_api import metrics, models
+from chessticulate_api.config import CONFIG
+
+logger = logging.getLogger(__name__)
+
+# queue a user for a game type, out of any other game type's queue. KEYS are the
+# rating windows hash, the game type's queue, then every queue. ARGV holds the
+# user id, rating and window, empty for none
+_JOIN_SCRIPT = """
+for i = 3, #KEYS do
+    redis.call('ZREM', KEYS[i], ARGV[1])
+end
+redis.call('HSET', KEYS[1], ARGV[1], ARGV[3])
+redis.call('ZADD', KEYS[2], ARGV[2], ARGV[1])
+"""
+
+# take a user out of every queue, KEYS are the rating windows hash then every
+# queue. 1 if they were queued
+_LEAVE_SCRIPT = """
+for i = 2, #KEYS do
+    redis.call('ZREM', KEYS[i], ARGV[1])
+end
+return redis.call('HDEL', KEYS[1], ARGV[1])
+"""
+
+# take pairs of users out of a queue, KEYS are the rating windows hash and the
+# queue. ARGV holds pairs of user ids, a pair is only taken if both users are
+# still queued. returns the 1-based numbers of the pairs taken
+_TAKE_SCRIPT = """
+local taken = {}
+for i = 1, #ARGV, 2 do
+    local a, b = ARGV[i], ARGV[i + 1]
+    if redis.call('ZSCORE', KEYS[2], a) and redis.call('ZSCORE', KEYS[2], b) then
+        redis.call('ZREM', KEYS[2], a, b)
+        redis.call('HDEL', KEYS[1], a, b)
+        taken[#taken + 1] = (i + 1) / 2
+    end
+end
+return taken
+"""
+
+
+class Player(NamedTuple):
+    """A queued player, with the most rating points they'll concede."""
+
+    user_id: int
+    rating: float
+    window: float | None
+
+
+def pair_players(players: list[Player]) -> list[tuple[Player, Player]]:
+    """
+    Pair up players sorted by rating, each with a neighbour, as long as their
+    ratings are within both players' windows. Players who can't be paired are
+    left out, to wait for the next tick.
+    """
+    pairs: list[tuple[Player, Player]] = []
+    i = 0
+    while i + 1 < len(players):
+        lower, higher = players[i], players[i + 1]
+        gap = higher.rating - lower.rating
+        if all(
+            window is None or gap <= window for window in (lower.window, higher.window)
+        ):
+            pairs.append((lower, higher))
+            i += 2
+        else:
+            i += 1
+    return pairs
+
+
+class MatchmakingQueue:
+    """
+    Players waiting for an opponent, by game type, in Redis sorted sets scored by
+    rating and shared by every worker process.
+
+    Players are paired on a tick by whichever process holds the queue's lock.
+    Pairs are taken out of the queue atomically, so a player who leaves while
+    being paired is either matched or left alone, never both.
+    """
+
+    def __init__(self, redis: Redis, key: str = "matchmaking"):
+        self.redis = redis
+        self.key = key
+        self._join_script = redis.register_script(_JOIN_SCRIPT)
+        self._leave_script = redis.register_script(_LEAVE_SCRIPT)
+        self._take_script = redis.register_script(_TAKE_SCRIPT)
+
+    def _queue_key(self, game_type: str) -> str:
+        return f"{self.key}:{game_type}"
+
+    def _queue_keys(self) -> list[str]:
+        return [self._queue_key(game_type.value) for game_type in models.GameType]
+
+    @metrics.timed(metrics.REDIS_SECONDS, "matchmaking_join", timing="redis")
+    async def join(self, game_type: str, player: Player):
+        """Queue a player for a game type, replacing any earlier entry of theirs."""
+        window = "" if player.window is None else player.window
+        await self._join_script(
+            keys=[
+                f"{self.key}:windows",
+                self._queue_key(game_type),
+                *self._queue_keys(),
+            ],
+            args=[player.user_id, player.rating, window],
+        )
+
+    @metrics.timed(metrics.REDIS_SECONDS, "matchmaking_leave", timing="redis")
+    async def leave(self, user_id: int) -> bool:
+        """Take a player out of the queue. Returns False if they weren't queued."""
+        return bool(
+            await self._leave_script(
+                keys=[f"{self.key}:windows", *self._queue_keys()], args=[user_id]
+            )
+        )
+
+    async def _players(self, game_type: str, limit: int) -> list[Player]:
+        """Up to `limit` players queued for a game type, lowest rating first."""
+        entries = await self.redis.zrange(
+            self._queue_key(game_type), 0, limit - 1, withscores=True
+        )
+        if not entries:
+            return []
+        windows = await self.redis.hmget(
+            f"{self.key}:windows", [user_id for user_id, _ in entries]
+        )
+        return [
+            Player(int(user_id), float(rating), float(window) if window else None)
+            for (user_id, rating), window in zip(entries, windows)
+        ]
+
+    @metrics.timed(metrics.REDIS_SECONDS, "matchmaking_pair", timing="redis")
+    async def pair(
+        self, limit: int = CONFIG.matchmaking_batch_size
+    ) -> list[tuple[str, Player, Player]] | None:
+        """
+        Pair up and take out of the queue the players who can be matched, as
+        (game type, player, player) tuples. At most `limit` players of each game
+        type are considered per call, lowest rating first. Returns None if another
+        process is pairing players.
+        """
+        lock = self.redis.lock(f"{self.key}:lock", timeout=60)
+        if not await lock.acquire(blocking=False):
+            return None
+        try:
+            matches: list[tuple[str, Player, Player]] = []
+            for game_type in models.GameType:
+                pairs = pair_players(await self._players(game_type.value, limit))
+                if not pairs:
+                    continue
+                taken = await self._take_script(
+                    keys=[f"{self.key}:windows", self._queue_key(game_type.value)],
+                    args=[player.user_id for pair in pairs for player in pair],
+                )
+                matches.extend((game_type.value, *pairs[i - 1]) for i in taken)
+            return matches
+        finally:
+            # the pairs are already out of the queue, they must still be returned
+            try:
+                await lock.release()
+            except LockError:
+                logger.warning("matchmaking lock expired before pairing ended")
+
+
+# queue of players waiting to be matched, set up at startup
+queue: MatchmakingQueue | None = None  # pylint: disable=invalid-name
@@ -0,0 +1,195 @@
+"""chessticulate_api.metrics"""
+
+import functools
+import glob
+import os
+import tempfile
+import time
+from typing import Awaitable, Callable, ParamSpec, TypeVar
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+from chessticulate_api import server_timing
+from chessticulate_api.config import CONFIG
+
+P = ParamSpec("P")
+T = TypeVar("T")
+
+# most database and redis round trips take well under the smallest default bucket
+_FAST_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+)
+
+CRUD_SECONDS = Histogram(
+    "chess_crud_duration_seconds",
+    "Time spent in crud functions, database round trips included.",
+    ["function"],
+    buckets=_FAST_BUCKETS,
+)
+
+WORKERS_SECONDS = Histogram(
+    "chess_workers_request_duration_seconds",
+    "Time spent on requests to the chess-workers service, by endpoint and outcome"
+    " (ok, rejected or error).",
+    ["endpoint", "outcome"],
+)
+
+REDIS_SECONDS = Histogram(
+    "chess_redis_duration_seconds",
+    "Time spent on redis operations.",
+    ["operation"],
+    buckets=_FAST_BUCKETS,
+)
+
+USER_FILTER_CHECKS = Counter(
+    "chess_user_filter_checks_total",
+    "Username and email availability checks by field and result: free (answered by"
+    " the bloom filter alone), taken, or false_positive (filter hit, but free).",
+    ["field", "result"],
+)
+
+BCRYPT_SECONDS = Histogram(
+    "chess_bcrypt_duration_seconds",
+    "Time spent hashing and checking passwords.",
+    ["operation"],
+)
+
+
+def timed(
+    histogram: Histogram,
+    *labels: str,
+    timing: str,
+    outcomes: dict[type[Exception], str] | None = None,
+) -> Callable[[Callable[P, Awaitable[T]]], Callable[P, Awaitable[T]]]:
+    """
+    Decorator observing the duration of each call to a coroutine function, also
+    counted towards the `timing` entry of the request's Server-Timing header.
+
+    With `outcomes`, calls are also labelled with their outcome: "ok" when they
+    return, the label `outcomes` maps the raised exception's type to, or "error"
+    for any other exception.
+    """
+    if outcomes is None:
+        children = {None: histogram.labels(*labels)}
+    else:
+        children = {
+            outcome: histogram.labels(*labels, outcome)
+            for outcome in ("ok", "error", *outcomes.values())
+        }
+
+    def outcome_of(exc: BaseException | None) -> str | None:
+        if outcomes is None:
+            return None
+        if exc is None:
+            return "ok"
+        for exc_type, outcome in outcomes.items():
+            if isinstance(exc, exc_type):
+                return outcome
+        return "error"
+
+    def decorator(fn: Callable[P, Awaitable[T]]) -> Callable[P, Awaitable[T]]:
+        @functools.wraps(fn)
+        async def wrapper(*args: P.args, **kwargs: P.kwargs) -> T:
+            start = time.perf_counter()
+            raised = None
+            try:
+                with server_timing.timer(timing):
+                    return await fn(*args, **kwargs)
+            except BaseException as exc:
+                raised = exc
+                raise
+            finally:
+                children[outcome_of(raised)].observe(time.perf_counter() - start)
+
+        return wrapper
+
+    return decorator
+
+
+def setup_multiprocess_dir() -> str:
+    """
+    Prepare the directory worker processes share their metrics through.
+
+    Must run in the supervising process before any worker is started, workers
+    find the directory through the PROMETHEUS_MULTIPROC_DIR environment variable.
+    Files left behind by a previous run are removed.
+    """
+    path = CONFIG.prometheus_multiproc_dir or tempfile.mkdtemp(
+        prefix="chess-api-metrics-"
+    )
+    os.makedirs(path, exist_ok=True)
+    for stale in glob.glob(os.path.join(path, "*.db")):
+        os.remove(stale)
+
+    os.environ["PROMETHEUS_MULTIPROC_DIR"] = path
+    CONFIG.prometheus_multiproc_dir = path
+    return path
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def sweep_dead_workers():
+    """
+    Remove the live gauge files of worker processes which no longer exist.
+
+    Counter and histogram files of dead workers are kept, so that totals never go
+    backwards when a worker is restarted.
+    """
+    pids = set()
+    for path in glob.glob(os.path.join(CONFIG.prometheus_multiproc_dir, "*.db")):
+        pid = os.path.basename(path)[: -len(".db")].rsplit("_", 1)[-1]
+        if pid.isdigit():
+            pids.add(int(pid))
+
+    for pid in pids:
+        if pid != os.getpid() and not _pid_alive(pid):
+            multiprocess.mark_process_dead(pid, CONFIG.prometheus_multiproc_dir)
+
+
+def mark_worker_dead():
+    """Clean up this worker's live gauges, for use on shutdown."""
+    if CONFIG.prometheus_multiproc_dir:
+        multiprocess.mark_process_dead(os.getpid(), CONFIG.prometheus_multiproc_dir)
+
+
+def render() -> tuple[bytes, str]:
+    """
+    Render metrics in the Prometheus text format, and its content type.
+
+    When running several workers the result aggregates the metrics of all of
+    them, whichever worker serves the scrape.
+    """
+    if not CONFIG.prometheus_multiproc_dir:
+        return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
+
+    sweep_dead_workers()
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry, CONFIG.prometheus_multiproc_dir)
+    return generate_latest(registry), CONTENT_TYPE_LATEST
@@ -0,0 +1,177 @@
+"""chessticulate_api.migrations"""
+
+from typing import Callable
+
+from sqlalchemy import (
+    Column,
+    Connection,
+    Index,
+    Integer,
+    MetaData,
+    Table,
+    inspect,
+    text,
+)
+from sqlalchemy.exc import DBAPIError
+
+from chessticulate_api import db, models, rating
+
+# arbitrary key for the postgres advisory lock serializing migration runs
+_MIGRATION_LOCK_KEY = 0x43484553
+
+_metadata = MetaData()
+
+schema_version = Table(
+    "schema_version",
+    _metadata,
+    Column("version", Integer, nullable=False),
+)
+
+
+class SchemaVersionError(Exception):
+    """Database schema does not match the version this code expects"""
+
+    def __init__(self, detail: str):
+        self.detail = detail
+        super().__init__(detail)
+
+
+def _create_index(conn: Connection, table: str, name: str, *columns: str):
+    """
+    Create an index as its migration defines it, rather than as the models
+    currently do, so a migration keeps running the same DDL as the models change.
+    """
+    frozen = Table(table, MetaData(), *(Column(column) for column in columns))
+    Index(name, *frozen.columns).create(conn, checkfirst=True)
+
+
+def _baseline(_: Connection):
+    """Tables as created by `models.init_db` before migrations were introduced."""
+
+
+def _index_moves_game_id(conn: Connection):
+    """Index moves.game_id, used by every move history lookup."""
+    _create_index(conn, "moves", "ix_moves_game_id", "game_id")
+
+
+def _index_users_name_trigrams(conn: Connection):
+    """Trigram index on lower(users.name), used by user search. Postgres only."""
+    if conn.dialect.name != "postgresql":
+        return
+    conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+    conn.execute(
+        text(
+            "CREATE INDEX IF NOT EXISTS ix_users_name_trgm"
+            " ON users USING gin (lower(name) gin_trgm_ops)"
+        )
+    )
+
+
+def _add_users_rating(conn: Connection):
+    """Add the indexed users.rating column."""
+    if "rating" not in {c["name"] for c in inspect(conn).get_columns("users")}:
+        conn.execute(
+            text(
+                "ALTER TABLE users ADD COLUMN rating FLOAT"
+                f" DEFAULT {rating.INITIAL_RATING} NOT NULL"
+            )
+        )
+    _create_index(conn, "users", "ix_users_rating", "rating")
+
+
+def _index_challenge_requests_status(conn: Connection):
+    """Index challenge_requests on status and created_at, to find pending ones."""
+    _create_index(
+        conn,
+        "challenge_requests",
+        "ix_challenge_requests_status_created_at",
+        "status",
+        "created_at",
+    )
+
+
+def _index_invitations_status(conn: Connection):
+    """Index invitations on status and date_sent, to find stale pending ones."""
+    _create_index(
+        conn, "invitations", "ix_invitations_status_date_sent", "status", "date_sent"
+    )
+
+
+# MIGRATIONS[n - 1] upgrades a database from version n - 1 to version n.
+# Only ever append to this list.
+MIGRATIONS: list[Callable[[Connection], None]] = [
+    _baseline,
+    _index_moves_game_id,
+    _index_users_name_trigrams,
+    _add_users_rating,
+    _index_challenge_requests_status,
+    _index_invitations_status,
+]
+
+LATEST_VERSION = len(MIGRATIONS)
+
+
+def _current_version(conn: Connection) -> int | None:
+    """Schema version of the database, None if it has never been migrated."""
+    try:
+        return conn.execute(schema_version.select()).scalar_one_or_none()
+    except DBAPIError:
+        return None
+
+
+def _migrate(conn: Connection) -> tuple[int | None, int]:
+    if conn.dialect.name == "postgresql":
+        conn.execute(
+            text("SELECT pg_advisory_xact_lock(:key)"), {"key": _MIGRATION_LOCK_KEY}
+        )
+
+    schema_version.create(conn, checkfirst=True)
+    start = version = _current_version(conn)
+
+    if version is None:
+        if inspect(conn).has_table(models.User.__tablename__):
+            # created by init_db before versioning existed
+            start = version = 1
+        else:
+            models.Base.metadata.create_all(conn)
+            version = LATEST_VERSION
+        conn.execute(schema_version.insert().values(version=version))
+
+    for migration in MIGRATIONS[version:]:
+        migration(conn)
+    # never record an older version over a schema migrated by a newer release
+    if version < LATEST_VERSION:
+        conn.execute(schema_version.update().values(version=LATEST_VERSION))
+
+    return start, max(version, LATEST_VERSION)
+
+
+async def migrate() -> tuple[int | None, int]:
+    """
+    Bring the database schema up to date.
+
+    Empty databases are created at the latest version directly. Returns the
+    version found before migrating, None for an empty database, and the version
+    migrated to.
+    """
+    async with db.async_engine.begin() as conn:
+        return await conn.run_sync(_migrate)
+
+
+async def check_version():
+    """
+    Make sure the database schema is at least at the latest version this code
+    knows of. A newer schema, migrated by a newer release rolling out alongside
+    this one, only ever adds to it.
+
+    Costs a single query, for use at startup in place of running DDL.
+    Raises SchemaVersionError if the database needs to be migrated.
+    """
+    async with db.async_engine.connect() as conn:
+        version = await conn.run_sync(_current_version)
+
+    if version is None or version < LATEST_VERSION:
+        raise SchemaVersionError(
+            f"database schema is at version '{version}', expected"
+            f" '{LATEST_VERSION}'. run `chess-api migrate`"
+        )
@@ -3,19 +3,23 @@
 import enum
 
 from sqlalchemy import (
+    DDL,
     Boolean,
     CheckConstraint,
     DateTime,
     Enum,
+    Float,
     ForeignKey,
+    Index,
     Integer,
     String,
+    event,
     func,
     sql,
 )
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column
 
-from chessticulate_api import db
+from chessticulate_api import db, rating
 
 
 class Base(DeclarativeBase):  # pylint: disable=too-few-public-methods
@@ -83,12 +87,38 @@ class User(Base):  # pylint: disable=too-few-public-methods
     wins: Mapped[int] = mapped_column(Integer, server_default="0", nullable=False)
     draws: Mapped[int] = mapped_column(Integer, server_default="0", nullable=False)
     losses: Mapped[int] = mapped_column(Integer, server_default="0", nullable=False)
+    rating: Mapped[float] = mapped_column(
+        Float,
+        server_default=str(rating.INITIAL_RATING),
+        nullable=False,
+        index=True,
+    )
+
+
+# trigram index serving user search, both prefix (LIKE) and fuzzy (%) matches.
+# postgres only, sqlite databases search by scanning the table
+USERS_NAME_TRGM_INDEX = Index(
+    "ix_users_name_trgm",
+    func.lower(User.name).label("name_lower"),
+    postgresql_using="gin",
+    postgresql_ops={"name_lower": "gin_trgm_ops"},
+).ddl_if(dialect="postgresql")
+
+event.listen(
+    Base.metadata,
+    "before_create",
+    DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm").execute_if(dialect="postgresql"),
+)
 
 
 class Invitation(Base):  # pylint: disable=too-few-public-methods
     """Invitation SQL Model"""
 
     __tablename__ = "invitations"
+    __table_args__ = (
+        # pending invitations, oldest first, as expired by the sweeper
+        Index("ix_invitations_status_date_sent", "status", "date_sent"),
+    )
 
     id_: Mapped[int] = mapped_column("id", primary_key=True)
     date_sent: Mapped[str] = mapped_column(
@@ -111,6 +141,11 @@ class ChallengeRequest(Base):  # pylint: disable=too-few-public-methods
     """Challenge Request SQL Model"""
 
     __tablename__ = "challenge_requests"
+    __table_args__ = (
+        # pending challenges, oldest first, as accepted by /challenges/accept-any
+        # and expired by the sweeper
+        Index("ix_challenge_requests_status_created_at", "status", "created_at"),
+    )
 
     id_: Mapped[int] = mapped_column("id", primary_key=True)
     requester_id: Mapped[int] = mapped_column(ForeignKey("users.id"), nullable=False)
@@ -192,7 +227,9 @@ class Move(Base):  # pylint: disable=too-few-public-methods
 
     id_: Mapped[int] = mapped_column("id", primary_key=True)
     user_id: Mapped[int] = mapped_column(ForeignKey("users.id"), nullable=False)
-    game_id: Mapped[int] = mapped_column(ForeignKey("games.id"), nullable=False)
+    game_id: Mapped[int] = mapped_column(
+        ForeignKey("games.id"), nullable=False, index=True
+    )
     timestamp: Mapped[str] = mapped_column(
         DateTime,
         server_default=func.now(),  # pylint: disable=not-callable
@@ -203,6 +240,11 @@ class Move(Base):  # pylint: disable=too-few-public-methods
 
 
 async def init_db():
-    """Submit DDL to database"""
+    """
+    Submit DDL to database.
+
+    Creates any missing tables at the latest schema. Deployed databases are
+    managed by `chessticulate_api.migrations` instead.
+    """
     async with db.async_engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
@@ -0,0 +1,136 @@
+"""chessticulate_api.query_stats"""
+
+import logging
+import time
+from collections import Counter
+from contextvars import ContextVar
+
+from prometheus_client import Counter as PromCounter
+from prometheus_client import Histogram
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from chessticulate_api.config import CONFIG
+
+logger = logging.getLogger(__name__)
+
+QUERIES = Histogram(
+    "chess_request_sql_queries",
+    "SQL statements executed per request.",
+    ["handler"],
+    buckets=(0, 1, 2, 3, 4, 5, 7, 10, 15, 20, 30, 50),
+)
+
+QUERY_SECONDS = Histogram(
+    "chess_request_sql_duration_seconds",
+    "Time spent executing SQL statements per request.",
+    ["handler"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0),
+)
+
+REPEATED_QUERIES = PromCounter(
+    "chess_request_sql_repeated_total",
+    "Requests which executed the same SQL statement more than"
+    " SQL_REPEATED_QUERY_THRESHOLD times, a likely N+1 query.",
+    ["handler"],
+)
+
+
+class QueryStats:  # pylint: disable=too-few-public-methods
+    """SQL statements executed, and the time spent on them, over some scope."""
+
+    __slots__ = ("count", "seconds", "statements", "started")
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        # start of the statement in progress, a request runs one at a time
+        self.started = 0.0
+        self.statements: Counter[str] = Counter()
+
+    def most_repeated(self) -> tuple[str, int]:
+        """The statement executed most often, and how many times."""
+        if not self.statements:
+            return "", 0
+        return self.statements.most_common(1)[0]
+
+
+# stats being collected for the current request, or None
+_stats: ContextVar[QueryStats | None] = ContextVar("query_stats", default=None)
+
+
+# pylint: disable=too-many-arguments, disable=too-many-positional-arguments
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(_conn, _cursor, statement, _params, _context, _many):
+    if (stats := _stats.get()) is not None:
+        stats.count += 1
+        stats.statements[statement] += 1
+        stats.started = time.perf_counter()
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(_conn, _cursor, _statement, _params, _context, _many):
+    if (stats := _stats.get()) is not None:
+        stats.seconds += time.perf_counter() - stats.started
+
+
+class QueryStatsMiddleware:  # pylint: disable=too-few-public-methods
+    """
+    Count the SQL statements each request executes and the time spent on them.
+
+    Results go to prometheus, labelled by route. When CONFIG.sql_debug_headers is
+    set they are also returned as X-SQL-Queries, X-SQL-Time-Ms and
+    X-SQL-Max-Repeats headers. Requests executing one statement more than
+    CONFIG.sql_repeated_query_threshold times are logged as likely N+1 queries.
+    Statements run after the response has started, such as the commit of a
+    request scoped session, are only counted in the metrics.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = QueryStats()
+        token = _stats.set(stats)
+
+        async def send_with_stats(message: Message):
+            if message["type"] == "http.response.start" and CONFIG.sql_debug_headers:
+                headers = MutableHeaders(scope=message)
+                headers.append("X-SQL-Queries", str(stats.count))
+                headers.append("X-SQL-Time-Ms", f"{stats.seconds * 1000:.1f}")
+                headers.append("X-SQL-Max-Repeats", str(stats.most_repeated()[1]))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_stats)
+        finally:
+            _stats.reset(token)
+            _report(scope, stats)
+
+
+def _report(scope: Scope, stats: QueryStats):
+    route = scope.get("route")
+    if route is None:
+        # unmatched paths would make for unbounded label values
+        return
+    handler = route.path
+
+    QUERIES.labels(handler).observe(stats.count)
+    QUERY_SECONDS.labels(handler).observe(stats.seconds)
+
+    statement, repeats = stats.most_repeated()
+    if repeats > CONFIG.sql_repeated_query_threshold:
+        REPEATED_QUERIES.labels(handler).inc()
+        logger.warning(
+            "%s %s executed the same statement %d times, likely an N+1 query: %s",
+            scope["method"],
+            handler,
+            repeats,
+            statement,
+        )
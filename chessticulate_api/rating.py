@@ -0,0 +1,29 @@
+"""chessticulate_api.rating"""
+
+from chessticulate_api.config import CONFIG
+
+# rating of players who haven't finished a game yet
+INITIAL_RATING = 1500.0
+
+
+def expected_score(rating: float, opponent: float) -> float:
+    """Score a player is expected to make against an opponent, 1 being a win."""
+    return 1 / (1 + 10 ** ((opponent - rating) / 400))
+
+
+def white_score(white: int, winner: int | None) -> float:
+    """Score white made in a game, 1 for a win, 0.5 for a draw and 0 for a loss."""
+    if winner is None:
+        return 0.5
+    return 1.0 if winner == white else 0.0
+
+
+def update(white: float, black: float, score: float) -> tuple[float, float]:
+    """
+    Elo ratings of the players of a game after it, white having made `score`.
+
+    Both players' ratings move by the same amount, CONFIG.rating_k_factor times
+    how much better or worse white did than expected.
+    """
+    change = CONFIG.rating_k_factor * (score - expected_score(white, black))
+    return white + change, black - change
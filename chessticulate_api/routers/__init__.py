@@ -3,4 +3,5 @@
 from chessticulate_api.routers.challenge import challenge_router
 from chessticulate_api.routers.game import game_router
 from chessticulate_api.routers.invitation import invitation_router
+from chessticulate_api.routers.leaderboard import leaderboard_router
 from chessticulate_api.routers.user import user_router
@@ -2,18 +2,36 @@
 
 from typing import Annotated
 
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.responses import StreamingResponse
 from pydantic import Field
+from redis.exceptions import RedisError
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from chessticulate_api import crud, db, models, schemas, security
+from chessticulate_api import (
+    crud,
+    db,
+    events,
+    fieldsets,
+    matchmaking,
+    models,
+    schemas,
+    security,
+)
 
 challenge_router = APIRouter(prefix="/challenges")
 
 
+def get_queue() -> matchmaking.MatchmakingQueue:
+    """The matchmaking queue, raising a 503 if it isn't set up."""
+    if matchmaking.queue is None:
+        raise HTTPException(status_code=503, detail="matchmaking is unavailable")
+    return matchmaking.queue
+
+
 @challenge_router.post("", status_code=201)
 async def create_challenge(
-    session: Annotated[AsyncSession, Depends(db.session)],
+    session: Annotated[AsyncSession, Depends(db.session, scope="function")],
     credentials: Annotated[schemas.Credentials, Depends(security.get_credentials)],
 ) -> schemas.CreateChallengeResponse:
     """Create a new challenge request"""
@@ -31,9 +49,13 @@ async def create_challenge(
 
 
 # pylint: disable=too-many-arguments, disable=too-many-positional-arguments
-@challenge_router.get("")
+@challenge_router.get(
+    "",
+    response_model=list[fieldsets.sparse(schemas.GetChallengeResponse)],
+    response_model_exclude_unset=True,
+)
 async def get_challenges(
-    session: Annotated[AsyncSession, Depends(db.session)],
+    session: Annotated[AsyncSession, Depends(db.read_session, scope="function")],
     _: Annotated[schemas.Credentials, Depends(security.get_credentials)],
     requester_id: int | None = None,
     responder_id: int | None = None,
@@ -42,10 +64,20 @@ async def get_challenges(
     skip: int = 0,
     limit: Annotated[int, Field(gt=0, le=50)] = 10,
     reverse: bool = False,
-) -> list[schemas.GetChallengeResponse]:
-    """Retrieve challenges"""
+    fields: str | None = None,
+):
+    """
+    Retrieve challenges
+
+    `fields` is a comma separated list of the fields to return, all by default.
+    """
 
-    args = {"skip": skip, "limit": limit, "reverse": reverse}
+    args = {
+        "skip": skip,
+        "limit": limit,
+        "reverse": reverse,
+        "fields": fieldsets.parse(schemas.GetChallengeResponse, fields),
+    }
 
     if requester_id:
         args["requester_id"] = requester_id
@@ -55,18 +87,34 @@ async def get_challenges(
         args["id_"] = challenge_id
     if status:
         args["status"] = status
-    challenges = await crud.get_challenges(session, **args)
+    challenges = await crud.get_challenge_rows(session, **args)
 
-    result = [
-        schemas.GetChallengeResponse(**vars(challenge)) for challenge in challenges
+    return [
+        fieldsets.sparse(schemas.GetChallengeResponse).model_validate(challenge)
+        for challenge in challenges
     ]
 
-    return result
+
+@challenge_router.post("/accept-any", status_code=202)
+async def accept_any_challenge(
+    session: Annotated[AsyncSession, Depends(db.session, scope="function")],
+    credentials: Annotated[schemas.Credentials, Depends(security.get_credentials)],
+) -> schemas.AcceptAnyChallengeResponse:
+    """
+    Accept the oldest open challenge made by someone else. Challenges being
+    accepted by other users meanwhile are skipped rather than waited on.
+    """
+    if not (game := await crud.accept_any_challenge(session, credentials.user_id)):
+        raise HTTPException(status_code=404, detail="no challenge is available")
+
+    return schemas.AcceptAnyChallengeResponse(
+        challenge_id=game["challenge_id"], game_id=game["id"]
+    )
 
 
 @challenge_router.post("/{challenge_id}/accept", status_code=202)
 async def accept_challenge(
-    session: Annotated[AsyncSession, Depends(db.session)],
+    session: Annotated[AsyncSession, Depends(db.session, scope="function")],
     credentials: Annotated[schemas.Credentials, Depends(security.get_credentials)],
     challenge_id: int,
 ) -> schemas.AcceptChallengeResponse:
@@ -114,7 +162,7 @@ async def accept_challenge(
 
 @challenge_router.post("/{challenge_id}/cancel", status_code=200)
 async def cancel_challenge(
-    session: Annotated[AsyncSession, Depends(db.session)],
+    session: Annotated[AsyncSession, Depends(db.session, scope="function")],
     credentials: Annotated[schemas.Credentials, Depends(security.get_credentials)],
     challenge_id: int,
 ):
@@ -141,3 +189,68 @@ async def cancel_challenge(
 
     if not await crud.cancel_challenge(session, challenge_id):
         raise HTTPException(status_code=500)
+
+
+@challenge_router.post("/queue", status_code=202)
+async def join_queue(
+    session: Annotated[AsyncSession, Depends(db.read_session, scope="function")],
+    credentials: Annotated[schemas.Credentials, Depends(security.get_credentials)],
+    queue: Annotated[matchmaking.MatchmakingQueue, Depends(get_queue)],
+    payload: schemas.JoinQueueRequest | None = None,
+) -> schemas.JoinQueueResponse:
+    """
+    Wait in the matchmaking queue for an opponent of the same game type, within
+    `rating_window` rating points if set. Matches are pushed to
+    `GET /challenges/queue/updates`. Joining again replaces the earlier entry.
+    """
+    payload = payload or schemas.JoinQueueRequest()
+    users = await crud.get_user_rows(
+        session, limit=1, fields=("rating",), id_=credentials.user_id, deleted=False
+    )
+    if not users:
+        raise HTTPException(status_code=404, detail="user does not exist")
+
+    player = matchmaking.Player(
+        credentials.user_id, users[0]["rating"], payload.rating_window
+    )
+    try:
+        await queue.join(payload.game_type, player)
+    except RedisError as exc:
+        raise HTTPException(
+            status_code=503, detail="matchmaking is unavailable"
+        ) from exc
+
+    return schemas.JoinQueueResponse(
+        game_type=payload.game_type,
+        rating=player.rating,
+        rating_window=player.window,
+    )
+
+
+@challenge_router.delete("/queue", status_code=200)
+async def leave_queue(
+    credentials: Annotated[schemas.Credentials, Depends(security.get_credentials)],
+    queue: Annotated[matchmaking.MatchmakingQueue, Depends(get_queue)],
+):
+    """Stop waiting in the matchmaking queue"""
+    try:
+        left = await queue.leave(credentials.user_id)
+    except RedisError as exc:
+        raise HTTPException(
+            status_code=503, detail="matchmaking is unavailable"
+        ) from exc
+    if not left:
+        raise HTTPException(status_code=404, detail="user is not in the queue")
+
+
+@challenge_router.get("/queue/updates")
+async def queue_updates(
+    credentials: Annotated[schemas.Credentials, Depends(security.get_credentials)],
+    request: Request,
+) -> StreamingResponse:
+    """
+    Subscribe to the caller's matches, each a `{"type": "match", "gameId": ...,
+    "white": ..., "black": ...}` event, and to their challenges and invitations
+    expiring, as `challenge_cancelled` and `invitation_cancelled` events
+    """
+    return await events.stream(request, events.user_channel(credentials.user_id))
@@ -1,23 +1,104 @@
 """chessticulate_api.routers.game"""
 
-import json
-from typing import Annotated
-
-from fastapi import APIRouter, Depends, HTTPException, Request
+import hashlib
+from typing import Annotated, Literal
+
+from fastapi import (
+    APIRouter,
+    BackgroundTasks,
+    Depends,
+    HTTPException,
+    Request,
+    Response,
+)
 from fastapi.responses import StreamingResponse
 from pydantic import Field
-from redis.asyncio import Redis
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from chessticulate_api import crud, db, schemas, security, workers_service
+from chessticulate_api import (
+    crud,
+    db,
+    events,
+    fieldsets,
+    leaderboard,
+    schemas,
+    security,
+    serialization,
+    workers_service,
+)
 
 game_router = APIRouter(prefix="/games")
 
+# finished games never change, clients may keep them for a year
+FINISHED_GAME_CACHE_CONTROL = "private, max-age=31536000, immutable"
+# active games can change with any move, clients must revalidate every time
+ACTIVE_GAME_CACHE_CONTROL = "private, no-cache"
+
+# fields of game lists unless asked for otherwise, move histories are left out
+# as they make up most of a game and list views rarely show them
+LIST_FIELDS = tuple(
+    field for field in fieldsets.every(schemas.GetGameResponse) if field != "move_hist"
+)
+
+
+async def _record_result(
+    session: AsyncSession, game, background_tasks: BackgroundTasks
+):
+    """
+    Set the players' wins on the leaderboard, once a game has ended.
+
+    The wins are read in the game's transaction and recorded once the response is
+    sent, after the transaction has committed, so the leaderboard never shows a
+    result which was rolled back. The endpoint's session must be function scoped
+    for its transaction to end before background tasks run.
+    """
+    if game.is_active or leaderboard.board is None:
+        return
+    users = await crud.get_user_rows(
+        session, ids=[game.white, game.black], limit=2, fields=("wins",)
+    )
+    background_tasks.add_task(
+        leaderboard.board.record,
+        {user["id"]: user["wins"] for user in users if user["wins"]},
+    )
+
+
+def _game_etag(game: crud.Row) -> str:
+    """
+    Entity tag of a game, changes whenever last_active does. Weak, as compressed
+    and uncompressed responses share it.
+    """
+    version = f"{game['id']}:{game['last_active'].isoformat()}:{game['is_active']}"
+    digest = hashlib.blake2b(version.encode(), digest_size=12).hexdigest()
+    return f'W/"{digest}"'
+
+
+def _game_cache_headers(game: crud.Row) -> dict[str, str]:
+    return {
+        "ETag": _game_etag(game),
+        "Cache-Control": (
+            ACTIVE_GAME_CACHE_CONTROL
+            if game["is_active"]
+            else FINISHED_GAME_CACHE_CONTROL
+        ),
+    }
+
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    # If-None-Match uses weak comparison, W/ prefixes are ignored
+    etag = etag.removeprefix("W/")
+    tags = (tag.strip().removeprefix("W/") for tag in if_none_match.split(","))
+    return any(tag in (etag, "*") for tag in tags)
+
 
 # pylint: disable=too-many-arguments, disable=too-many-positional-arguments
-@game_router.get("")
+@game_router.get(
+    "",
+    response_model=list[fieldsets.sparse(schemas.GetGameResponse)],
+    response_model_exclude_unset=True,
+)
 async def get_games(
-    session: Annotated[AsyncSession, Depends(db.session)],
+    session: Annotated[AsyncSession, Depends(db.read_session, scope="function")],
     _: Annotated[schemas.Credentials, Depends(security.get_credentials)],
     game_id: int | None = None,
     player_id: int | None = None,
@@ -30,9 +111,23 @@ async def get_games(
     skip: int = 0,
     limit: Annotated[int, Field(gt=0, le=50)] = 10,
     reverse: bool = False,
-) -> list[schemas.GetGameResponse]:
-    """Retrieve a list of games"""
-    args = {"skip": skip, "limit": limit, "reverse": reverse}
+    fields: str | None = None,
+    include: Literal["moves"] | None = None,
+):
+    """
+    Retrieve a list of games
+
+    `fields` is a comma separated list of the fields to return. By default every
+    field except move_hist is returned, `include=moves` adds the move histories.
+    """
+    args = {
+        "skip": skip,
+        "limit": limit,
+        "reverse": reverse,
+        "fields": fieldsets.parse(schemas.GetGameResponse, fields) or LIST_FIELDS,
+    }
+    if include == "moves":
+        args["fields"] += ("move_hist",)
 
     if game_id:
         args["id_"] = game_id
@@ -50,18 +145,50 @@ async def get_games(
         args["player_id"] = player_id
     if is_active is not None:
         args["is_active"] = is_active
-    games = await crud.get_games(session, **args)
+    games = await crud.get_game_rows(session, **args)
 
-    result = [schemas.GetGameResponse(**vars(game)) for game in games]
+    return [
+        fieldsets.sparse(schemas.GetGameResponse).model_validate(game) for game in games
+    ]
 
-    return result
+
+@game_router.get("/{game_id}", responses={304: {"description": "Not Modified"}})
+async def get_game(
+    session: Annotated[AsyncSession, Depends(db.read_session, scope="function")],
+    _: Annotated[schemas.Credentials, Depends(security.get_credentials)],
+    request: Request,
+    response: Response,
+    game_id: int,
+) -> schemas.GetGameResponse:
+    """
+    Retrieve a single game.
+
+    Responses carry an ETag. Send it back in If-None-Match to get a 304 Not
+    Modified, without the game being loaded, as long as the game hasn't changed.
+    Finished games are marked as cacheable indefinitely.
+    """
+    if if_none_match := request.headers.get("If-None-Match"):
+        version = await crud.get_game_version(session, game_id)
+        if version is None:
+            raise HTTPException(status_code=404, detail="invalid game id")
+        headers = _game_cache_headers(version)
+        if _etag_matches(if_none_match, headers["ETag"]):
+            return Response(status_code=304, headers=headers)
+
+    games = await crud.get_game_rows(session, id_=game_id, limit=1)
+    if not games:
+        raise HTTPException(status_code=404, detail="invalid game id")
+
+    response.headers.update(_game_cache_headers(games[0]))
+    return schemas.GetGameResponse.model_validate(games[0])
 
 
 # pylint: disable=too-many-locals
 @game_router.post("/{game_id}/move")
 async def move(
-    session: Annotated[AsyncSession, Depends(db.session)],
+    session: Annotated[AsyncSession, Depends(db.session, scope="function")],
     request: Request,
+    background_tasks: BackgroundTasks,
     credentials: Annotated[schemas.Credentials, Depends(security.get_credentials)],
     game_id: int,
     payload: schemas.DoMoveRequest,
@@ -69,7 +196,9 @@ async def move(
     """Attempt a move on a given game"""
 
     user_id = credentials.user_id
-    games = await crud.get_games(session, id_=game_id)
+    # locked until the move commits, so a concurrent move or forfeit of the game
+    # waits and then sees its result
+    games = await crud.get_games(session, id_=game_id, lock_rows=True)
 
     if not games:
         raise HTTPException(status_code=404, detail="invalid game id")
@@ -88,9 +217,12 @@ async def move(
             detail=f"it is not the turn of user with id '{user_id}'",
         )
 
+    if not game.is_active:
+        raise HTTPException(status_code=409, detail=f"game '{game_id}' is over")
+
     try:
         response = await workers_service.do_move(
-            game.fen, payload.move, json.loads(game.states)
+            game.fen, payload.move, serialization.loads(game.states)
         )
     except workers_service.ClientRequestError as e:
         raise HTTPException(status_code=400, detail=str(e)) from e
@@ -108,13 +240,13 @@ async def move(
         user_id,
         whomst,
         payload.move,
-        json.dumps(states),
+        serialization.dumps(states),
         fen,
         status,
     )
+    await _record_result(session, updated_game, background_tasks)
 
     # publish update to redis
-    redis: Redis = request.app.state.redis
     event = {
         "type": "move",
         "gameId": game_id,
@@ -123,7 +255,7 @@ async def move(
         "status": status,
         "whomst": whomst,
     }
-    await redis.publish(f"game:{game_id}", json.dumps(event))
+    await events.publish(request.app.state.redis, events.game_channel(game_id), event)
 
     return schemas.DoMoveResponse(**vars(updated_game))
 
@@ -137,44 +269,13 @@ async def game_update(
     game_id: int,
 ) -> StreamingResponse:
     """subscribe to recieve live updates from games"""
-
-    redis: Redis = request.app.state.redis
-    pubsub = redis.pubsub()
-    channel = f"game:{game_id}"
-    await pubsub.subscribe(channel)
-
-    async def event_stream():
-        # notify client that connection has been made
-        yield ": connected\n\n"
-        try:
-            while True:
-                # wait 1s for message, send heartbeat if none
-                msg = await pubsub.get_message(
-                    ignore_subscribe_messages=True,
-                    timeout=1.0,
-                )
-                if msg and msg["type"] == "message":
-                    data = msg["data"]
-                    yield f"data: {data}\n\n"
-                else:
-                    yield ": ping\n\n"
-                if await request.is_disconnected():
-                    break
-        finally:
-            await pubsub.unsubscribe(channel)
-            await pubsub.close()
-
-    headers = {
-        "Content-Type": "text/event-stream",
-        "Cache-Control": "no-cache, no-transform",
-        "Connection": "keep-alive",
-    }
-    return StreamingResponse(event_stream(), headers=headers)
+    return await events.stream(request, events.game_channel(game_id))
 
 
 @game_router.post("/{game_id}/forfeit")
 async def forfeit(
-    session: Annotated[AsyncSession, Depends(db.session)],
+    session: Annotated[AsyncSession, Depends(db.session, scope="function")],
+    background_tasks: BackgroundTasks,
     credentials: Annotated[schemas.Credentials, Depends(security.get_credentials)],
     game_id: int,
 ) -> schemas.ForfeitResponse:
@@ -195,5 +296,6 @@ async def forfeit(
         )
 
     quiter = await crud.forfeit(session, user_id, game)
+    await _record_result(session, quiter, background_tasks)
 
     return schemas.ForfeitResponse(**vars(quiter))
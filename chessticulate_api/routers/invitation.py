@@ -6,14 +6,14 @@ from fastapi import APIRouter, Depends, HTTPException
 from pydantic import Field
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from chessticulate_api import crud, db, models, schemas, security
+from chessticulate_api import crud, db, fieldsets, models, schemas, security
 
 invitation_router = APIRouter(prefix="/invitations")
 
 
 @invitation_router.post("", status_code=201)
 async def create_invitation(
-    session: Annotated[AsyncSession, Depends(db.session)],
+    session: Annotated[AsyncSession, Depends(db.session, scope="function")],
     credentials: Annotated[schemas.Credentials, Depends(security.get_credentials)],
     payload: schemas.CreateInvitationRequest,
 ) -> schemas.CreateInvitationResponse:
@@ -41,9 +41,13 @@ async def create_invitation(
 
 
 # pylint: disable=too-many-arguments, disable=too-many-positional-arguments
-@invitation_router.get("")
+@invitation_router.get(
+    "",
+    response_model=list[fieldsets.sparse(schemas.GetInvitationResponse)],
+    response_model_exclude_unset=True,
+)
 async def get_invitations(
-    session: Annotated[AsyncSession, Depends(db.session)],
+    session: Annotated[AsyncSession, Depends(db.read_session, scope="function")],
     credentials: Annotated[schemas.Credentials, Depends(security.get_credentials)],
     to_id: int | None = None,
     from_id: int | None = None,
@@ -52,8 +56,13 @@ async def get_invitations(
     skip: int = 0,
     limit: Annotated[int, Field(gt=0, le=50)] = 10,
     reverse: bool = False,
-) -> list[schemas.GetInvitationResponse]:
-    """Retrieve a list of invitations."""
+    fields: str | None = None,
+):
+    """
+    Retrieve a list of invitations.
+
+    `fields` is a comma separated list of the fields to return, all by default.
+    """
     if not (to_id or from_id):
         raise HTTPException(
             status_code=400, detail="'to_id' or 'from_id' must be supplied"
@@ -64,7 +73,12 @@ async def get_invitations(
             detail="'to_id' or 'from_id' must match the requestor's user ID",
         )
 
-    args = {"skip": skip, "limit": limit, "reverse": reverse}
+    args = {
+        "skip": skip,
+        "limit": limit,
+        "reverse": reverse,
+        "fields": fieldsets.parse(schemas.GetInvitationResponse, fields),
+    }
 
     if to_id:
         args["to_id"] = to_id
@@ -74,18 +88,17 @@ async def get_invitations(
         args["id_"] = invitation_id
     if status:
         args["status"] = status
-    invitations = await crud.get_invitations(session, **args)
+    invitations = await crud.get_invitation_rows(session, **args)
 
-    result = [
-        schemas.GetInvitationResponse(**vars(invitation)) for invitation in invitations
+    return [
+        fieldsets.sparse(schemas.GetInvitationResponse).model_validate(invitation)
+        for invitation in invitations
     ]
 
-    return result
-
 
 @invitation_router.put("/{invitation_id}/accept")
 async def accept_invitation(
-    session: Annotated[AsyncSession, Depends(db.session)],
+    session: Annotated[AsyncSession, Depends(db.session, scope="function")],
     credentials: Annotated[schemas.Credentials, Depends(security.get_credentials)],
     invitation_id: int,
 ) -> schemas.AcceptInvitationResponse:
@@ -141,7 +154,7 @@ async def accept_invitation(
 
 @invitation_router.put("/{invitation_id}/decline")
 async def decline_invitation(
-    session: Annotated[AsyncSession, Depends(db.session)],
+    session: Annotated[AsyncSession, Depends(db.session, scope="function")],
     credentials: Annotated[schemas.Credentials, Depends(security.get_credentials)],
     invitation_id: int,
 ):
@@ -192,7 +205,7 @@ async def decline_invitation(
 
 @invitation_router.put("/{invitation_id}/cancel")
 async def cancel_invitation(
-    session: Annotated[AsyncSession, Depends(db.session)],
+    session: Annotated[AsyncSession, Depends(db.session, scope="function")],
     credentials: Annotated[schemas.Credentials, Depends(security.get_credentials)],
     invitation_id: int,
 ):
@@ -0,0 +1,49 @@
+"""chessticulate_api.routers.leaderboard"""
+
+from typing import Annotated
+
+from fastapi import APIRouter, Depends, HTTPException
+from pydantic import Field
+from redis.exceptions import RedisError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from chessticulate_api import crud, db, leaderboard, schemas, security
+
+leaderboard_router = APIRouter(prefix="/leaderboard")
+
+
+def get_board() -> leaderboard.Leaderboard:
+    """The leaderboard, raising a 503 if it isn't set up."""
+    if leaderboard.board is None:
+        raise HTTPException(status_code=503, detail="leaderboard is unavailable")
+    return leaderboard.board
+
+
+@leaderboard_router.get("")
+async def get_leaderboard(
+    session: Annotated[AsyncSession, Depends(db.read_session, scope="function")],
+    _: Annotated[schemas.Credentials, Depends(security.get_credentials)],
+    board: Annotated[leaderboard.Leaderboard, Depends(get_board)],
+    skip: Annotated[int, Field(ge=0)] = 0,
+    limit: Annotated[int, Field(gt=0, le=50)] = 10,
+) -> list[schemas.LeaderboardEntry]:
+    """
+    Retrieve users ranked by wins, most wins first. Users with as many wins share
+    a rank, users who haven't won yet aren't listed.
+    """
+    try:
+        page = await board.page(skip, limit)
+    except (leaderboard.NotBuiltError, RedisError) as exc:
+        raise HTTPException(
+            status_code=503, detail="leaderboard is unavailable"
+        ) from exc
+
+    usernames = await crud.get_usernames(session, [user_id for _, user_id, _ in page])
+    return [
+        schemas.LeaderboardEntry(
+            rank=rank, user_id=user_id, username=usernames[user_id], wins=wins
+        )
+        for rank, user_id, wins in page
+        # left in the leaderboard until its next rebuild
+        if user_id in usernames
+    ]
@@ -2,67 +2,193 @@
 
 from typing import Annotated
 
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Query, Response
 from pydantic import Field
+from redis.exceptions import RedisError
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from chessticulate_api import crud, db, schemas, security
+from chessticulate_api import (
+    bloom,
+    crud,
+    db,
+    fieldsets,
+    leaderboard,
+    metrics,
+    schemas,
+    security,
+)
+from chessticulate_api.routers.leaderboard import get_board
 
 user_router = APIRouter(prefix="/users")
 
+# most users `GET /users?ids=` looks up at once
+MAX_IDS = 50
+
+
+def _parse_ids(ids: str) -> list[int]:
+    """Parse a comma separated list of user ids, without duplicates, in order."""
+    try:
+        parsed = list(dict.fromkeys(int(id_) for id_ in ids.split(",")))
+    except ValueError as exc:
+        raise HTTPException(
+            status_code=400, detail="'ids' must be a comma separated list of user ids"
+        ) from exc
+    if len(parsed) > MAX_IDS:
+        raise HTTPException(
+            status_code=400, detail=f"at most {MAX_IDS} ids can be looked up at once"
+        )
+    return parsed
+
 
 # pylint: disable=too-many-arguments, disable=too-many-positional-arguments
-@user_router.get("")
+@user_router.get(
+    "",
+    response_model=list[fieldsets.sparse(schemas.GetUserResponse)],
+    response_model_exclude_unset=True,
+)
 async def get_users(
-    session: Annotated[AsyncSession, Depends(db.session)],
+    session: Annotated[AsyncSession, Depends(db.read_session, scope="function")],
     _: Annotated[schemas.Credentials, Depends(security.get_credentials)],
+    response: Response,
     user_id: int | None = None,
+    ids: str | None = None,
     user_name: str | None = None,
     skip: int = 0,
     limit: Annotated[int, Field(gt=0, le=50)] = 10,
     order_by: str = "date_joined",
     reverse: bool = False,
-) -> list[schemas.GetUserResponse]:
-    """Retrieve user info."""
-    args = {"skip": skip, "limit": limit, "order_by": order_by, "reverse": reverse}
+    fields: str | None = None,
+):
+    """
+    Retrieve user info.
+
+    `ids` looks up a comma separated list of up to 50 user ids at once, users are
+    returned in the same order, ignoring skip and limit. Ids of users which don't
+    exist are listed in the X-Missing-Ids response header.
+
+    `fields` is a comma separated list of the fields to return, all by default.
+    """
+    args = {
+        "skip": skip,
+        "limit": limit,
+        "order_by": order_by,
+        "reverse": reverse,
+        "fields": fieldsets.parse(schemas.GetUserResponse, fields),
+    }
 
     if user_id:
         args["id_"] = user_id
     if user_name:
         args["name"] = user_name
-
-    users = await crud.get_users(session, **args)
-
-    return [schemas.GetUserResponse(**vars(user)) for user in users]
+    if ids is not None:
+        args["ids"] = _parse_ids(ids)
+        args["skip"], args["limit"] = 0, len(args["ids"])
+
+    users = await crud.get_user_rows(session, **args)
+
+    if ids is not None:
+        found = {user["id"]: user for user in users}
+        users = [found[id_] for id_ in args["ids"] if id_ in found]
+        if missing := [str(id_) for id_ in args["ids"] if id_ not in found]:
+            response.headers["X-Missing-Ids"] = ",".join(missing)
+
+    return [
+        fieldsets.sparse(schemas.GetUserResponse).model_validate(user) for user in users
+    ]
+
+
+async def _taken(session: AsyncSession, field: str, value: str) -> bool:
+    """
+    Whether a user with the given name or email exists. The database is only
+    queried when the filter of taken names and emails can't rule it out.
+    """
+    user_filter = bloom.user_filter
+    if user_filter is not None:
+        might_have = (
+            user_filter.might_have_name
+            if field == "name"
+            else user_filter.might_have_email
+        )
+        if not await might_have(value):
+            metrics.USER_FILTER_CHECKS.labels(field, "free").inc()
+            return False
+
+    taken = bool(
+        await crud.get_user_rows(session, limit=1, fields=(), **{field: value})
+    )
+    if user_filter is not None:
+        result = "taken" if taken else "false_positive"
+        metrics.USER_FILTER_CHECKS.labels(field, result).inc()
+    return taken
+
+
+@user_router.get("/search")
+async def search_users(
+    session: Annotated[AsyncSession, Depends(db.read_session, scope="function")],
+    _: Annotated[schemas.Credentials, Depends(security.get_credentials)],
+    q: Annotated[str, Query(min_length=2, max_length=15)],
+    limit: Annotated[int, Field(gt=0, le=50)] = 10,
+) -> list[schemas.GetUserResponse]:
+    """
+    Search users by name, best match first: the exact name, then names starting
+    with `q`, then similar names. Deleted users are left out.
+    """
+    users = await crud.search_users(session, q, limit=limit)
+    return [schemas.GetUserResponse.model_validate(user) for user in users]
 
 
 @user_router.get("/name/{name}", status_code=200)
 async def username_exists(
-    session: Annotated[AsyncSession, Depends(db.session)],
+    session: Annotated[AsyncSession, Depends(db.read_session, scope="function")],
     name: str,
 ) -> schemas.ExistsResponse:
     """Check if a username is already taken"""
-    result = await crud.get_users(session, name=name)
-    if len(result) == 0:
+    if not await _taken(session, "name", name):
         return schemas.ExistsResponse(exists=False, detail="username does not exist")
     return schemas.ExistsResponse(exists=True, detail="username exists")
 
 
 @user_router.get("/email/{email}", status_code=200)
 async def email_exists(
-    session: Annotated[AsyncSession, Depends(db.session)],
+    session: Annotated[AsyncSession, Depends(db.read_session, scope="function")],
     email: str,
 ) -> schemas.ExistsResponse:
     """Check if an email is already taken"""
-    result = await crud.get_users(session, email=email)
-    if len(result) == 0:
+    if not await _taken(session, "email", email):
         return schemas.ExistsResponse(exists=False, detail="email does not exist")
     return schemas.ExistsResponse(exists=True, detail="email exists")
 
 
+@user_router.get("/{user_id}/rank")
+async def get_rank(
+    session: Annotated[AsyncSession, Depends(db.read_session, scope="function")],
+    _: Annotated[schemas.Credentials, Depends(security.get_credentials)],
+    board: Annotated[leaderboard.Leaderboard, Depends(get_board)],
+    user_id: int,
+) -> schemas.GetRankResponse:
+    """
+    Retrieve a user's rank on the leaderboard. Users with as many wins share a
+    rank, users who haven't won yet rank after everyone who has.
+    """
+    try:
+        rank, wins = await board.rank(user_id)
+    except (leaderboard.NotBuiltError, RedisError) as exc:
+        raise HTTPException(
+            status_code=503, detail="leaderboard is unavailable"
+        ) from exc
+
+    # users who haven't won aren't in the leaderboard, make sure they exist
+    if not wins and not await crud.get_user_rows(
+        session, limit=1, fields=(), id_=user_id, deleted=False
+    ):
+        raise HTTPException(status_code=404, detail="user not found")
+
+    return schemas.GetRankResponse(user_id=user_id, rank=rank, wins=wins)
+
+
 @user_router.get("/self")
 async def get_self(
-    session: Annotated[AsyncSession, Depends(db.session)],
+    session: Annotated[AsyncSession, Depends(db.read_session, scope="function")],
     credentials: Annotated[schemas.Credentials, Depends(security.get_credentials)],
 ) -> schemas.GetOwnUserResponse:
     """Retrieve own user info."""
@@ -74,9 +200,12 @@ async def get_self(
 
 @user_router.delete("/self", status_code=204)
 async def delete_user(
-    session: Annotated[AsyncSession, Depends(db.session)],
+    session: Annotated[AsyncSession, Depends(db.session, scope="function")],
     credentials: Annotated[schemas.Credentials, Depends(security.get_credentials)],
+    background_tasks: BackgroundTasks,
 ):
     """Delete own user."""
     user_id = credentials.user_id
-    await crud.delete_user(session, user_id)
+    if await crud.delete_user(session, user_id) and leaderboard.board is not None:
+        # once the deletion has committed, a rollback leaves the user ranked
+        background_tasks.add_task(leaderboard.board.remove, user_id)
@@ -95,6 +95,31 @@ class AcceptChallengeResponse(BaseModel):
     game_id: int
 
 
+class AcceptAnyChallengeResponse(BaseModel):
+    """Pydantic model for accepting any open challenge request"""
+
+    challenge_id: int
+    game_id: int
+
+
+class JoinQueueRequest(BaseModel):
+    """Pydantic model for joining the matchmaking queue"""
+
+    game_type: GameTypeEnum = GameTypeEnum.CHESS
+    # most rating points between the player and their opponent, any if unset
+    rating_window: float | None = Field(default=None, gt=0)
+
+    model_config = {"use_enum_values": True}
+
+
+class JoinQueueResponse(BaseModel):
+    """Pydantic model for joining the matchmaking queue response"""
+
+    game_type: str
+    rating: float
+    rating_window: float | None = None
+
+
 class LoginRequest(BaseModel):
     """pydantic Model fro Login Requests"""
 
@@ -150,6 +175,7 @@ class GetUserResponse(BaseModel):
     wins: int
     draws: int
     losses: int
+    rating: float
 
 
 class ExistsResponse(BaseModel):
@@ -165,6 +191,23 @@ class GetOwnUserResponse(GetUserResponse):
     email: str
 
 
+class GetRankResponse(BaseModel):
+    """Pydantic model for a user's leaderboard rank"""
+
+    user_id: int
+    rank: int
+    wins: int
+
+
+class LeaderboardEntry(BaseModel):
+    """Pydantic model for an entry of the leaderboard"""
+
+    rank: int
+    user_id: int
+    username: str
+    wins: int
+
+
 class GetUserListResponse(RootModel):
     """Pydantic model for returning a list of GetUserResponses"""
 
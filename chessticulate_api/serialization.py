@@ -0,0 +1,37 @@
+"""chessticulate_api.serialization"""
+
+import json
+from typing import Any
+
+from fastapi.responses import JSONResponse, ORJSONResponse
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None  # pylint: disable=invalid-name
+
+
+if orjson is not None:
+
+    def loads(data: str | bytes) -> Any:
+        """Parse a JSON document."""
+        return orjson.loads(data)  # pylint: disable=no-member
+
+    def dumps(obj: Any) -> str:
+        """Serialize `obj` to compact JSON."""
+        return orjson.dumps(obj).decode()  # pylint: disable=no-member
+
+    # response class used by every endpoint unless it picks its own
+    DefaultResponse: type[JSONResponse] = ORJSONResponse
+
+else:  # pragma: no cover
+
+    def loads(data: str | bytes) -> Any:
+        """Parse a JSON document."""
+        return json.loads(data)
+
+    def dumps(obj: Any) -> str:
+        """Serialize `obj` to compact JSON."""
+        return json.dumps(obj, separators=(",", ":"), ensure_ascii=False)
+
+    DefaultResponse = JSONResponse
@@ -0,0 +1,100 @@
+"""chessticulate_api.server_timing"""
+
+import time
+from contextvars import ContextVar
+
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+
+class _Timings:  # pylint: disable=too-few-public-methods
+    """Durations accumulated over one request, in seconds, by metric name."""
+
+    __slots__ = ("durations", "active")
+
+    def __init__(self):
+        self.durations: dict[str, float] = {}
+        # metrics currently being timed, so nested calls aren't counted twice
+        self.active: set[str] = set()
+
+
+# only set while ServerTimingMiddleware is handling a request
+_timings: ContextVar[_Timings | None] = ContextVar("server_timings", default=None)
+
+
+class _Timer:
+    """Context manager behind `timer`, a class as it is on every crud call path."""
+
+    __slots__ = ("name", "timings", "start")
+
+    def __init__(self, name: str):
+        self.name = name
+        self.timings: _Timings | None = None
+        self.start = 0.0
+
+    def __enter__(self):
+        timings = _timings.get()
+        if timings is not None and self.name not in timings.active:
+            timings.active.add(self.name)
+            self.timings = timings
+            self.start = time.perf_counter()
+
+    def __exit__(self, *_):
+        if (timings := self.timings) is not None:
+            elapsed = time.perf_counter() - self.start
+            timings.active.discard(self.name)
+            durations = timings.durations
+            durations[self.name] = durations.get(self.name, 0.0) + elapsed
+
+
+def timer(name: str) -> _Timer:
+    """
+    Add the time spent in a `with` block to the `name` entry of the current
+    request's Server-Timing header. Does nothing unless ServerTimingMiddleware is
+    installed.
+    """
+    return _Timer(name)
+
+
+def header_value(durations: dict[str, float]) -> str:
+    """Format durations in seconds as a Server-Timing header value."""
+    return ", ".join(
+        f"{name};dur={secs * 1000:.1f}" for name, secs in durations.items()
+    )
+
+
+class ServerTimingMiddleware:  # pylint: disable=too-few-public-methods
+    """
+    Report where each request spent its time in a Server-Timing header, e.g.
+    `auth;dur=1.2, db;dur=3.1, workers;dur=41.0, redis;dur=0.4, app;dur=47.9`.
+
+    "app" is the total time until the response started. Entries can overlap,
+    the database lookup made by authentication counts towards both auth and db.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        timings = _Timings()
+        token = _timings.set(timings)
+        start = time.perf_counter()
+
+        async def send_with_timings(message: Message):
+            if message["type"] == "http.response.start":
+                durations = {
+                    **timings.durations,
+                    "app": time.perf_counter() - start,
+                }
+                headers = MutableHeaders(scope=message)
+                headers.append("Server-Timing", header_value(durations))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timings)
+        finally:
+            _timings.reset(token)
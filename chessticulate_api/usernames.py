@@ -0,0 +1,59 @@
+"""chessticulate_api.usernames"""
+
+from collections import OrderedDict
+from typing import Iterable
+
+from chessticulate_api.config import CONFIG
+
+
+class UsernameCache:
+    """
+    Bounded LRU map of user ids to usernames, kept in process.
+
+    Usernames never change after signup, so entries never go stale and every
+    worker process can keep its own cache without coordinating. Entries are
+    dropped when a user is deleted all the same, deleted users are rarely looked
+    up again and shouldn't hold on to a slot.
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._names: OrderedDict[int, str] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._names)
+
+    def lookup(self, ids: Iterable[int]) -> tuple[dict[int, str], set[int]]:
+        """Usernames of the cached ids, and the set of ids which aren't cached."""
+        names: dict[int, str] = {}
+        missing: set[int] = set()
+        for id_ in ids:
+            name = self._names.get(id_)
+            if name is None:
+                missing.add(id_)
+            else:
+                self._names.move_to_end(id_)
+                names[id_] = name
+        return names, missing
+
+    def update(self, names: dict[int, str]):
+        """Cache `names`, evicting the least recently used entries over max_size."""
+        if self.max_size <= 0:
+            return
+        for id_, name in names.items():
+            self._names[id_] = name
+            self._names.move_to_end(id_)
+        while len(self._names) > self.max_size:
+            self._names.popitem(last=False)
+
+    def discard(self, id_: int):
+        """Drop the entry of a user, if cached."""
+        self._names.pop(id_, None)
+
+    def clear(self):
+        """Drop every entry."""
+        self._names.clear()
+
+
+# usernames of list query results, shared by every request of the process
+cache = UsernameCache(CONFIG.username_cache_size)
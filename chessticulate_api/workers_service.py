@@ -2,6 +2,7 @@
 
 import httpx
 
+from chessticulate_api import metrics
 from chessticulate_api.config import CONFIG
 
 
@@ -19,6 +20,12 @@ class ClientRequestError(Exception):
         self.detail = detail
 
 
+@metrics.timed(
+    metrics.WORKERS_SECONDS,
+    "move",
+    timing="workers",
+    outcomes={ClientRequestError: "rejected"},
+)
 async def do_move(fen: str, move: str, states: dict[str, str]):
     """do move request to chess-workers service"""
     client = httpx.AsyncClient()
@@ -45,6 +52,12 @@ async def do_move(fen: str, move: str, states: dict[str, str]):
         await client.aclose()
 
 
+@metrics.timed(
+    metrics.WORKERS_SECONDS,
+    "suggest",
+    timing="workers",
+    outcomes={ClientRequestError: "rejected"},
+)
 async def suggest_move(fen: str, states: dict[str, str]):
     """suggest move request to chess-workers service"""
     client = httpx.AsyncClient()
@@ -1,5 +1,5 @@
 from copy import copy
-from unittest.mock import AsyncMock
+from unittest.mock import AsyncMock, MagicMock
 
 import pytest
 import pytest_asyncio
@@ -9,7 +9,7 @@ from sqlalchemy import text
 from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from chessticulate_api import app, config, crud, db, models
+from chessticulate_api import app, config, crud, db, models, usernames
 
 FAKE_USER_DATA = [
     {
@@ -216,6 +216,13 @@ async def _init_fake_data():
         config.CONFIG.sql_conn_str, echo=config.CONFIG.sql_echo
     )
     db.async_session = db.async_sessionmaker(db.async_engine, expire_on_commit=False)
+    db.async_read_engine = db.async_engine
+    db.async_read_session = db.async_sessionmaker(
+        db.read_only(db.async_read_engine), expire_on_commit=False
+    )
+    db.async_primary_read_session = db.async_sessionmaker(
+        db.read_only(db.async_engine), expire_on_commit=False
+    )
     await models.init_db()
 
     async with db.async_session() as session:
@@ -266,10 +273,82 @@ async def restore_fake_data_after():
     await _init_fake_data()
 
 
+@pytest.fixture(autouse=True)
+def clear_username_cache():
+    # fake data is recreated between tests, reusing user ids
+    usernames.cache.clear()
+
+
+@pytest.fixture
+def max_queries(request, monkeypatch) -> list:
+    """
+    Response hooks failing a test marked `max_queries(n)` when any request it
+    makes through `client` runs more than n SQL statements.
+    """
+    marker = request.node.get_closest_marker("max_queries")
+    if marker is None:
+        return []
+    limit = marker.args[0]
+    monkeypatch.setattr(config.CONFIG, "sql_debug_headers", True)
+
+    async def check(response):
+        queries = int(response.headers["X-SQL-Queries"])
+        assert queries <= limit, (
+            f"{response.request.method} {response.request.url.path} ran"
+            f" {queries} SQL statements, expected at most {limit}"
+        )
+
+    return [check]
+
+
 @pytest_asyncio.fixture
-async def client():
+async def client(max_queries):
     app.state.redis = AsyncMock(name="FakeRedis")
     async with AsyncClient(
-        transport=ASGITransport(app=app), base_url="http://test"
+        transport=ASGITransport(app=app),
+        base_url="http://test",
+        event_hooks={"response": max_queries},
     ) as ac:
         yield ac
+
+
+@pytest.fixture
+def redis_mock():
+    """
+    Stand-in Redis client. Commands, the lock and pipelines can be awaited, and
+    each registered script is an AsyncMock of its own.
+    """
+    redis = MagicMock(name="FakeRedis")
+    redis.lock.return_value.acquire = AsyncMock(return_value=True)
+    redis.lock.return_value.release = AsyncMock()
+    redis.lock.return_value.reacquire = AsyncMock(return_value=True)
+    redis.lock.return_value.owned = AsyncMock(return_value=True)
+    redis.pipeline.return_value.execute = AsyncMock()
+    for command in (
+        "bitop",
+        "delete",
+        "exists",
+        "hmget",
+        "rename",
+        "set",
+        "setbit",
+        "zadd",
+        "zrange",
+        "zrem",
+    ):
+        setattr(redis, command, AsyncMock(name=f"FakeRedis.{command}"))
+    redis.register_script.side_effect = lambda _: AsyncMock()
+    return redis
+
+
+@pytest_asyncio.fixture
+async def lua_redis():
+    """
+    In memory Redis running Lua scripts, for testing the scripts themselves.
+    Skips the test unless fakeredis and lupa are installed.
+    """
+    fakeredis = pytest.importorskip("fakeredis")
+    pytest.importorskip("lupa")
+    redis = fakeredis.FakeAsyncRedis(decode_responses=True)
+    yield redis
+    await redis.aclose()
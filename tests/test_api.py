@@ -1,12 +1,14 @@
 from datetime import datetime, timedelta, timezone
+from unittest.mock import AsyncMock
 
 import jwt
 import pytest
+import pytest_asyncio
 import respx
 from httpx import Response
 from pydantic import SecretStr
 
-from chessticulate_api import crud
+from chessticulate_api import app, crud, db, serialization
 from chessticulate_api.config import CONFIG
 from chessticulate_api.workers_service import ClientRequestError, ServerRequestError
 
@@ -51,6 +53,97 @@ class TestToken:
         assert response.status_code == 401
         assert response.json()["detail"] == "user has been deleted"
 
+    @pytest.mark.asyncio
+    async def test_writes_authenticate_on_primary(
+        self, client, token, monkeypatch, restore_fake_data_after
+    ):
+        replica = AsyncMock(side_effect=AssertionError("authenticated on replica"))
+        monkeypatch.setattr(db, "read_sessionmaker", replica)
+        response = await client.delete(
+            "/users/self", headers={"Authorization": f"Bearer {token}"}
+        )
+
+        assert response.status_code == 204
+        replica.assert_not_called()
+
+
+async def _pins_on_response(method: str, path: str, redis, headers=None, json=None):
+    """
+    Call the app directly, returning the read-your-writes pins held in Redis
+    when the response body is sent. Test clients only return once the whole app
+    call is over, dependency exits included.
+    """
+    body = serialization.dumps(json).encode() if json is not None else b""
+    headers = {**(headers or {}), "Content-Type": "application/json"}
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": method,
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": b"",
+        "root_path": "",
+        "headers": [(k.lower().encode(), v.encode()) for k, v in headers.items()],
+        "server": ("test", 80),
+        "client": ("test", 50000),
+    }
+    pins = []
+
+    async def receive():
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    async def send(message):
+        if message["type"] == "http.response.body" and not message.get("more_body"):
+            pins.extend(await redis.keys("read-your-writes:*"))
+
+    await app(scope, receive, send)
+    return pins
+
+
+class TestReadYourWrites:
+    @pytest_asyncio.fixture
+    async def replica(self, client, lua_redis, monkeypatch, restore_fake_data_after):
+        # a replica which hasn't caught up with anything, reads on it fail. set
+        # by hand, restore_fake_data_after resets the engines once it's undone
+        read_engine, read_session = db.async_read_engine, db.async_read_session
+        db.async_read_engine = db.create_engine("sqlite+aiosqlite:///:memory:")
+        db.async_read_session = db.async_sessionmaker(db.async_read_engine)
+        monkeypatch.setattr(CONFIG, "sql_read_your_writes", 5.0)
+        monkeypatch.setattr(app.state, "redis", lua_redis)
+        yield db.async_read_engine
+        await db.async_read_engine.dispose()
+        db.async_read_engine, db.async_read_session = read_engine, read_session
+
+    @pytest.mark.asyncio
+    async def test_read_after_write(self, client, token, replica, lua_redis):
+        headers = {"Authorization": f"Bearer {token}"}
+        pins = await _pins_on_response("POST", "/challenges", lua_redis, headers)
+        assert pins == ["read-your-writes:1"]
+
+        response = await client.get("/challenges?requester_id=1", headers=headers)
+        assert response.status_code == 200
+        assert len(response.json()) == 1
+
+    @pytest.mark.asyncio
+    async def test_read_after_signup(self, client, replica, lua_redis):
+        credentials = {"name": "ChessFan12", "password": "Knightc3!"}
+        pins = await _pins_on_response(
+            "POST",
+            "/signup",
+            lua_redis,
+            json={**credentials, "email": "chessfan@email.com"},
+        )
+        assert len(pins) == 1
+
+        response = await client.post("/login", json=credentials)
+        headers = {"Authorization": f"Bearer {response.json()['jwt']}"}
+        user_id = int(pins[0].rsplit(":", 1)[1])
+        response = await client.get(f"/users?user_id={user_id}", headers=headers)
+        assert response.status_code == 200
+        assert response.json()[0]["name"] == "ChessFan12"
+
 
 # For all following tests, user with id = 1 is logged in
 class TestLogin:
@@ -77,6 +170,7 @@ class TestLogin:
         assert response.status_code == 401
 
     @pytest.mark.asyncio
+    @pytest.mark.max_queries(1)
     async def test_login_succeeds(self, client):
         response = await client.post(
             "/login",
@@ -116,8 +210,25 @@ class TestSignup:
             },
         )
         assert response.status_code == 400
+        assert response.json()["detail"] == "user with same name already exists"
+
+    @pytest.mark.asyncio
+    @pytest.mark.max_queries(2)
+    async def test_signup_fails_email_already_exists(self, client, fake_user_data):
+        response = await client.post(
+            "/signup",
+            headers={},
+            json={
+                "name": "newuser",
+                "email": fake_user_data[0]["email"],
+                "password": "F@kepswd420",
+            },
+        )
+        assert response.status_code == 400
+        assert response.json()["detail"] == "user with same email already exists"
 
     @pytest.mark.asyncio
+    @pytest.mark.max_queries(1)
     async def test_signup_succeeds(self, client, restore_fake_data_after):
         response = await client.post(
             "/signup",
@@ -175,6 +286,7 @@ class TestGetUsers:
         assert user["wins"] == user["draws"] == user["losses"] == 0
 
     @pytest.mark.asyncio
+    @pytest.mark.max_queries(2)
     async def test_get_user_default_params(self, client, token):
         response = await client.get(
             "/users", headers={"Authorization": f"Bearer {token}"}
@@ -196,6 +308,53 @@ class TestGetUsers:
         assert len(users) == 3
 
     @pytest.mark.asyncio
+    @pytest.mark.max_queries(2)
+    async def test_get_users_by_ids(self, client, token):
+        response = await client.get(
+            "/users?ids=3,1,999,2,3", headers={"Authorization": f"Bearer {token}"}
+        )
+
+        assert response.status_code == 200
+        assert [user["id"] for user in response.json()] == [3, 1, 2]
+        assert response.headers["X-Missing-Ids"] == "999"
+
+    @pytest.mark.asyncio
+    async def test_get_users_by_ids_none_missing(self, client, token):
+        response = await client.get(
+            "/users?ids=2,1&limit=1", headers={"Authorization": f"Bearer {token}"}
+        )
+
+        assert [user["id"] for user in response.json()] == [2, 1]
+        assert "X-Missing-Ids" not in response.headers
+
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize(
+        "ids, detail",
+        [
+            ("1,two", "'ids' must be a comma separated list of user ids"),
+            (",".join(map(str, range(51))), "at most 50 ids can be looked up at once"),
+        ],
+    )
+    async def test_get_users_by_ids_fails(self, client, token, ids, detail):
+        response = await client.get(
+            "/users", params={"ids": ids}, headers={"Authorization": f"Bearer {token}"}
+        )
+
+        assert response.status_code == 400
+        assert response.json()["detail"] == detail
+
+    @pytest.mark.asyncio
+    async def test_get_user_fields(self, client, token):
+        response = await client.get(
+            "/users?user_id=1&fields=name,wins",
+            headers={"Authorization": f"Bearer {token}"},
+        )
+
+        assert response.status_code == 200
+        assert response.json() == [{"id": 1, "name": "fakeuser1", "wins": 0}]
+
+    @pytest.mark.asyncio
+    @pytest.mark.max_queries(2)
     async def test_get_own_user(self, client, token):
         response = await client.get(
             "/users/self", headers={"Authorization": f"Bearer {token}"}
@@ -206,6 +365,32 @@ class TestGetUsers:
         assert user["email"] == "fakeuser1@fakeemail.com"
 
 
+class TestSearchUsers:
+    @pytest.mark.asyncio
+    @pytest.mark.max_queries(2)
+    async def test_search_users(self, client, token):
+        response = await client.get(
+            "/users/search?q=fakeuser3", headers={"Authorization": f"Bearer {token}"}
+        )
+
+        assert response.status_code == 200
+        users = response.json()
+        assert users[0]["name"] == "fakeuser3"
+        assert "email" not in users[0]
+
+    @pytest.mark.asyncio
+    async def test_search_users_query_too_short(self, client, token):
+        response = await client.get(
+            "/users/search?q=f", headers={"Authorization": f"Bearer {token}"}
+        )
+        assert response.status_code == 422
+
+    @pytest.mark.asyncio
+    async def test_search_users_not_logged_in(self, client):
+        response = await client.get("/users/search?q=fakeuser")
+        assert response.status_code == 401
+
+
 class TestUsernameExists:
     @pytest.mark.asyncio
     async def test_username_exists(self, client):
@@ -371,6 +556,19 @@ class TestGetInvitations:
         assert response.json()[0]["black_username"] == "fakeuser3"
 
     @pytest.mark.asyncio
+    async def test_get_invitation_fields(self, client, token):
+        params = {"to_id": 1, "invitation_id": 2, "fields": "status,black_username"}
+        response = await client.get(
+            "/invitations", headers={"Authorization": f"Bearer {token}"}, params=params
+        )
+
+        assert response.status_code == 200
+        assert response.json() == [
+            {"id": 2, "status": "ACCEPTED", "black_username": "fakeuser3"}
+        ]
+
+    @pytest.mark.asyncio
+    @pytest.mark.max_queries(3)
     async def test_get_invitation_succeeds_using_custom_params(self, client, token):
         params = {"from_id": 1, "limit": 1, "reverse": True, "status": "ACCEPTED"}
         response = await client.get(
@@ -434,6 +632,7 @@ class TestAcceptInvitation:
         )
 
     @pytest.mark.asyncio
+    @pytest.mark.max_queries(8)
     async def test_accept_invitation_succeeds(
         self, client, token, restore_fake_data_after
     ):
@@ -565,17 +764,70 @@ class TestCancelInvitation:
 
 class TestGetGames:
     @pytest.mark.asyncio
+    @pytest.mark.max_queries(3)
     async def test_get_games_succeeds_no_params(self, client, token):
         response = await client.get(
             "/games", headers={"Authorization": f"Bearer {token}"}
         )
         assert response.status_code == 200
         assert len(response.json()) == 3
+        assert all("move_hist" not in game for game in response.json())
+
+    @pytest.mark.asyncio
+    @pytest.mark.max_queries(4)
+    async def test_get_games_include_moves(self, client, token):
+        response = await client.get(
+            "/games?game_id=1&include=moves",
+            headers={"Authorization": f"Bearer {token}"},
+        )
+        assert response.status_code == 200
+        assert response.json()[0]["move_hist"] == ["e4"]
+        assert response.json()[0]["white_username"] == "fakeuser1"
+
+    @pytest.mark.asyncio
+    @pytest.mark.max_queries(3)
+    async def test_get_games_fields(self, client, token):
+        response = await client.get(
+            "/games?game_id=1&fields=whomst,is_active,white_username",
+            headers={"Authorization": f"Bearer {token}"},
+        )
+        assert response.status_code == 200
+        assert response.json() == [
+            {"id": 1, "whomst": 1, "is_active": True, "white_username": "fakeuser1"}
+        ]
+
+    @pytest.mark.asyncio
+    @pytest.mark.max_queries(3)
+    async def test_get_games_fields_move_hist(self, client, token):
+        response = await client.get(
+            "/games?game_id=1&fields=move_hist",
+            headers={"Authorization": f"Bearer {token}"},
+        )
+        assert response.status_code == 200
+        assert response.json() == [{"id": 1, "move_hist": ["e4"]}]
+
+    @pytest.mark.asyncio
+    async def test_get_games_fails_unknown_field(self, client, token):
+        response = await client.get(
+            "/games?fields=whomst,states,password",
+            headers={"Authorization": f"Bearer {token}"},
+        )
+        assert response.status_code == 400
+        assert response.json()["detail"] == "unknown fields: password, states"
+
+    @pytest.mark.asyncio
+    async def test_get_games_fails_unknown_include(self, client, token):
+        response = await client.get(
+            "/games?include=states",
+            headers={"Authorization": f"Bearer {token}"},
+        )
+        assert response.status_code == 422
 
     @pytest.mark.asyncio
     async def test_get_games_succeeds_params(self, client, token):
         response = await client.get(
-            "/games?game_id=1&invitation_id=1&white_id=1&black_id=2&whomst_id=1",
+            "/games?game_id=1&invitation_id=1&white_id=1&black_id=2&whomst_id=1"
+            "&include=moves",
             headers={"Authorization": f"Bearer {token}"},
         )
         json_obj = response.json()
@@ -603,6 +855,7 @@ class TestGetGames:
         assert len(response.json()) == 1
 
     @pytest.mark.asyncio
+    @pytest.mark.max_queries(3)
     async def test_get_games_succeeds_get_by_player_id(self, client, token):
         response = await client.get(
             "/games?player_id=1",
@@ -647,6 +900,74 @@ class TestGetGames:
         assert len(response.json()) == 0
 
 
+class TestGetGame:
+    @pytest.mark.asyncio
+    async def test_get_game_fails_invalid_game_id(self, client, token):
+        response = await client.get(
+            "/games/42069", headers={"Authorization": f"Bearer {token}"}
+        )
+        assert response.status_code == 404
+        assert response.json()["detail"] == "invalid game id"
+
+    @pytest.mark.asyncio
+    async def test_get_game_succeeds(self, client, token):
+        response = await client.get(
+            "/games/1", headers={"Authorization": f"Bearer {token}"}
+        )
+        assert response.status_code == 200
+        assert response.json()["id"] == 1
+        assert response.json()["move_hist"] == ["e4"]
+        assert response.headers["ETag"]
+        assert response.headers["Cache-Control"] == "private, no-cache"
+
+    @pytest.mark.asyncio
+    async def test_get_game_finished_is_immutable(self, client, token):
+        response = await client.get(
+            "/games/2", headers={"Authorization": f"Bearer {token}"}
+        )
+        assert response.status_code == 200
+        assert response.headers["Cache-Control"] == (
+            "private, max-age=31536000, immutable"
+        )
+
+    @pytest.mark.asyncio
+    async def test_get_game_not_modified(self, client, token, monkeypatch):
+        monkeypatch.setattr(CONFIG, "sql_debug_headers", True)
+        headers = {"Authorization": f"Bearer {token}"}
+        etag = (await client.get("/games/1", headers=headers)).headers["ETag"]
+
+        response = await client.get(
+            "/games/1", headers={**headers, "If-None-Match": etag.removeprefix("W/")}
+        )
+        assert response.status_code == 304
+        assert response.content == b""
+        assert response.headers["ETag"] == etag
+        # authentication and the version lookup, no move history
+        assert response.headers["X-SQL-Queries"] == "2"
+
+    @pytest.mark.asyncio
+    async def test_get_game_modified_after_move(
+        self, client, token, restore_fake_data_after
+    ):
+        headers = {"Authorization": f"Bearer {token}"}
+        etag = (await client.get("/games/1", headers=headers)).headers["ETag"]
+
+        with respx.mock:
+            respx.post(CONFIG.workers_base_url).mock(
+                return_value=Response(
+                    200, json={"status": "MOVEOK", "fen": "abcdefg", "states": "{}"}
+                )
+            )
+            await client.post("/games/1/move", headers=headers, json={"move": "e5"})
+
+        response = await client.get(
+            "/games/1", headers={**headers, "If-None-Match": etag}
+        )
+        assert response.status_code == 200
+        assert response.headers["ETag"] != etag
+        assert response.json()["move_hist"] == ["e4", "e5"]
+
+
 class TestMove:
     @pytest.mark.asyncio
     async def test_do_move_fails_invalid_game_id(self, client, token):
@@ -678,6 +999,20 @@ class TestMove:
         assert response.status_code == 400
         assert response.json()["detail"] == "it is not the turn of user with id '1'"
 
+    @pytest.mark.asyncio
+    async def test_do_move_fails_game_over(
+        self, client, token, restore_fake_data_after
+    ):
+        headers = {"Authorization": f"Bearer {token}"}
+        response = await client.post("/games/1/forfeit", headers=headers)
+        assert response.status_code == 200
+
+        response = await client.post(
+            "/games/1/move", headers=headers, json={"move": "e5"}
+        )
+        assert response.status_code == 409
+        assert response.json()["detail"] == "game '1' is over"
+
     @pytest.mark.asyncio
     async def test_do_move_fails_invalid_move(self, client, token):
         # client request errors can be invalid move, puts in check/still in check, or game already over
@@ -712,6 +1047,7 @@ class TestMove:
     # do_move uses redis if its sucessful
     # none of the other endpoints or tests require it, but the client must have redis for these to pass
     @pytest.mark.asyncio
+    @pytest.mark.max_queries(7)
     async def test_do_move_successful(self, client, token, restore_fake_data_after):
         with respx.mock:
             respx.post(CONFIG.workers_base_url).mock(
@@ -758,6 +1094,7 @@ class TestMove:
 class TestForfeit:
 
     @pytest.mark.asyncio
+    @pytest.mark.max_queries(8)
     async def test_forfeit_succeeds(self, client, token, restore_fake_data_after):
         response = await client.post(
             "/games/1/forfeit",
@@ -816,6 +1153,7 @@ class TestGetChallenges:
         assert len(response.json()) == 2
 
     @pytest.mark.asyncio
+    @pytest.mark.max_queries(3)
     async def test_get_challenges_succeeds_and_includes_requester_username(
         self, client, token, restore_fake_data_after
     ):
@@ -832,6 +1170,24 @@ class TestGetChallenges:
         assert challenge["fulfilled_by"] is None
         assert challenge["game_id"] is None
 
+    @pytest.mark.asyncio
+    async def test_get_challenges_fields(self, client, token):
+        response = await client.get(
+            "/challenges?requester_id=3&fields=game_id",
+            headers={"Authorization": f"Bearer {token}"},
+        )
+        assert response.status_code == 200
+        assert response.json() == [{"id": response.json()[0]["id"], "game_id": None}]
+
+    @pytest.mark.asyncio
+    async def test_get_challenges_fails_unknown_field(self, client, token):
+        response = await client.get(
+            "/challenges?fields=game_id,move_hist",
+            headers={"Authorization": f"Bearer {token}"},
+        )
+        assert response.status_code == 400
+        assert response.json()["detail"] == "unknown fields: move_hist"
+
 
 class TestAcceptChallenge:
     @pytest.mark.asyncio
@@ -870,6 +1226,7 @@ class TestAcceptChallenge:
         assert accept_resp.json()["detail"] == "cannot accept own challenge"
 
     @pytest.mark.asyncio
+    @pytest.mark.max_queries(8)
     async def test_accept_challenge_succeeds(
         self, session, client, token, restore_fake_data_after
     ):
@@ -890,6 +1247,40 @@ class TestAcceptChallenge:
         assert bad_accept.status_code == 404
 
 
+class TestAcceptAnyChallenge:
+    @pytest.mark.asyncio
+    @pytest.mark.max_queries(4)
+    async def test_accept_any_challenge_succeeds(
+        self, client, token, restore_fake_data_after
+    ):
+        response = await client.post(
+            "/challenges/accept-any", headers={"Authorization": f"Bearer {token}"}
+        )
+        assert response.status_code == 202
+        assert response.json()["challenge_id"] == 1
+
+        game = await client.get(
+            f"/games/{response.json()['game_id']}",
+            headers={"Authorization": f"Bearer {token}"},
+        )
+        assert game.json()["challenge_id"] == 1
+
+    @pytest.mark.asyncio
+    async def test_accept_any_challenge_none_available(
+        self, client, token, restore_fake_data_after
+    ):
+        for _ in range(2):
+            response = await client.post(
+                "/challenges/accept-any", headers={"Authorization": f"Bearer {token}"}
+            )
+            assert response.status_code == 202
+
+        response = await client.post(
+            "/challenges/accept-any", headers={"Authorization": f"Bearer {token}"}
+        )
+        assert response.status_code == 404
+
+
 class TestCancelChallenge:
     @pytest.mark.asyncio
     async def test_cancel_challenge_fails_not_logged_in(self, client):
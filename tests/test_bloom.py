@@ -0,0 +1,203 @@
+from unittest.mock import AsyncMock
+
+import pytest
+from pydantic import SecretStr
+from redis.exceptions import ConnectionError as RedisConnectionError
+from redis.exceptions import LockNotOwnedError
+
+from chessticulate_api import bloom, crud
+
+
+async def _users(*users):
+    for user in users:
+        yield user
+
+
+@pytest.fixture
+def user_filter(monkeypatch):
+    user_filter = bloom.UserFilter(capacity=1000, error_rate=0.01)
+    monkeypatch.setattr(bloom, "user_filter", user_filter)
+    return user_filter
+
+
+class TestBloomFilter:
+    def test_parameters(self):
+        # a million users at 1%, the defaults, take 2.3MiB and 7 hashes
+        assert bloom.parameters(2_000_000, 0.01) == (19170117, 7)
+
+    def test_no_false_negatives(self):
+        bloom_filter = bloom.BloomFilter(1000, 0.01)
+        for i in range(1000):
+            bloom_filter.add(f"user{i}")
+        assert all(f"user{i}" in bloom_filter for i in range(1000))
+
+    def test_false_positive_rate(self):
+        bloom_filter = bloom.BloomFilter(10_000, 0.01)
+        for i in range(10_000):
+            bloom_filter.add(f"user{i}")
+        false_positives = sum(f"other{i}" in bloom_filter for i in range(20_000))
+        assert false_positives / 20_000 < 0.015
+
+    def test_redis_bit_order(self):
+        bloom_filter = bloom.BloomFilter(10, 0.01)
+        bloom_filter.add("user")
+        offset = bloom.offsets("user", bloom_filter.size, bloom_filter.hashes)[0]
+        # SETBIT numbers bits from the most significant bit of the first byte
+        assert bloom_filter.bits[offset // 8] & (1 << (7 - offset % 8))
+
+
+class TestUserFilter:
+    @pytest.mark.asyncio
+    async def test_unbuilt_filter_might_have_anything(self, user_filter):
+        assert not await user_filter.is_built()
+        assert await user_filter.might_have_name("anyone")
+
+    @pytest.mark.asyncio
+    async def test_rebuild(self, user_filter):
+        count = await user_filter.rebuild(
+            _users(("user1", "user1@email.com"), ("user2", None))
+        )
+
+        assert count == 2
+        assert await user_filter.is_built()
+        assert await user_filter.might_have_name("user1")
+        assert await user_filter.might_have_email("user1@email.com")
+        assert not await user_filter.might_have_name("user3")
+        # names and emails don't match each other
+        assert not await user_filter.might_have_email("user1")
+
+    @pytest.mark.asyncio
+    async def test_add_during_rebuild(self, user_filter):
+        async def users():
+            yield "user1", "user1@email.com"
+            await user_filter.add("user2", "user2@email.com")
+            # a second rebuild is turned away while one is running
+            assert await user_filter.rebuild(_users()) is None
+
+        await user_filter.rebuild(users())
+
+        assert await user_filter.might_have_name("user2")
+
+
+class TestRedisUserFilter:
+    def test_key_names_size(self, redis_mock):
+        user_filter = bloom.RedisUserFilter(redis_mock, 1_000_000, 0.01)
+        assert user_filter.key == "users:bloom:19170117:7"
+
+    @pytest.mark.asyncio
+    async def test_lookup_falls_back_on_redis_errors(self, redis_mock):
+        redis_mock.register_script.side_effect = lambda _: AsyncMock(
+            side_effect=RedisConnectionError
+        )
+        user_filter = bloom.RedisUserFilter(redis_mock, 1000, 0.01)
+        assert await user_filter.might_have_name("user1")
+
+    @pytest.mark.asyncio
+    async def test_add_logs_redis_errors(self, redis_mock):
+        redis_mock.register_script.side_effect = lambda _: AsyncMock(
+            side_effect=RedisConnectionError
+        )
+        user_filter = bloom.RedisUserFilter(redis_mock, 1000, 0.01)
+        await user_filter.add("user1", "user1@email.com")
+
+    @pytest.mark.asyncio
+    async def test_rebuild_outlives_its_lock(self, redis_mock):
+        redis_mock.lock.return_value.release.side_effect = LockNotOwnedError
+        user_filter = bloom.RedisUserFilter(redis_mock, 1000, 0.01)
+        assert await user_filter.rebuild(_users(("user1", None))) == 1
+        redis_mock.rename.assert_awaited_once()
+
+    @pytest.mark.asyncio
+    async def test_rebuild_lost_its_lock(self, redis_mock):
+        # another rebuild took the lock over, and is writing the next key now
+        lock = redis_mock.lock.return_value
+        lock.reacquire.side_effect = LockNotOwnedError
+        lock.owned.return_value = False
+        user_filter = bloom.RedisUserFilter(redis_mock, 1000, 0.01)
+        assert await user_filter.rebuild(_users(("user1", None))) is None
+
+        redis_mock.set.assert_not_awaited()
+        redis_mock.rename.assert_not_awaited()
+        redis_mock.delete.assert_not_awaited()
+        lock.release.assert_not_awaited()
+
+    @pytest.mark.asyncio
+    async def test_rebuild_extends_its_lock(self, redis_mock):
+        users = _users(*((f"user{i}", None) for i in range(25_000)))
+        user_filter = bloom.RedisUserFilter(redis_mock, 1000, 0.01)
+        assert await user_filter.rebuild(users) == 25_000
+        # after every 10,000 users, and before the upload
+        assert redis_mock.lock.return_value.reacquire.await_count == 3
+
+
+class TestRedisUserFilterScripts:
+    @pytest.fixture
+    def lua_filter(self, lua_redis):
+        return bloom.RedisUserFilter(lua_redis, 1000, 0.01)
+
+    @pytest.mark.asyncio
+    async def test_unbuilt_filter_might_have_anything(self, lua_filter):
+        # adds are dropped until the filter is built
+        await lua_filter.add("user1", None)
+        assert not await lua_filter.is_built()
+        assert await lua_filter.might_have_name("anyone")
+
+    @pytest.mark.asyncio
+    async def test_rebuild_and_add(self, lua_filter):
+        assert await lua_filter.rebuild(_users(("user1", "user1@email.com"))) == 1
+        assert await lua_filter.is_built()
+        assert await lua_filter.might_have_name("user1")
+        assert await lua_filter.might_have_email("user1@email.com")
+        assert not await lua_filter.might_have_name("user2")
+
+        await lua_filter.add("user2", None)
+        assert await lua_filter.might_have_name("user2")
+
+    @pytest.mark.asyncio
+    async def test_add_during_rebuild(self, lua_filter):
+        async def users():
+            yield "user1", None
+            await lua_filter.add("user2", None)
+
+        await lua_filter.rebuild(users())
+        assert await lua_filter.might_have_name("user2")
+        assert not await lua_filter.might_have_name("user3")
+
+
+class TestCrud:
+    @pytest.mark.asyncio
+    async def test_rebuild_user_filter(self, session, user_filter, fake_user_data):
+        assert await crud.rebuild_user_filter(session, user_filter) == len(
+            fake_user_data
+        )
+        for user in fake_user_data:
+            assert await user_filter.might_have_name(user["name"])
+            assert await user_filter.might_have_email(user["email"])
+
+    @pytest.mark.asyncio
+    async def test_create_user_adds_to_filter(self, session, user_filter):
+        await user_filter.rebuild(_users())
+        password_hash = await crud.hash_password(SecretStr("password"))
+        await crud.create_user(session, "unique", "unique@email.com", password_hash)
+
+        assert await user_filter.might_have_name("unique")
+        assert await user_filter.might_have_email("unique@email.com")
+
+
+class TestExistsEndpoints:
+    @pytest.mark.asyncio
+    @pytest.mark.max_queries(0)
+    async def test_definitely_free_name_skips_db(self, client, user_filter):
+        await user_filter.rebuild(_users(("fakeuser1", "fakeuser1@fakeemail.com")))
+        response = await client.get("/users/name/nonexistentuser")
+        assert response.json()["exists"] is False
+
+    @pytest.mark.asyncio
+    async def test_filter_hits_are_confirmed(self, client, user_filter):
+        await user_filter.rebuild(_users(("fakeuser1", None), ("ghost", None)))
+
+        response = await client.get("/users/name/fakeuser1")
+        assert response.json()["exists"] is True
+        # in the filter, but not in the database
+        response = await client.get("/users/name/ghost")
+        assert response.json()["exists"] is False
@@ -0,0 +1,118 @@
+import importlib
+import sys
+
+import pytest
+import pytest_asyncio
+from httpx import ASGITransport, AsyncClient
+from starlette.applications import Starlette
+from starlette.responses import PlainTextResponse, StreamingResponse
+from starlette.routing import Route
+
+from chessticulate_api import compression
+
+BODY = "e4 e5 Nf3 Nc6 Bb5 a6 " * 100
+
+
+async def _text(_):
+    return PlainTextResponse(BODY)
+
+
+async def _small(_):
+    return PlainTextResponse("e4")
+
+
+async def _events(_):
+    async def stream():
+        yield f"data: {BODY}\n\n"
+
+    return StreamingResponse(stream(), media_type="text/event-stream")
+
+
+def _app(middleware_module=compression):
+    app = Starlette(
+        routes=[
+            Route("/text", _text),
+            Route("/small", _small),
+            Route("/events", _events),
+        ]
+    )
+    return middleware_module.CompressionMiddleware(app, minimum_size=1024)
+
+
+@pytest_asyncio.fixture
+async def raw_client():
+    async with AsyncClient(
+        transport=ASGITransport(app=_app()), base_url="http://test"
+    ) as ac:
+        yield ac
+
+
+class TestAcceptedEncodings:
+    @pytest.mark.parametrize(
+        "header, expected",
+        [
+            ("", {""}),
+            ("gzip, deflate, br", {"gzip", "deflate", "br"}),
+            ("br;q=0, gzip;q=0.5", {"gzip"}),
+            ("GZIP; q=1.0, br; q=0.0", {"gzip"}),
+            ("br;q=junk", set()),
+        ],
+    )
+    def test_accepted_encodings(self, header, expected):
+        assert compression._accepted_encodings(header) == expected
+
+
+class TestCompressionMiddleware:
+    @pytest.mark.asyncio
+    async def test_brotli_preferred(self, raw_client):
+        response = await raw_client.get(
+            "/text", headers={"Accept-Encoding": "gzip, br"}
+        )
+        assert response.headers["Content-Encoding"] == "br"
+        assert response.headers["Vary"] == "Accept-Encoding"
+        assert response.text == BODY
+
+    @pytest.mark.asyncio
+    async def test_gzip(self, raw_client):
+        response = await raw_client.get("/text", headers={"Accept-Encoding": "gzip"})
+        assert response.headers["Content-Encoding"] == "gzip"
+        assert response.text == BODY
+
+    @pytest.mark.asyncio
+    async def test_identity(self, raw_client):
+        response = await raw_client.get(
+            "/text", headers={"Accept-Encoding": "br;q=0, gzip;q=0"}
+        )
+        assert "Content-Encoding" not in response.headers
+        assert response.text == BODY
+
+    @pytest.mark.asyncio
+    async def test_below_minimum_size(self, raw_client):
+        response = await raw_client.get("/small", headers={"Accept-Encoding": "br"})
+        assert "Content-Encoding" not in response.headers
+
+    @pytest.mark.asyncio
+    async def test_event_stream_not_compressed(self, raw_client):
+        response = await raw_client.get(
+            "/events", headers={"Accept-Encoding": "br, gzip"}
+        )
+        assert "Content-Encoding" not in response.headers
+        assert response.text == f"data: {BODY}\n\n"
+
+    @pytest.mark.asyncio
+    async def test_gzip_without_brotli(self, monkeypatch):
+        monkeypatch.setitem(sys.modules, "brotli", None)
+        module = importlib.reload(compression)
+        try:
+            async with AsyncClient(
+                transport=ASGITransport(app=_app(module)), base_url="http://test"
+            ) as client:
+                response = await client.get(
+                    "/text", headers={"Accept-Encoding": "br, gzip"}
+                )
+        finally:
+            monkeypatch.undo()
+            importlib.reload(compression)
+
+        assert response.headers["Content-Encoding"] == "gzip"
+        assert response.text == BODY
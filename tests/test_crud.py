@@ -1,13 +1,21 @@
+import asyncio
+import os
 from datetime import datetime, timedelta, timezone
 
 import jwt
 import pytest
 import sqlalchemy
 from pydantic import SecretStr
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.ext.asyncio import async_sessionmaker
 
-from chessticulate_api import crud, models
+from chessticulate_api import crud, db, models, query_stats, usernames
 from chessticulate_api.config import CONFIG
 
+# postgres database the tests may create and drop tables in, tests needing one
+# are skipped without it
+POSTGRES_CONN_STR = os.environ.get("TEST_POSTGRES_CONN_STR")
+
 
 def test_password_hashing():
     pswd = SecretStr("test password")
@@ -73,37 +81,104 @@ class TestGetUsers:
         assert len(users) == 5
 
 
+class TestSearchUsers:
+    @pytest.mark.asyncio
+    async def test_search_users_prefix(self, session):
+        rows = await crud.search_users(session, "FAKEUSER")
+        # deleted fakeuser4 is left out
+        assert [row["name"] for row in rows] == [
+            "fakeuser1",
+            "fakeuser2",
+            "fakeuser3",
+            "fakeuser5",
+            "fakeuser6",
+        ]
+
+    @pytest.mark.asyncio
+    async def test_search_users_ranks_exact_match_first(self, session):
+        rows = await crud.search_users(session, "fakeuser6", limit=1)
+        assert [row["name"] for row in rows] == ["fakeuser6"]
+
+    @pytest.mark.asyncio
+    async def test_search_users_substring(self, session):
+        rows = await crud.search_users(session, "user5")
+        assert [row["name"] for row in rows] == ["fakeuser5"]
+
+    @pytest.mark.asyncio
+    async def test_search_users_escapes_wildcards(self, session):
+        assert await crud.search_users(session, "fake_ser") == []
+        assert await crud.search_users(session, "%") == []
+
+
+class TestGetUsersByIds:
+    @pytest.mark.asyncio
+    async def test_get_users_ids(self, session):
+        users = await crud.get_users(session, ids=[3, 1, 42069], order_by="id_")
+        assert [user.id_ for user in users] == [1, 3]
+
+    @pytest.mark.asyncio
+    async def test_get_user_rows_ids_shares_statement(self, session):
+        await crud.get_user_rows(session, ids=[1])
+        hits = crud._users_stmt.cache_info().hits
+        rows = await crud.get_user_rows(session, ids=[1, 2, 5], limit=3)
+        assert sorted(row["id"] for row in rows) == [1, 2, 5]
+        assert crud._users_stmt.cache_info().hits == hits + 1
+
+
+class TestGetUserRows:
+    @pytest.mark.asyncio
+    async def test_get_user_rows(self, session):
+        rows = await crud.get_user_rows(session, order_by="wins", reverse=True, limit=2)
+        assert [row["name"] for row in rows] == ["fakeuser5", "fakeuser6"]
+        assert rows[0]["id"] == 5
+        assert "password" not in rows[0]
+
+    @pytest.mark.asyncio
+    async def test_get_user_rows_matches_get_users(self, session):
+        users = await crud.get_users(session, deleted=False)
+        rows = await crud.get_user_rows(session, deleted=False)
+        assert [user.id_ for user in users] == [row["id"] for row in rows]
+
+
 class TestCreateUser:
     @pytest.mark.asyncio
     async def test_create_user_fails_duplicate_name(self, session, fake_user_data):
-        with pytest.raises(sqlalchemy.exc.IntegrityError):
+        with pytest.raises(crud.UserExistsError) as exc_info:
             await crud.create_user(
-                session,
-                fake_user_data[0]["name"],
-                "unique@fakeemail.com",
-                SecretStr(fake_user_data[0]["password"]),
+                session, fake_user_data[0]["name"], "unique@fakeemail.com", "hash"
             )
-
-        # sessions need to be rolled back after exeptions are raised to prevent errors from cascading
+        assert exc_info.value.fields == ["name"]
 
     @pytest.mark.asyncio
     async def test_create_user_fails_duplicate_email(self, session, fake_user_data):
-        with pytest.raises(sqlalchemy.exc.IntegrityError):
+        with pytest.raises(crud.UserExistsError) as exc_info:
             await crud.create_user(
-                session,
-                "unique",
-                fake_user_data[0]["email"],
-                SecretStr(fake_user_data[0]["password"]),
+                session, "unique", fake_user_data[0]["email"], "hash"
             )
+        assert exc_info.value.fields == ["email"]
+
+    @pytest.mark.asyncio
+    async def test_create_user_fails_duplicate_name_and_email(
+        self, session, fake_user_data
+    ):
+        with pytest.raises(crud.UserExistsError) as exc_info:
+            await crud.create_user(
+                session, fake_user_data[0]["name"], fake_user_data[1]["email"], "hash"
+            )
+        assert exc_info.value.fields == ["name", "email"]
+        assert str(exc_info.value) == "user with same name and email already exists"
 
     @pytest.mark.asyncio
     async def test_create_user_succeeds(self, session):
+        password_hash = await crud.hash_password(SecretStr("password"))
         user = await crud.create_user(
-            session, "unique", "unique@fakeemail.com", SecretStr("password")
+            session, "unique", "unique@fakeemail.com", password_hash
         )
         assert user is not None
         assert user.name == "unique"
         assert user.email == "unique@fakeemail.com"
+        assert user.date_joined is not None
+        assert crud._check_password(SecretStr("password"), user.password)
 
 
 class TestDeleteUser:
@@ -124,6 +199,14 @@ class TestDeleteUser:
         assert users[0].deleted
         assert await crud.delete_user(session, users[0].id_) is False
 
+    @pytest.mark.asyncio
+    async def test_delete_user_drops_cached_username(self, session):
+        await crud.get_game_rows(session, id_=1, fields=["white_username"])
+        assert usernames.cache.lookup([1]) == ({1: "fakeuser1"}, set())
+
+        assert await crud.delete_user(session, 1) is True
+        assert usernames.cache.lookup([1]) == ({}, {1})
+
 
 class TestLogin:
     @pytest.mark.asyncio
@@ -231,6 +314,15 @@ class TestGetInvitations:
         assert len(invitations) == expected_count
 
 
+class TestGetInvitationRows:
+    @pytest.mark.asyncio
+    async def test_get_invitation_rows(self, session):
+        rows = await crud.get_invitation_rows(session, id_=2)
+        assert len(rows) == 1
+        assert rows[0]["white_username"] == "fakeuser1"
+        assert rows[0]["black_username"] == "fakeuser3"
+
+
 class TestCancelInvitation:
     @pytest.mark.asyncio
     async def test_cancel_invitation_fails_doesnt_exist(self, session):
@@ -364,6 +456,116 @@ class TestGetGames:
         games = await crud.get_games(session, id_=1)
         assert games[0].move_hist == ["e4"]
 
+    @pytest.mark.asyncio
+    async def test_get_games_by_player_id(self, session):
+        games = await crud.get_games(session, player_id=1)
+        assert sorted(game.id_ for game in games) == [1, 2]
+
+    @pytest.mark.asyncio
+    async def test_get_games_reuses_statement_per_filter_shape(self, session):
+        hits = crud._games_stmt.cache_info().hits
+        games1 = await crud.get_games(session, white=1, is_active=True)
+        games2 = await crud.get_games(session, is_active=True, white=3)
+        assert [game.id_ for game in games1] == [1]
+        assert games2 == []
+        assert crud._games_stmt.cache_info().hits == hits + 1
+
+    @pytest.mark.asyncio
+    async def test_get_games_fetches_move_histories_at_once(self, session):
+        stats = query_stats.QueryStats()
+        token = query_stats._stats.set(stats)
+        try:
+            games = await crud.get_games(session, player_id=1, order_by="id_")
+        finally:
+            query_stats._stats.reset(token)
+
+        assert [game.move_hist for game in games] == [["e4"], ["Nxe4"]]
+        # games, usernames and move histories
+        assert stats.count == 3
+
+    @pytest.mark.asyncio
+    async def test_get_games_usernames_are_cached(self, session):
+        await crud.get_games(session, player_id=1)
+
+        stats = query_stats.QueryStats()
+        token = query_stats._stats.set(stats)
+        try:
+            games = await crud.get_games(session, player_id=1, order_by="id_")
+        finally:
+            query_stats._stats.reset(token)
+
+        assert [(game.white_username, game.black_username) for game in games] == [
+            ("fakeuser1", "fakeuser2"),
+            ("fakeuser3", "fakeuser1"),
+        ]
+        # games and move histories, the users table isn't touched
+        assert stats.count == 2
+        assert all("JOIN" not in statement for statement in stats.statements)
+
+
+class TestGetGameRows:
+    @pytest.mark.asyncio
+    async def test_get_game_rows(self, session):
+        rows = await crud.get_game_rows(session, player_id=1, order_by="id_")
+        assert [row["id"] for row in rows] == [1, 2]
+        assert rows[0]["white_username"] == "fakeuser1"
+        assert rows[0]["black_username"] == "fakeuser2"
+        assert rows[0]["move_hist"] == ["e4"]
+        assert rows[1]["move_hist"] == ["Nxe4"]
+        assert "states" not in rows[0]
+
+    @pytest.mark.asyncio
+    async def test_get_game_rows_does_not_exist(self, session):
+        assert await crud.get_game_rows(session, id_=42069) == []
+
+    @pytest.mark.asyncio
+    async def test_get_game_rows_fields(self, session):
+        stats = query_stats.QueryStats()
+        token = query_stats._stats.set(stats)
+        try:
+            rows = await crud.get_game_rows(
+                session, player_id=1, order_by="id_", fields=["whomst", "is_active"]
+            )
+        finally:
+            query_stats._stats.reset(token)
+
+        assert rows == [
+            {"id": 1, "whomst": 1, "is_active": True},
+            {"id": 2, "whomst": 3, "is_active": False},
+        ]
+        # neither the move histories nor the usernames are queried
+        assert stats.count == 1
+        assert "JOIN" not in next(iter(stats.statements))
+
+    @pytest.mark.asyncio
+    async def test_get_game_rows_fields_username(self, session):
+        stats = query_stats.QueryStats()
+        token = query_stats._stats.set(stats)
+        try:
+            rows = await crud.get_game_rows(
+                session, player_id=1, order_by="id_", fields=["white_username"]
+            )
+        finally:
+            query_stats._stats.reset(token)
+
+        # the white column is only selected to look the username up
+        assert rows == [
+            {"id": 1, "white_username": "fakeuser1"},
+            {"id": 2, "white_username": "fakeuser3"},
+        ]
+        # both usernames are fetched at once
+        assert stats.count == 2
+
+    @pytest.mark.asyncio
+    async def test_get_game_rows_fields_move_hist(self, session):
+        rows = await crud.get_game_rows(
+            session, player_id=1, order_by="id_", fields=["black_username", "move_hist"]
+        )
+        assert rows == [
+            {"id": 1, "black_username": "fakeuser2", "move_hist": ["e4"]},
+            {"id": 2, "black_username": "fakeuser1", "move_hist": ["Nxe4"]},
+        ]
+
 
 class TestDoMove:
     @pytest.mark.parametrize(
@@ -453,6 +655,72 @@ class TestDoMove:
         assert game_after_move[0].result == models.GameResult.CHECKMATE
 
 
+async def _results(session) -> dict[int, tuple[int, int, int]]:
+    rows = await crud.get_user_rows(session, fields=["wins", "draws", "losses"])
+    return {row["id"]: (row["wins"], row["draws"], row["losses"]) for row in rows}
+
+
+async def _counted(session, before) -> dict[int, tuple[int, int, int]]:
+    """Results counted since `before`, by user id."""
+    counted = {}
+    for id_, result in (await _results(session)).items():
+        if result != before[id_]:
+            counted[id_] = tuple(a - b for a, b in zip(result, before[id_]))
+    return counted
+
+
+class TestResults:
+    @pytest.mark.asyncio
+    async def test_checkmate_counts_win_and_loss(self, session):
+        before = await _results(session)
+        await crud.do_move(session, 1, 1, 2, "e4", "{}", "fen", "CHECKMATE")
+        assert await _counted(session, before) == {1: (1, 0, 0), 2: (0, 0, 1)}
+
+    @pytest.mark.asyncio
+    async def test_draw_counts_draws(self, session):
+        before = await _results(session)
+        await crud.do_move(session, 1, 1, 2, "e4", "{}", "fen", "STALEMATE")
+        assert await _counted(session, before) == {1: (0, 1, 0), 2: (0, 1, 0)}
+
+    @pytest.mark.asyncio
+    async def test_moves_dont_count(self, session):
+        before = await _results(session)
+        await crud.do_move(session, 1, 1, 2, "e4", "{}", "fen", "CHECK")
+        assert await _counted(session, before) == {}
+
+    @pytest.mark.asyncio
+    async def test_forfeit_counts_once(self, session):
+        before = await _results(session)
+        game = (await crud.get_games(session, id_=3))[0]
+        await crud.forfeit(session, 2, game)
+        await crud.forfeit(session, 3, game)
+
+        assert await _counted(session, before) == {2: (0, 0, 1), 3: (1, 0, 0)}
+        game = (await crud.get_game_rows(session, id_=3, fields=["winner"]))[0]
+        assert game["winner"] == 3
+
+    @pytest.mark.asyncio
+    async def test_recount_results(self, session):
+        await crud.do_move(session, 1, 1, 2, "e4", "{}", "fen", "CHECKMATE")
+        game = (await crud.get_games(session, id_=3))[0]
+        await crud.forfeit(session, 2, game)
+
+        stats = query_stats.QueryStats()
+        token = query_stats._stats.set(stats)
+        try:
+            assert await crud.recount_results(session) == 3
+        finally:
+            query_stats._stats.reset(token)
+
+        results = await _results(session)
+        assert results.pop(1) == (1, 0, 0)
+        assert results.pop(2) == (0, 0, 2)
+        assert results.pop(3) == (1, 0, 0)
+        # the fake users' made up counters are reset
+        assert set(results.values()) == {(0, 0, 0)}
+        assert stats.count == 2
+
+
 class TestCreateChallenge:
     @pytest.mark.asyncio
     async def test_create_challenge_fails_requester_does_not_exist(self, session):
@@ -520,6 +788,14 @@ class TestGetChallenges:
         assert c2.id_ in pending_ids
 
 
+class TestGetChallengeRows:
+    @pytest.mark.asyncio
+    async def test_get_challenge_rows(self, session):
+        rows = await crud.get_challenge_rows(session, requester_id=2)
+        assert len(rows) == 2
+        assert all(row["requester_username"] == "fakeuser2" for row in rows)
+
+
 class TestAcceptChallenge:
     @pytest.mark.asyncio
     async def test_accept_challenge_fails_doesnt_exist(self, session):
@@ -573,6 +849,89 @@ class TestAcceptChallenge:
         assert updated.game_id == game.id_
 
 
+async def _race_for_challenges(conn_str: str):
+    """Twenty users accept any challenge at once, each on a connection of its own."""
+    engine = db.create_engine(conn_str)
+    sessions = async_sessionmaker(engine, expire_on_commit=False)
+    async with engine.begin() as conn:
+        await conn.run_sync(models.Base.metadata.create_all)
+    async with sessions.begin() as session:
+        session.add_all(
+            models.User(name=f"user{i}", password="x") for i in range(1, 41)
+        )
+    async with sessions.begin() as session:
+        session.add_all(models.ChallengeRequest(requester_id=i) for i in range(1, 21))
+
+    async def accept(user_id: int):
+        async with sessions.begin() as session:
+            game = await crud.accept_any_challenge(session, user_id)
+            # hold the claimed row's lock while the other callers claim theirs
+            await asyncio.sleep(0.05)
+            return game
+
+    try:
+        # twenty users racing for twenty challenges each get one
+        games = await asyncio.gather(*(accept(i) for i in range(21, 41)))
+        assert None not in games
+        assert {game["challenge_id"] for game in games} == set(range(1, 21))
+        assert await accept(1) is None
+    finally:
+        async with engine.begin() as conn:
+            await conn.run_sync(models.Base.metadata.drop_all)
+        await engine.dispose()
+
+
+class TestAcceptAnyChallenge:
+    @pytest.mark.asyncio
+    async def test_accept_any_challenge_skips_own(self, session):
+        # fakeuser3 made the oldest pending challenge
+        stats = query_stats.QueryStats()
+        token = query_stats._stats.set(stats)
+        try:
+            game = await crud.accept_any_challenge(session, 3)
+        finally:
+            query_stats._stats.reset(token)
+
+        assert game["challenge_id"] == 2
+        assert {game["white"], game["black"]} == {2, 3}
+        # claim the challenge, insert the game, link the game to the challenge
+        assert stats.count == 3
+
+        challenge = (await crud.get_challenges(session, id_=2))[0]
+        assert challenge.status == models.ChallengeRequestStatus.ACCEPTED
+        assert challenge.fulfilled_by == 3
+        assert challenge.game_id == game["id"]
+
+    @pytest.mark.asyncio
+    async def test_accept_any_challenge_oldest_first(self, session):
+        first = await crud.accept_any_challenge(session, 1)
+        second = await crud.accept_any_challenge(session, 1)
+        assert (first["challenge_id"], second["challenge_id"]) == (1, 2)
+
+    @pytest.mark.asyncio
+    async def test_accept_any_challenge_none_left(self, session):
+        await crud.create_challenge(session, 4)
+        assert await crud.accept_any_challenge(session, 2) is not None
+        # the remaining challenges are fakeuser2's own and a deleted user's
+        assert await crud.accept_any_challenge(session, 2) is None
+
+    def test_claim_skips_locked_rows_on_postgres(self):
+        stmt = crud._claim_challenge_stmt(1)
+        compiled = str(stmt.compile(dialect=postgresql.dialect()))
+        assert "FOR UPDATE OF challenge_requests SKIP LOCKED" in compiled
+
+    @pytest.mark.asyncio
+    async def test_accept_any_challenge_smoke_sqlite(self, tmp_path):
+        # smoke test only: sqlite doesn't render FOR UPDATE SKIP LOCKED and
+        # serializes writers, so the callers never actually contend for a row
+        await _race_for_challenges(f"sqlite+aiosqlite:///{tmp_path / 'chess.db'}")
+
+    @pytest.mark.asyncio
+    @pytest.mark.skipif(not POSTGRES_CONN_STR, reason="TEST_POSTGRES_CONN_STR not set")
+    async def test_accept_any_challenge_skips_locked_rows(self):
+        await _race_for_challenges(POSTGRES_CONN_STR)
+
+
 class TestCancelChallenge:
     @pytest.mark.asyncio
     async def test_cancel_challenge_fails_doesnt_exist(self, session):
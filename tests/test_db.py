@@ -0,0 +1,120 @@
+from types import SimpleNamespace
+
+import jwt
+import pytest
+from redis.exceptions import RedisError
+
+from chessticulate_api import db
+from chessticulate_api.config import CONFIG
+
+
+def _fake_request(redis, method="GET", user_id=1):
+    headers = {}
+    if user_id is not None:
+        token = jwt.encode({"user_id": user_id}, CONFIG.jwt_secret, CONFIG.jwt_algo)
+        headers["Authorization"] = f"Bearer {token}"
+    app = SimpleNamespace(state=SimpleNamespace(redis=redis))
+    return SimpleNamespace(
+        method=method, headers=headers, app=app, state=SimpleNamespace()
+    )
+
+
+class TestEngineKwargs:
+    def test_memory_sqlite_has_no_pool_options(self):
+        kwargs = db._engine_kwargs("sqlite+aiosqlite:///:memory:")
+        assert "pool_size" not in kwargs
+        assert kwargs["pool_pre_ping"]
+
+    def test_file_sqlite_has_pool_options(self):
+        kwargs = db._engine_kwargs("sqlite+aiosqlite:///chess.db")
+        assert kwargs["pool_size"] == CONFIG.sql_pool_size
+        assert kwargs["max_overflow"] == CONFIG.sql_max_overflow
+        assert "connect_args" not in kwargs
+
+    def test_read_only_memory_sqlite(self):
+        engine = db.create_engine("sqlite+aiosqlite:///:memory:")
+        assert db.read_only(engine) is engine
+
+    def test_read_only_autocommit(self):
+        engine = db.create_engine("sqlite+aiosqlite:///chess.db")
+        options = db.read_only(engine).get_execution_options()
+        assert options["isolation_level"] == "AUTOCOMMIT"
+
+    def test_asyncpg_statement_cache(self):
+        kwargs = db._engine_kwargs("postgresql+asyncpg://u:p@localhost/chess")
+        assert kwargs["pool_recycle"] == CONFIG.sql_pool_recycle
+        assert kwargs["connect_args"] == {
+            "statement_cache_size": CONFIG.sql_statement_cache_size,
+            "prepared_statement_cache_size": CONFIG.sql_statement_cache_size,
+        }
+
+
+class TestReadRouting:
+    @pytest.fixture
+    def replica(self, monkeypatch):
+        replica_engine = db.create_engine("sqlite+aiosqlite:///:memory:")
+        monkeypatch.setattr(db, "async_read_engine", replica_engine)
+        monkeypatch.setattr(
+            db, "async_read_session", db.async_sessionmaker(replica_engine)
+        )
+        monkeypatch.setattr(CONFIG, "sql_read_your_writes", 5.0)
+        yield replica_engine
+
+    @pytest.mark.asyncio
+    async def test_reads_use_primary_without_replica(self, redis_mock):
+        sessionmaker = await db.read_sessionmaker(_fake_request(redis_mock))
+        assert sessionmaker is db.async_primary_read_session
+        redis_mock.exists.assert_not_called()
+
+    @pytest.mark.asyncio
+    async def test_reads_use_replica(self, replica, redis_mock):
+        redis_mock.exists.return_value = 0
+        sessionmaker = await db.read_sessionmaker(_fake_request(redis_mock))
+        assert sessionmaker is db.async_read_session
+        redis_mock.exists.assert_awaited_once_with("read-your-writes:1")
+
+    @pytest.mark.asyncio
+    async def test_reads_pinned_after_write(self, replica, redis_mock):
+        await db.mark_write(_fake_request(redis_mock, method="POST"))
+        redis_mock.set.assert_awaited_once_with("read-your-writes:1", 1, px=5000)
+        redis_mock.exists.return_value = 1
+        sessionmaker = await db.read_sessionmaker(_fake_request(redis_mock))
+        assert sessionmaker is db.async_primary_read_session
+
+    @pytest.mark.asyncio
+    async def test_pin_user_set_by_endpoint(self, replica, redis_mock):
+        request = _fake_request(redis_mock, method="POST", user_id=None)
+        request.state.user_id = 7
+        await db.mark_write(request)
+        redis_mock.set.assert_awaited_once_with("read-your-writes:7", 1, px=5000)
+
+    @pytest.mark.asyncio
+    async def test_pinning_disabled(self, replica, redis_mock, monkeypatch):
+        monkeypatch.setattr(CONFIG, "sql_read_your_writes", 0.0)
+        await db.mark_write(_fake_request(redis_mock, method="POST"))
+        sessionmaker = await db.read_sessionmaker(_fake_request(redis_mock))
+        assert sessionmaker is db.async_read_session
+        redis_mock.set.assert_not_called()
+        redis_mock.exists.assert_not_called()
+
+    @pytest.mark.asyncio
+    async def test_anonymous_reads_use_replica(self, replica, redis_mock):
+        await db.mark_write(_fake_request(redis_mock, method="POST", user_id=None))
+        request = _fake_request(redis_mock, user_id=None)
+        assert await db.read_sessionmaker(request) is db.async_read_session
+        redis_mock.set.assert_not_called()
+
+    @pytest.mark.asyncio
+    async def test_invalid_token_uses_replica(self, replica, redis_mock):
+        request = _fake_request(redis_mock)
+        request.headers["Authorization"] = "Bearer not-a-jwt"
+        assert await db.read_sessionmaker(request) is db.async_read_session
+        redis_mock.exists.assert_not_called()
+
+    @pytest.mark.asyncio
+    async def test_redis_error_reads_from_primary(self, replica, redis_mock):
+        redis_mock.set.side_effect = RedisError("down")
+        redis_mock.exists.side_effect = RedisError("down")
+        await db.mark_write(_fake_request(redis_mock, method="POST"))
+        sessionmaker = await db.read_sessionmaker(_fake_request(redis_mock))
+        assert sessionmaker is db.async_primary_read_session
@@ -0,0 +1,100 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from redis.exceptions import LockNotOwnedError
+from sqlalchemy import update
+
+from chessticulate_api import crud, db, models
+from chessticulate_api.app import expire_stale
+from chessticulate_api.config import CONFIG
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+class TestExpire:
+    @pytest.mark.asyncio
+    async def test_expire_challenges(self, session):
+        expired = await crud.expire_challenges(
+            session, _now() + timedelta(minutes=1), limit=1
+        )
+        # oldest first, in batches
+        assert expired == [{"id": 1, "requester_id": 3}]
+        expired = await crud.expire_challenges(
+            session, _now() + timedelta(minutes=1), limit=10
+        )
+        assert expired == [{"id": 2, "requester_id": 2}]
+
+        challenges = await crud.get_challenges(session, id_=1)
+        assert challenges[0].status == models.ChallengeRequestStatus.CANCELLED
+
+    @pytest.mark.asyncio
+    async def test_expire_challenges_keeps_recent(self, session):
+        expired = await crud.expire_challenges(
+            session, _now() - timedelta(minutes=1), limit=10
+        )
+        assert expired == []
+
+    @pytest.mark.asyncio
+    async def test_expire_invitations(self, session):
+        expired = await crud.expire_invitations(
+            session, _now() + timedelta(minutes=1), limit=10
+        )
+        # only the pending invitations
+        assert expired == [
+            {"id": 4, "from_id": 1, "to_id": 2},
+            {"id": 7, "from_id": 4, "to_id": 1},
+            {"id": 8, "from_id": 2, "to_id": 1},
+        ]
+
+
+class TestExpireStale:
+    @pytest.mark.asyncio
+    async def test_expire_stale(self, redis_mock, monkeypatch, restore_fake_data_after):
+        monkeypatch.setattr(CONFIG, "expiry_batch_size", 1)
+        async with db.async_session() as session:
+            async with session.begin():
+                await session.execute(
+                    update(models.ChallengeRequest)
+                    .where(models.ChallengeRequest.id_ == 1)
+                    .values(created_at=_now() - timedelta(hours=2))
+                )
+                await session.execute(
+                    update(models.Invitation)
+                    .where(models.Invitation.id_ == 4)
+                    .values(date_sent=_now() - timedelta(days=8))
+                )
+
+        assert await expire_stale(redis_mock) == (1, 1)
+
+        pipeline = redis_mock.pipeline.return_value
+        published = [call.args[0] for call in pipeline.publish.call_args_list]
+        assert published == ["user:3", "user:1", "user:2"]
+        redis_mock.lock.return_value.release.assert_awaited_once()
+
+        async with db.async_session() as session:
+            challenges = await crud.get_challenge_rows(
+                session, status=models.ChallengeRequestStatus.PENDING, fields=()
+            )
+        # the recent challenge stays open
+        assert [challenge["id"] for challenge in challenges] == [2]
+
+    @pytest.mark.asyncio
+    async def test_expire_stale_disabled(self, redis_mock, monkeypatch):
+        monkeypatch.setattr(CONFIG, "challenge_ttl", 0)
+        monkeypatch.setattr(CONFIG, "invitation_ttl", 0)
+        assert await expire_stale(redis_mock) == (0, 0)
+        redis_mock.pipeline.assert_not_called()
+
+    @pytest.mark.asyncio
+    async def test_expire_stale_outlives_its_lock(self, redis_mock, monkeypatch):
+        monkeypatch.setattr(CONFIG, "challenge_ttl", 0)
+        monkeypatch.setattr(CONFIG, "invitation_ttl", 0)
+        redis_mock.lock.return_value.release.side_effect = LockNotOwnedError
+        assert await expire_stale(redis_mock) == (0, 0)
+
+    @pytest.mark.asyncio
+    async def test_expire_stale_already_running(self, redis_mock):
+        redis_mock.lock.return_value.acquire.return_value = False
+        assert await expire_stale(redis_mock) is None
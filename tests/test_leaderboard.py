@@ -0,0 +1,212 @@
+from unittest.mock import AsyncMock
+
+import pytest
+from redis.exceptions import ConnectionError as RedisConnectionError
+from redis.exceptions import LockNotOwnedError
+
+from chessticulate_api import crud, leaderboard
+
+
+async def _wins(*wins):
+    for user_wins in wins:
+        yield user_wins
+
+
+@pytest.fixture
+def board(monkeypatch, redis_mock):
+    board = leaderboard.Leaderboard(redis_mock)
+    monkeypatch.setattr(leaderboard, "board", board)
+    return board
+
+
+class TestLeaderboard:
+    @pytest.mark.asyncio
+    async def test_page_ranks_ties_together(self, board):
+        # two users have more wins than the first user of the page
+        board._page_script.return_value = [
+            2,
+            ["5", "10", "7", "9", "3", "9", "8", "8"],
+        ]
+        page = await board.page(skip=2, limit=4)
+        assert page == [(3, 5, 10), (4, 7, 9), (4, 3, 9), (6, 8, 8)]
+        board._page_script.assert_awaited_once_with(
+            keys=["leaderboard:wins"], args=[2, 5]
+        )
+
+    @pytest.mark.asyncio
+    async def test_page_ends_at_placeholder(self, board):
+        board._page_script.return_value = [0, ["5", "1", "-", "-1"]]
+        assert await board.page(skip=0, limit=10) == [(1, 5, 1)]
+
+    @pytest.mark.asyncio
+    async def test_rank(self, board):
+        board._rank_script.return_value = ["3", 4]
+        assert await board.rank(1) == (5, 3)
+
+    @pytest.mark.asyncio
+    async def test_rank_without_wins(self, board):
+        # every user with a win ranks above
+        board._rank_script.return_value = [None, 7]
+        assert await board.rank(1) == (8, 0)
+
+    @pytest.mark.asyncio
+    async def test_not_built(self, board):
+        board._page_script.return_value = None
+        board._rank_script.return_value = None
+        with pytest.raises(leaderboard.NotBuiltError):
+            await board.page(skip=0, limit=10)
+        with pytest.raises(leaderboard.NotBuiltError):
+            await board.rank(1)
+
+    @pytest.mark.asyncio
+    async def test_record_falls_back_on_redis_errors(self, board):
+        board._record_script.side_effect = RedisConnectionError
+        await board.record({1: 2})
+        board._record_script.assert_awaited_once_with(
+            keys=["leaderboard:wins", "leaderboard:wins:next"], args=["1", "2"]
+        )
+
+    @pytest.mark.asyncio
+    async def test_rebuild_leaderboard(self, session, board):
+        assert await crud.rebuild_leaderboard(session, board) == 2
+
+        redis = board.redis
+        # only users with a win are added, and never lower wins recorded meanwhile
+        redis.zadd.assert_any_await("leaderboard:wins:next", {5: 2, 6: 1}, gt=True)
+        redis.rename.assert_awaited_once_with(
+            "leaderboard:wins:next", "leaderboard:wins"
+        )
+        redis.lock.return_value.release.assert_awaited_once()
+
+    @pytest.mark.asyncio
+    async def test_rebuild_already_running(self, board):
+        board.redis.lock.return_value.acquire.return_value = False
+        assert await board.rebuild(AsyncMock()) is None
+        board.redis.rename.assert_not_awaited()
+
+    @pytest.mark.asyncio
+    async def test_rebuild_outlives_its_lock(self, session, board):
+        board.redis.lock.return_value.release.side_effect = LockNotOwnedError
+        assert await crud.rebuild_leaderboard(session, board) == 2
+
+    @pytest.mark.asyncio
+    async def test_rebuild_lost_its_lock(self, session, board):
+        # another rebuild took the lock over, and is writing the next key now
+        lock = board.redis.lock.return_value
+        lock.reacquire.side_effect = LockNotOwnedError
+        lock.owned.return_value = False
+        assert await crud.rebuild_leaderboard(session, board) is None
+
+        board.redis.rename.assert_not_awaited()
+        board.redis.delete.assert_awaited_once_with("leaderboard:wins:next")
+        lock.release.assert_not_awaited()
+
+
+class TestLeaderboardEndpoints:
+    @pytest.mark.asyncio
+    @pytest.mark.max_queries(2)
+    async def test_get_leaderboard(self, client, token, board):
+        board._page_script.return_value = [0, ["5", "2", "6", "1"]]
+        response = await client.get(
+            "/leaderboard", headers={"Authorization": f"Bearer {token}"}
+        )
+        assert response.status_code == 200
+        assert response.json() == [
+            {"rank": 1, "user_id": 5, "username": "fakeuser5", "wins": 2},
+            {"rank": 2, "user_id": 6, "username": "fakeuser6", "wins": 1},
+        ]
+
+    @pytest.mark.asyncio
+    async def test_get_leaderboard_unavailable(self, client, token, board):
+        board._page_script.return_value = None
+        response = await client.get(
+            "/leaderboard", headers={"Authorization": f"Bearer {token}"}
+        )
+        assert response.status_code == 503
+
+    @pytest.mark.asyncio
+    async def test_get_leaderboard_not_set_up(self, client, token, monkeypatch):
+        monkeypatch.setattr(leaderboard, "board", None)
+        response = await client.get(
+            "/leaderboard", headers={"Authorization": f"Bearer {token}"}
+        )
+        assert response.status_code == 503
+
+    @pytest.mark.asyncio
+    @pytest.mark.max_queries(1)
+    async def test_get_rank(self, client, token, board):
+        board._rank_script.return_value = ["2", 0]
+        response = await client.get(
+            "/users/5/rank", headers={"Authorization": f"Bearer {token}"}
+        )
+        assert response.status_code == 200
+        assert response.json() == {"user_id": 5, "rank": 1, "wins": 2}
+
+    @pytest.mark.asyncio
+    async def test_get_rank_user_does_not_exist(self, client, token, board):
+        board._rank_script.return_value = [None, 2]
+        response = await client.get(
+            "/users/42069/rank", headers={"Authorization": f"Bearer {token}"}
+        )
+        assert response.status_code == 404
+
+    @pytest.mark.asyncio
+    async def test_forfeit_records_wins(
+        self, client, token, board, restore_fake_data_after
+    ):
+        response = await client.post(
+            "/games/1/forfeit", headers={"Authorization": f"Bearer {token}"}
+        )
+        assert response.status_code == 200
+        board._record_script.assert_awaited_once_with(
+            keys=["leaderboard:wins", "leaderboard:wins:next"], args=["2", "1"]
+        )
+
+    @pytest.mark.asyncio
+    async def test_delete_user_removes_them(
+        self, client, token, board, restore_fake_data_after
+    ):
+        response = await client.delete(
+            "/users/self", headers={"Authorization": f"Bearer {token}"}
+        )
+        assert response.status_code == 204
+        board.redis.zrem.assert_any_await("leaderboard:wins", 1)
+
+
+class TestLeaderboardScripts:
+    @pytest.fixture
+    def lua_board(self, lua_redis):
+        return leaderboard.Leaderboard(lua_redis)
+
+    @pytest.mark.asyncio
+    async def test_not_built(self, lua_board):
+        await lua_board.record({5: 2})
+        assert not await lua_board.is_built()
+        with pytest.raises(leaderboard.NotBuiltError):
+            await lua_board.page(skip=0, limit=10)
+        with pytest.raises(leaderboard.NotBuiltError):
+            await lua_board.rank(5)
+
+    @pytest.mark.asyncio
+    async def test_page_and_rank(self, lua_board):
+        assert await lua_board.rebuild(_wins((5, 2), (6, 1), (7, 2))) == 3
+
+        assert await lua_board.page(skip=0, limit=10) == [
+            (1, 7, 2),
+            (1, 5, 2),
+            (3, 6, 1),
+        ]
+        assert await lua_board.page(skip=1, limit=2) == [(1, 5, 2), (3, 6, 1)]
+        assert await lua_board.page(skip=3, limit=2) == []
+        assert await lua_board.rank(6) == (3, 1)
+        # users without wins rank after every user with some
+        assert await lua_board.rank(1) == (4, 0)
+
+    @pytest.mark.asyncio
+    async def test_record_only_raises_wins(self, lua_board):
+        await lua_board.rebuild(_wins())
+        await lua_board.record({5: 3, 6: 1})
+        # an older count recorded late
+        await lua_board.record({5: 2})
+        assert await lua_board.rank(5) == (1, 3)
+        assert await lua_board.rank(6) == (2, 1)
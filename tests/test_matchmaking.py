@@ -0,0 +1,238 @@
+from unittest.mock import AsyncMock
+
+import pytest
+from redis.exceptions import LockNotOwnedError
+from sqlalchemy.exc import OperationalError
+
+from chessticulate_api import crud, matchmaking, models, query_stats
+from chessticulate_api.app import match_players
+from chessticulate_api.matchmaking import Player
+
+
+@pytest.fixture
+def queue(monkeypatch, redis_mock):
+    queue = matchmaking.MatchmakingQueue(redis_mock)
+    monkeypatch.setattr(matchmaking, "queue", queue)
+    return queue
+
+
+class TestPairPlayers:
+    def test_pairs_neighbours(self):
+        players = [Player(i, 1000 + i, None) for i in range(5)]
+        assert matchmaking.pair_players(players) == [
+            (players[0], players[1]),
+            (players[2], players[3]),
+        ]
+
+    def test_respects_both_windows(self):
+        players = [
+            Player(1, 1000, None),
+            Player(2, 1200, 100),
+            Player(3, 1250, None),
+            Player(4, 1600, 500),
+        ]
+        # 1 and 2 are too far apart for 2, 3 and 4 are within 4's window
+        assert matchmaking.pair_players(players) == [
+            (players[1], players[2]),
+        ]
+
+    def test_skips_unpairable_player(self):
+        players = [Player(1, 1000, 50), Player(2, 1500, None), Player(3, 1510, None)]
+        assert matchmaking.pair_players(players) == [(players[1], players[2])]
+
+
+class TestMatchmakingQueue:
+    @pytest.mark.asyncio
+    async def test_join(self, queue):
+        await queue.join("CHESS", Player(1, 1500.0, None))
+        queue._join_script.assert_awaited_once_with(
+            keys=["matchmaking:windows", "matchmaking:CHESS", "matchmaking:CHESS"],
+            args=[1, 1500.0, ""],
+        )
+
+    @pytest.mark.asyncio
+    async def test_leave(self, queue):
+        queue._leave_script.return_value = 0
+        assert not await queue.leave(1)
+
+    @pytest.mark.asyncio
+    async def test_pair_takes_pairs_still_queued(self, queue):
+        queue.redis.zrange.return_value = [
+            ("1", 1500.0),
+            ("2", 1510.0),
+            ("3", 1600.0),
+            ("4", 1650.0),
+        ]
+        queue.redis.hmget.return_value = ["", "", "200", ""]
+        # player 4 left meanwhile
+        queue._take_script.return_value = [1]
+
+        assert await queue.pair() == [
+            ("CHESS", Player(1, 1500.0, None), Player(2, 1510.0, None))
+        ]
+        queue._take_script.assert_awaited_once_with(
+            keys=["matchmaking:windows", "matchmaking:CHESS"], args=[1, 2, 3, 4]
+        )
+        queue.redis.lock.return_value.release.assert_awaited_once()
+
+    @pytest.mark.asyncio
+    async def test_pair_outlives_its_lock(self, queue):
+        queue.redis.lock.return_value.release.side_effect = LockNotOwnedError
+        queue.redis.zrange.return_value = [("1", 1500.0), ("2", 1510.0)]
+        queue.redis.hmget.return_value = ["", ""]
+        queue._take_script.return_value = [1]
+
+        assert await queue.pair() == [
+            ("CHESS", Player(1, 1500.0, None), Player(2, 1510.0, None))
+        ]
+
+    @pytest.mark.asyncio
+    async def test_pair_already_running(self, queue):
+        queue.redis.lock.return_value.acquire.return_value = False
+        assert await queue.pair() is None
+        queue.redis.zrange.assert_not_awaited()
+
+
+class TestCreateMatches:
+    @pytest.mark.asyncio
+    async def test_create_matches(self, session):
+        stats = query_stats.QueryStats()
+        token = query_stats._stats.set(stats)
+        try:
+            games = await crud.create_matches(
+                session, [("CHESS", 1, 2), ("CHESS", 3, 5), ("CHESS", 6, 2)]
+            )
+        finally:
+            query_stats._stats.reset(token)
+
+        # inserts of the challenges and games, and an update of the challenges
+        assert stats.count == 3
+        assert [{game["white"], game["black"]} for game in games] == [
+            {1, 2},
+            {3, 5},
+            {6, 2},
+        ]
+        challenges = await crud.get_challenge_rows(
+            session, fulfilled_by=5, fields=("fulfilled_by", "game_id", "status")
+        )
+        assert len(challenges) == 1
+        assert challenges[0]["game_id"] == games[1]["id"]
+        assert challenges[0]["status"] == models.ChallengeRequestStatus.ACCEPTED
+
+
+class TestMatchPlayers:
+    @pytest.mark.asyncio
+    async def test_match_players_notifies_both(self, queue, restore_fake_data_after):
+        queue.pair = AsyncMock(
+            return_value=[("CHESS", Player(1, 1500, None), Player(2, 1500, None))]
+        )
+        pipeline = queue.redis.pipeline.return_value
+        pipeline.execute = AsyncMock()
+
+        assert await match_players(queue) == 1
+
+        channels = sorted(call.args[0] for call in pipeline.publish.call_args_list)
+        assert channels == ["user:1", "user:2"]
+        pipeline.execute.assert_awaited_once()
+
+    @pytest.mark.asyncio
+    async def test_match_players_requeues_on_failure(self, queue, monkeypatch):
+        matches = [("CHESS", Player(1, 1500, None), Player(2, 1500, None))]
+        queue.pair = AsyncMock(return_value=matches)
+        queue.join = AsyncMock()
+        monkeypatch.setattr(
+            crud,
+            "create_matches",
+            AsyncMock(side_effect=OperationalError("INSERT", {}, Exception())),
+        )
+
+        with pytest.raises(OperationalError):
+            await match_players(queue)
+        assert queue.join.await_count == 2
+
+
+class TestQueueEndpoints:
+    @pytest.mark.asyncio
+    @pytest.mark.max_queries(2)
+    async def test_join_queue(self, client, token, queue):
+        response = await client.post(
+            "/challenges/queue",
+            json={"rating_window": 200},
+            headers={"Authorization": f"Bearer {token}"},
+        )
+        assert response.status_code == 202
+        assert response.json() == {
+            "game_type": "CHESS",
+            "rating": 1500.0,
+            "rating_window": 200.0,
+        }
+        queue._join_script.assert_awaited_once()
+
+    @pytest.mark.asyncio
+    async def test_join_queue_without_body(self, client, token, queue):
+        response = await client.post(
+            "/challenges/queue", headers={"Authorization": f"Bearer {token}"}
+        )
+        assert response.status_code == 202
+        assert response.json()["rating_window"] is None
+
+    @pytest.mark.asyncio
+    async def test_join_queue_not_set_up(self, client, token, monkeypatch):
+        monkeypatch.setattr(matchmaking, "queue", None)
+        response = await client.post(
+            "/challenges/queue", headers={"Authorization": f"Bearer {token}"}
+        )
+        assert response.status_code == 503
+
+    @pytest.mark.asyncio
+    async def test_leave_queue_not_queued(self, client, token, queue):
+        queue._leave_script.return_value = 0
+        response = await client.delete(
+            "/challenges/queue", headers={"Authorization": f"Bearer {token}"}
+        )
+        assert response.status_code == 404
+
+
+class TestMatchmakingScripts:
+    @pytest.fixture
+    def lua_queue(self, lua_redis):
+        return matchmaking.MatchmakingQueue(lua_redis)
+
+    @pytest.mark.asyncio
+    async def test_join_and_leave(self, lua_queue):
+        await lua_queue.join("CHESS", Player(1, 1500.0, None))
+        await lua_queue.join("CHESS", Player(2, 1510.0, 100.0))
+        # joining again replaces the earlier entry
+        await lua_queue.join("CHESS", Player(2, 1520.0, 50.0))
+        assert await lua_queue._players("CHESS", 10) == [
+            Player(1, 1500.0, None),
+            Player(2, 1520.0, 50.0),
+        ]
+
+        assert await lua_queue.leave(2)
+        assert not await lua_queue.leave(2)
+        assert await lua_queue._players("CHESS", 10) == [Player(1, 1500.0, None)]
+        assert await lua_queue.redis.hkeys("matchmaking:windows") == ["1"]
+
+    @pytest.mark.asyncio
+    async def test_pair_takes_pairs_still_queued(self, lua_queue):
+        for user_id in range(1, 5):
+            await lua_queue.join("CHESS", Player(user_id, 1500.0 + user_id, None))
+        await lua_queue.leave(4)
+
+        assert await lua_queue._take_script(
+            keys=["matchmaking:windows", "matchmaking:CHESS"], args=[1, 2, 3, 4]
+        ) == [1]
+        assert await lua_queue._players("CHESS", 10) == [Player(3, 1503.0, None)]
+        assert await lua_queue.pair() == []
+
+    @pytest.mark.asyncio
+    async def test_pair(self, lua_queue):
+        await lua_queue.join("CHESS", Player(1, 1500.0, None))
+        await lua_queue.join("CHESS", Player(2, 1550.0, 100.0))
+        await lua_queue.join("CHESS", Player(3, 1900.0, None))
+
+        assert await lua_queue.pair() == [
+            ("CHESS", Player(1, 1500.0, None), Player(2, 1550.0, 100.0))
+        ]
+        assert await lua_queue._players("CHESS", 10) == [Player(3, 1900.0, None)]
@@ -0,0 +1,121 @@
+import json
+import os
+import subprocess
+import sys
+
+import httpx
+import pytest
+import respx
+from prometheus_client import REGISTRY
+
+from chessticulate_api import metrics, workers_service
+from chessticulate_api.config import CONFIG
+
+# run in a fresh interpreter, so prometheus_client picks up the multiprocess dir
+_WORKER = """
+from prometheus_client import Counter
+Counter("chess_test_requests", "test counter").inc({n})
+"""
+
+
+@pytest.fixture
+def multiproc_dir(monkeypatch, tmp_path):
+    monkeypatch.setattr(CONFIG, "prometheus_multiproc_dir", str(tmp_path))
+    # setenv first, so the variable is restored even if it was unset
+    monkeypatch.setenv("PROMETHEUS_MULTIPROC_DIR", "")
+    monkeypatch.delenv("PROMETHEUS_MULTIPROC_DIR")
+    yield tmp_path
+
+
+def _run_worker(path, n: int):
+    subprocess.run(
+        [sys.executable, "-c", _WORKER.format(n=n)],
+        env={**os.environ, "PROMETHEUS_MULTIPROC_DIR": str(path)},
+        check=True,
+    )
+
+
+class TestRender:
+    def test_render_single_process(self, monkeypatch):
+        monkeypatch.setattr(CONFIG, "prometheus_multiproc_dir", None)
+        content, media_type = metrics.render()
+        assert media_type.startswith("text/plain")
+        assert b"python_info" in content
+
+    def test_render_aggregates_workers(self, multiproc_dir):
+        _run_worker(multiproc_dir, 2)
+        _run_worker(multiproc_dir, 3)
+
+        content, _ = metrics.render()
+        assert b"chess_test_requests_total 5.0" in content
+
+
+def _sample(name: str, labels: dict[str, str]) -> float:
+    return REGISTRY.get_sample_value(name, labels) or 0.0
+
+
+class TestLatencyMetrics:
+    @pytest.mark.asyncio
+    async def test_route_and_crud_latency_exposed(self, client, token, monkeypatch):
+        monkeypatch.setattr(CONFIG, "prometheus_multiproc_dir", None)
+        await client.get("/users", headers={"Authorization": f"Bearer {token}"})
+
+        content = (await client.get("/metrics")).text
+        assert 'http_request_duration_seconds_count{handler="/users"' in content
+        assert 'http_requests_inprogress{handler="/users"' in content
+        assert 'chess_crud_duration_seconds_count{function="get_user_rows"}' in content
+
+    @pytest.mark.parametrize(
+        "status, content, outcome",
+        [
+            (200, {"status": "MOVEOK", "states": {}, "fen": "fen"}, "ok"),
+            (400, {"message": "invalid move"}, "rejected"),
+            (500, {"message": "Internal Server Error"}, "error"),
+        ],
+    )
+    @pytest.mark.asyncio
+    async def test_workers_latency_by_outcome(self, status, content, outcome):
+        labels = {"endpoint": "move", "outcome": outcome}
+        before = _sample("chess_workers_request_duration_seconds_count", labels)
+
+        with respx.mock:
+            respx.post(CONFIG.workers_base_url).mock(
+                return_value=httpx.Response(status, content=json.dumps(content))
+            )
+            try:
+                await workers_service.do_move(fen="fen", move="move", states={})
+            except (
+                workers_service.ClientRequestError,
+                workers_service.ServerRequestError,
+            ):
+                pass
+
+        after = _sample("chess_workers_request_duration_seconds_count", labels)
+        assert after == before + 1
+
+
+class TestSetupMultiprocessDir:
+    def test_setup_removes_stale_files(self, multiproc_dir):
+        stale = multiproc_dir / "counter_123.db"
+        stale.write_bytes(b"")
+
+        assert metrics.setup_multiprocess_dir() == str(multiproc_dir)
+        assert not stale.exists()
+        assert os.environ["PROMETHEUS_MULTIPROC_DIR"] == str(multiproc_dir)
+
+
+class TestSweepDeadWorkers:
+    def test_sweep_removes_dead_worker_gauges(self, multiproc_dir):
+        # pid of a process which has already exited
+        proc = subprocess.Popen([sys.executable, "-c", ""])
+        proc.wait()
+        dead_pid = proc.pid
+
+        live = multiproc_dir / f"gauge_livesum_{dead_pid}.db"
+        counter = multiproc_dir / f"counter_{dead_pid}.db"
+        live.write_bytes(b"")
+        counter.write_bytes(b"")
+
+        metrics.sweep_dead_workers()
+        assert not live.exists()
+        assert counter.exists()
@@ -0,0 +1,206 @@
+import pytest
+import pytest_asyncio
+from sqlalchemy import inspect
+
+from chessticulate_api import db, migrations, rating
+
+# tables as models.init_db created them before migrations existed, frozen so that
+# later changes to the models don't leak into the unversioned database
+BASELINE_DDL = (
+    """
+    CREATE TABLE users (
+        id INTEGER NOT NULL,
+        name VARCHAR NOT NULL,
+        password VARCHAR,
+        email VARCHAR,
+        deleted BOOLEAN DEFAULT 0 NOT NULL,
+        date_joined DATETIME DEFAULT CURRENT_TIMESTAMP NOT NULL,
+        wins INTEGER DEFAULT '0' NOT NULL,
+        draws INTEGER DEFAULT '0' NOT NULL,
+        losses INTEGER DEFAULT '0' NOT NULL,
+        PRIMARY KEY (id),
+        UNIQUE (email)
+    )
+    """,
+    "CREATE UNIQUE INDEX ix_users_name ON users (name)",
+    """
+    CREATE TABLE invitations (
+        id INTEGER NOT NULL,
+        date_sent DATETIME DEFAULT CURRENT_TIMESTAMP NOT NULL,
+        date_answered DATETIME,
+        from_id INTEGER NOT NULL,
+        to_id INTEGER NOT NULL,
+        game_type VARCHAR(5) NOT NULL,
+        status VARCHAR(9) DEFAULT 'PENDING' NOT NULL,
+        PRIMARY KEY (id),
+        FOREIGN KEY(from_id) REFERENCES users (id),
+        FOREIGN KEY(to_id) REFERENCES users (id)
+    )
+    """,
+    """
+    CREATE TABLE challenge_requests (
+        id INTEGER NOT NULL,
+        requester_id INTEGER NOT NULL,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP NOT NULL,
+        game_type VARCHAR(5) DEFAULT 'CHESS' NOT NULL,
+        status VARCHAR(9) DEFAULT 'PENDING' NOT NULL,
+        fulfilled_by INTEGER,
+        game_id INTEGER,
+        PRIMARY KEY (id),
+        FOREIGN KEY(requester_id) REFERENCES users (id),
+        FOREIGN KEY(fulfilled_by) REFERENCES users (id),
+        FOREIGN KEY(game_id) REFERENCES games (id)
+    )
+    """,
+    """
+    CREATE TABLE games (
+        id INTEGER NOT NULL,
+        game_type VARCHAR(5) DEFAULT 'CHESS' NOT NULL,
+        date_started DATETIME DEFAULT CURRENT_TIMESTAMP NOT NULL,
+        invitation_id INTEGER,
+        challenge_id INTEGER,
+        last_active DATETIME DEFAULT CURRENT_TIMESTAMP NOT NULL,
+        white INTEGER NOT NULL,
+        black INTEGER NOT NULL,
+        whomst INTEGER NOT NULL,
+        winner INTEGER,
+        is_active BOOLEAN DEFAULT 1 NOT NULL,
+        result VARCHAR(20),
+        fen VARCHAR DEFAULT 'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1'
+            NOT NULL,
+        states VARCHAR DEFAULT '{}' NOT NULL,
+        PRIMARY KEY (id),
+        CONSTRAINT ck_game_invitation_or_challenge
+            CHECK ((invitation_id IS NOT NULL) OR (challenge_id IS NOT NULL)),
+        FOREIGN KEY(invitation_id) REFERENCES invitations (id),
+        FOREIGN KEY(challenge_id) REFERENCES challenge_requests (id),
+        FOREIGN KEY(white) REFERENCES users (id),
+        FOREIGN KEY(black) REFERENCES users (id),
+        FOREIGN KEY(whomst) REFERENCES users (id),
+        FOREIGN KEY(winner) REFERENCES users (id)
+    )
+    """,
+    """
+    CREATE TABLE moves (
+        id INTEGER NOT NULL,
+        user_id INTEGER NOT NULL,
+        game_id INTEGER NOT NULL,
+        timestamp DATETIME DEFAULT CURRENT_TIMESTAMP NOT NULL,
+        movestr VARCHAR NOT NULL,
+        fen VARCHAR NOT NULL,
+        PRIMARY KEY (id),
+        FOREIGN KEY(user_id) REFERENCES users (id),
+        FOREIGN KEY(game_id) REFERENCES games (id)
+    )
+    """,
+)
+
+
+@pytest_asyncio.fixture
+async def file_engine(monkeypatch, tmp_path):
+    engine = db.create_engine(f"sqlite+aiosqlite:///{tmp_path / 'chess.db'}")
+    monkeypatch.setattr(db, "async_engine", engine)
+    yield engine
+    await engine.dispose()
+
+
+async def _indexes(engine, table: str) -> set[str]:
+    async with engine.connect() as conn:
+        return await conn.run_sync(
+            lambda c: {ix["name"] for ix in inspect(c).get_indexes(table)}
+        )
+
+
+class TestMigrate:
+    @pytest.mark.asyncio
+    async def test_migrate_empty_database(self, file_engine):
+        assert await migrations.migrate() == (None, migrations.LATEST_VERSION)
+        assert "ix_moves_game_id" in await _indexes(file_engine, "moves")
+        await migrations.check_version()
+
+    @pytest.mark.asyncio
+    async def test_migrate_is_idempotent(self, file_engine):
+        await migrations.migrate()
+        assert await migrations.migrate() == (
+            migrations.LATEST_VERSION,
+            migrations.LATEST_VERSION,
+        )
+
+    @pytest.mark.asyncio
+    async def test_migrate_unversioned_database(self, file_engine):
+        async with file_engine.begin() as conn:
+            for ddl in BASELINE_DDL:
+                await conn.exec_driver_sql(ddl)
+            await conn.exec_driver_sql("INSERT INTO users (name) VALUES ('user1')")
+
+        assert await migrations.migrate() == (1, migrations.LATEST_VERSION)
+        assert "ix_moves_game_id" in await _indexes(file_engine, "moves")
+        assert "ix_users_rating" in await _indexes(file_engine, "users")
+        assert "ix_challenge_requests_status_created_at" in await _indexes(
+            file_engine, "challenge_requests"
+        )
+        assert "ix_invitations_status_date_sent" in await _indexes(
+            file_engine, "invitations"
+        )
+        async with file_engine.connect() as conn:
+            # existing users start at the initial rating
+            result = await conn.exec_driver_sql("SELECT rating FROM users")
+            assert result.scalar_one() == rating.INITIAL_RATING
+        await migrations.check_version()
+
+    @pytest.mark.asyncio
+    async def test_migrate_adds_users_rating(self, file_engine):
+        await migrations.migrate()
+        async with file_engine.begin() as conn:
+            await conn.exec_driver_sql("DROP INDEX ix_users_rating")
+            await conn.exec_driver_sql("ALTER TABLE users DROP COLUMN rating")
+            await conn.execute(migrations.schema_version.update().values(version=3))
+
+        assert await migrations.migrate() == (3, migrations.LATEST_VERSION)
+        assert "ix_users_rating" in await _indexes(file_engine, "users")
+
+    @pytest.mark.asyncio
+    async def test_migrate_adds_status_indexes(self, file_engine):
+        await migrations.migrate()
+        async with file_engine.begin() as conn:
+            await conn.exec_driver_sql(
+                "DROP INDEX ix_challenge_requests_status_created_at"
+            )
+            await conn.exec_driver_sql("DROP INDEX ix_invitations_status_date_sent")
+            await conn.execute(migrations.schema_version.update().values(version=4))
+
+        assert await migrations.migrate() == (4, migrations.LATEST_VERSION)
+        assert "ix_challenge_requests_status_created_at" in await _indexes(
+            file_engine, "challenge_requests"
+        )
+        assert "ix_invitations_status_date_sent" in await _indexes(
+            file_engine, "invitations"
+        )
+
+
+class TestCheckVersion:
+    @pytest.mark.asyncio
+    async def test_check_version_fails_not_migrated(self, file_engine):
+        with pytest.raises(migrations.SchemaVersionError):
+            await migrations.check_version()
+
+    @pytest.mark.asyncio
+    async def test_check_version_fails_behind(self, file_engine):
+        await migrations.migrate()
+        async with file_engine.begin() as conn:
+            await conn.execute(migrations.schema_version.update().values(version=1))
+
+        with pytest.raises(migrations.SchemaVersionError):
+            await migrations.check_version()
+
+    @pytest.mark.asyncio
+    async def test_check_version_accepts_newer_schema(self, file_engine):
+        newer = migrations.LATEST_VERSION + 1
+        await migrations.migrate()
+        async with file_engine.begin() as conn:
+            await conn.execute(migrations.schema_version.update().values(version=newer))
+
+        await migrations.check_version()
+        # an older release migrating leaves the newer version in place
+        assert await migrations.migrate() == (newer, newer)
+        await migrations.check_version()
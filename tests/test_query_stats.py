@@ -0,0 +1,53 @@
+import logging
+
+import pytest
+from prometheus_client import REGISTRY
+
+from chessticulate_api.config import CONFIG
+
+
+def _sample(name: str, labels: dict[str, str]) -> float:
+    return REGISTRY.get_sample_value(name, labels) or 0.0
+
+
+class TestQueryStats:
+    @pytest.mark.asyncio
+    async def test_debug_headers_off_by_default(self, client, token):
+        response = await client.get(
+            "/users", headers={"Authorization": f"Bearer {token}"}
+        )
+        assert "X-SQL-Queries" not in response.headers
+
+    @pytest.mark.asyncio
+    async def test_debug_headers(self, client, token, monkeypatch):
+        monkeypatch.setattr(CONFIG, "sql_debug_headers", True)
+        response = await client.get(
+            "/users", headers={"Authorization": f"Bearer {token}"}
+        )
+        # authentication and the user list
+        assert response.headers["X-SQL-Queries"] == "2"
+        assert response.headers["X-SQL-Max-Repeats"] == "1"
+        assert float(response.headers["X-SQL-Time-Ms"]) > 0
+
+    @pytest.mark.asyncio
+    async def test_queries_recorded_by_route(self, client, token):
+        labels = {"handler": "/users/self"}
+        count = _sample("chess_request_sql_queries_count", labels)
+        total = _sample("chess_request_sql_queries_sum", labels)
+
+        await client.get("/users/self", headers={"Authorization": f"Bearer {token}"})
+
+        assert _sample("chess_request_sql_queries_count", labels) == count + 1
+        assert _sample("chess_request_sql_queries_sum", labels) == total + 2
+
+    @pytest.mark.asyncio
+    async def test_repeated_statement_logged(self, client, token, monkeypatch, caplog):
+        monkeypatch.setattr(CONFIG, "sql_repeated_query_threshold", 0)
+        labels = {"handler": "/users"}
+        before = _sample("chess_request_sql_repeated_total", labels)
+
+        with caplog.at_level(logging.WARNING, logger="chessticulate_api.query_stats"):
+            await client.get("/users", headers={"Authorization": f"Bearer {token}"})
+
+        assert "likely an N+1 query" in caplog.text
+        assert _sample("chess_request_sql_repeated_total", labels) == before + 1
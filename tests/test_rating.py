@@ -0,0 +1,82 @@
+import pytest
+from sqlalchemy import update
+
+from chessticulate_api import crud, models, rating
+from chessticulate_api.config import CONFIG
+
+
+async def _ratings(session) -> dict[int, float]:
+    rows = await crud.get_user_rows(session, fields=["rating"])
+    return {row["id"]: row["rating"] for row in rows}
+
+
+class TestRating:
+    def test_expected_score(self):
+        assert rating.expected_score(1500, 1500) == 0.5
+        assert rating.expected_score(1900, 1500) == pytest.approx(10 / 11)
+
+    def test_white_score(self):
+        assert rating.white_score(1, 1) == 1.0
+        assert rating.white_score(1, 2) == 0.0
+        assert rating.white_score(1, None) == 0.5
+
+    def test_update_moves_both_ratings_the_same_amount(self):
+        white, black = rating.update(1500, 1500, 1.0)
+        assert white == 1500 + CONFIG.rating_k_factor / 2
+        assert black == 1500 - CONFIG.rating_k_factor / 2
+
+    def test_update_draw_favors_lower_rated_player(self):
+        white, black = rating.update(1900, 1500, 0.5)
+        assert white < 1900
+        assert black > 1500
+        assert white + black == pytest.approx(3400)
+
+
+class TestGameRatings:
+    @pytest.mark.asyncio
+    async def test_checkmate_updates_ratings(self, session):
+        await crud.do_move(session, 1, 1, 2, "e4", "{}", "fen", "CHECKMATE")
+        ratings = await _ratings(session)
+        assert ratings.pop(1) == 1500 + CONFIG.rating_k_factor / 2
+        assert ratings.pop(2) == 1500 - CONFIG.rating_k_factor / 2
+        assert set(ratings.values()) == {rating.INITIAL_RATING}
+
+    @pytest.mark.asyncio
+    async def test_draw_between_equals_keeps_ratings(self, session):
+        await crud.do_move(session, 1, 1, 2, "e4", "{}", "fen", "STALEMATE")
+        assert set((await _ratings(session)).values()) == {rating.INITIAL_RATING}
+
+    @pytest.mark.asyncio
+    async def test_forfeit_rates_once(self, session):
+        game = (await crud.get_games(session, id_=3))[0]
+        await crud.forfeit(session, 2, game)
+        await crud.forfeit(session, 3, game)
+
+        ratings = await _ratings(session)
+        assert ratings[2] == 1500 - CONFIG.rating_k_factor / 2
+        assert ratings[3] == 1500 + CONFIG.rating_k_factor / 2
+
+    @pytest.mark.asyncio
+    async def test_recompute_ratings(self, session):
+        await crud.do_move(session, 1, 1, 2, "e4", "{}", "fen", "CHECKMATE")
+        game = (await crud.get_games(session, id_=3))[0]
+        await crud.forfeit(session, 2, game)
+        expected = await _ratings(session)
+
+        # ratings drifting from the game history are put back
+        await session.execute(update(models.User).values(rating=1234.0))
+        assert await crud.recompute_ratings(session, batch_size=1) == 2
+        assert await _ratings(session) == expected
+
+    @pytest.mark.asyncio
+    async def test_recompute_ratings_replays_in_order(self, session):
+        await crud.do_move(session, 1, 1, 2, "e4", "{}", "fen", "CHECKMATE")
+        game = (await crud.get_games(session, id_=3))[0]
+        await crud.forfeit(session, 3, game)
+        expected = await _ratings(session)
+        # user 2 lost to user 1 first, then gained more beating user 3 as the
+        # lower rated player
+        assert expected[2] > rating.INITIAL_RATING
+
+        await crud.recompute_ratings(session)
+        assert await _ratings(session) == expected
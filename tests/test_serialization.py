@@ -0,0 +1,50 @@
+import importlib
+import sys
+
+import pytest
+from fastapi.responses import JSONResponse, ORJSONResponse
+
+from chessticulate_api import serialization
+
+
+@pytest.fixture
+def without_orjson(monkeypatch):
+    # a None entry makes `import orjson` raise ImportError
+    monkeypatch.setitem(sys.modules, "orjson", None)
+    yield importlib.reload(serialization)
+    monkeypatch.undo()
+    importlib.reload(serialization)
+
+
+class TestSerialization:
+    def test_round_trip(self):
+        states = {"rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR": "1"}
+        assert serialization.loads(serialization.dumps(states)) == states
+
+    def test_dumps_compact(self):
+        assert serialization.dumps({"a": [1, 2]}) == '{"a":[1,2]}'
+
+    def test_default_response_orjson(self):
+        assert serialization.DefaultResponse is ORJSONResponse
+
+    def test_fallback_without_orjson(self, without_orjson):
+        assert without_orjson.DefaultResponse is JSONResponse
+        assert without_orjson.dumps({"a": [1, 2]}) == '{"a":[1,2]}'
+        assert without_orjson.loads('{"a":[1,2]}') == {"a": [1, 2]}
+
+    @pytest.mark.asyncio
+    async def test_endpoints_use_default_response(self, client, token, monkeypatch):
+        rendered = []
+        render = ORJSONResponse.render
+
+        def spy(self, content):
+            rendered.append(content)
+            return render(self, content)
+
+        monkeypatch.setattr(ORJSONResponse, "render", spy)
+        response = await client.get(
+            "/games", headers={"Authorization": f"Bearer {token}"}
+        )
+
+        assert response.status_code == 200
+        assert rendered == [response.json()]
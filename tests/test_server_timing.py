@@ -0,0 +1,72 @@
+from unittest.mock import AsyncMock
+
+import pytest
+import pytest_asyncio
+import respx
+from httpx import ASGITransport, AsyncClient, Response
+
+from chessticulate_api import server_timing
+from chessticulate_api.app import app
+from chessticulate_api.config import CONFIG
+
+
+@pytest_asyncio.fixture
+async def timed_client():
+    app.state.redis = AsyncMock(name="FakeRedis")
+    transport = ASGITransport(app=server_timing.ServerTimingMiddleware(app))
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        yield ac
+
+
+def _entries(response) -> dict[str, float]:
+    entries = {}
+    for entry in response.headers["Server-Timing"].split(", "):
+        name, dur = entry.split(";dur=")
+        entries[name] = float(dur)
+    return entries
+
+
+class TestServerTiming:
+    @pytest.mark.asyncio
+    async def test_move_breakdown(self, timed_client, token, restore_fake_data_after):
+        with respx.mock:
+            respx.post(CONFIG.workers_base_url).mock(
+                return_value=Response(
+                    200, json={"status": "MOVEOK", "fen": "abcdefg", "states": "{}"}
+                )
+            )
+            response = await timed_client.post(
+                "/games/1/move",
+                headers={"Authorization": f"Bearer {token}"},
+                json={"move": "e4"},
+            )
+
+        assert response.status_code == 200
+        entries = _entries(response)
+        assert set(entries) == {"auth", "db", "workers", "redis", "app"}
+        assert entries["app"] >= entries["workers"]
+
+    def test_nested_calls_counted_once(self, monkeypatch):
+        clock = iter(range(100))
+        monkeypatch.setattr(server_timing.time, "perf_counter", lambda: next(clock))
+        timings = server_timing._Timings()
+        token = server_timing._timings.set(timings)
+        try:
+            with server_timing.timer("db"):
+                with server_timing.timer("db"):
+                    pass
+        finally:
+            server_timing._timings.reset(token)
+
+        assert timings.durations == {"db": 1.0}
+
+    @pytest.mark.asyncio
+    async def test_disabled_by_default(self, client, token):
+        response = await client.get(
+            "/users", headers={"Authorization": f"Bearer {token}"}
+        )
+        assert "Server-Timing" not in response.headers
+
+    def test_header_value(self):
+        value = server_timing.header_value({"db": 0.0031, "workers": 0.041})
+        assert value == "db;dur=3.1, workers;dur=41.0"
@@ -0,0 +1,29 @@
+from chessticulate_api import usernames
+
+
+class TestUsernameCache:
+    def test_lookup(self):
+        cache = usernames.UsernameCache(10)
+        cache.update({1: "user1", 2: "user2"})
+        assert cache.lookup([1, 2, 3]) == ({1: "user1", 2: "user2"}, {3})
+
+    def test_evicts_least_recently_used(self):
+        cache = usernames.UsernameCache(2)
+        cache.update({1: "user1", 2: "user2"})
+        cache.lookup([1])
+        cache.update({3: "user3"})
+
+        assert len(cache) == 2
+        assert cache.lookup([1, 2, 3]) == ({1: "user1", 3: "user3"}, {2})
+
+    def test_discard(self):
+        cache = usernames.UsernameCache(10)
+        cache.update({1: "user1"})
+        cache.discard(1)
+        cache.discard(2)
+        assert cache.lookup([1]) == ({}, {1})
+
+    def test_size_zero_caches_nothing(self):
+        cache = usernames.UsernameCache(0)
+        cache.update({1: "user1"})
+        assert len(cache) == 0